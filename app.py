@@ -1,13 +1,124 @@
+import secrets
+import time
+from http.cookies import SimpleCookie
+
 import streamlit as st
+import streamlit.components.v1 as components
+from streamlit.web.server.websocket_headers import _get_websocket_headers
+from log_setup import setup_logging
 from utils import AIModel, format_chat_history
-from config import PAGE_CONFIG, PRESET_MODELS, DEFAULT_API_CONFIG
+from client import get_client
+from config import (
+    PAGE_CONFIG, PRESET_MODELS, DEFAULT_API_CONFIG, CONTEXT_CONFIG, RENDER_CONFIG, STORAGE_CONFIG, OUTPUT_CONFIG,
+    HEDGE_CONFIG, COMPARE_CONFIG
+)
+from buffer import content_bytes
+from cancel import CancelToken
+from context_window import CONTEXT_POLICIES
+from metrics import RequestSpan
+from render import BackgroundStream, ParallelStreams, RenderScheduler
+from storage import get_conversation_store
+
+run_started = time.perf_counter()
+
+OWNER_COOKIE = "think_ai_owner"  # 保存所有者密钥的Cookie
 
 # 配置页面
 st.set_page_config(**PAGE_CONFIG)
+setup_logging()
 
-# 初始化会话状态
-if "chat_history" not in st.session_state:
+store = get_conversation_store()
+
+def load_conversation(conversation_id):
+    """加载会话：只读取最近的消息，更早的消息在界面上按需加载"""
+    recent = store.load_page(conversation_id, limit=STORAGE_CONFIG["context_messages"])
+    st.session_state.conversation_id = conversation_id
+    st.session_state.chat_history = [{"role": m["role"], "content": m["content"]} for m in recent]
+    st.session_state.history_bytes = sum(content_bytes(m["content"]) for m in recent)
+    st.session_state.display_messages = recent[-STORAGE_CONFIG["page_size"]:]
+    st.session_state.display_limit = STORAGE_CONFIG["page_size"]
+    st.session_state.comparison = None
+    st.query_params["c"] = conversation_id
+
+def new_conversation():
+    """开始新会话：发送第一条消息时才写入存储，没有消息的会话不留下记录"""
+    st.session_state.conversation_id = None
     st.session_state.chat_history = []
+    st.session_state.history_bytes = 0
+    st.session_state.display_messages = []
+    st.session_state.display_limit = STORAGE_CONFIG["page_size"]
+    st.session_state.comparison = None
+    if "c" in st.query_params:
+        del st.query_params["c"]
+
+def append_to_history(message):
+    """追加一条消息：写入存储，并更新内存中的上下文和显示列表
+
+    内存中的历史超过条数或字节上限时移出较早的消息，它们仍可从存储中加载。
+    保持前缀稳定时一次多移出一部分，之后若干轮的请求前缀不变。
+    """
+    if st.session_state.conversation_id is None:
+        st.session_state.conversation_id = store.create_conversation(st.session_state.owner)
+        st.query_params["c"] = st.session_state.conversation_id
+    seq = store.append_message(st.session_state.conversation_id, message)
+    history = st.session_state.chat_history
+    history.append(message)
+    st.session_state.history_bytes += content_bytes(message["content"])
+    excess = len(history) - STORAGE_CONFIG["context_messages"]
+    max_bytes = OUTPUT_CONFIG["max_session_bytes"]
+    if CONTEXT_CONFIG["prefix_stable"]:
+        if excess > 0:
+            excess += int(STORAGE_CONFIG["context_messages"] * (1 - CONTEXT_CONFIG["trim_watermark"]))
+        if st.session_state.history_bytes > max_bytes:
+            max_bytes = int(max_bytes * CONTEXT_CONFIG["trim_watermark"])
+    while len(history) > 1 and (excess > 0 or st.session_state.history_bytes > max_bytes):
+        st.session_state.history_bytes -= content_bytes(history.pop(0)["content"])
+        excess -= 1
+    display = st.session_state.display_messages
+    display.append({"seq": seq, **message})
+    if len(display) > st.session_state.display_limit:
+        del display[:len(display) - st.session_state.display_limit]
+
+def session_model():
+    """本会话的模型：进程级共享客户端加上本会话的设置和上下文状态
+
+    会话中只保存设置（api_config）和上下文状态（model_state），
+    连接池、解析器和指标由所有会话共用，每次使用时创建的开销可以忽略。
+    """
+    return AIModel(st.session_state.api_config, state=st.session_state.model_state)
+
+def browser_owner():
+    """读取本浏览器Cookie中的所有者密钥，没有时返回None"""
+    try:
+        headers = _get_websocket_headers() or {}
+    except Exception:
+        # 不在Streamlit服务中运行（例如AppTest）
+        return None
+    cookie = SimpleCookie(headers.get("Cookie", ""))
+    return cookie[OWNER_COOKIE].value if OWNER_COOKIE in cookie else None
+
+# 会话所有者：每个浏览器一个随机密钥，保存在Cookie中而不是地址栏，刷新页面后仍能
+# 找回自己的会话；复制给别人的链接不带密钥，其他浏览器看不到也打不开这些会话
+if "owner" not in st.session_state:
+    st.session_state.owner = browser_owner()
+    if st.session_state.owner is None:
+        st.session_state.owner = secrets.token_urlsafe(16)
+        components.html(
+            f"<script>document.cookie = '{OWNER_COOKIE}={st.session_state.owner}; "
+            f"path=/; max-age=31536000; SameSite=Strict';</script>",
+            height=0
+        )
+if "u" in st.query_params:
+    # 旧版本放在地址栏中的密钥
+    del st.query_params["u"]
+
+# 初始化会话状态
+if "conversation_id" not in st.session_state:
+    conversation_id = st.query_params.get("c")
+    if conversation_id and store.has_conversation(conversation_id, st.session_state.owner):
+        load_conversation(conversation_id)
+    else:
+        new_conversation()
 
 if "api_config" not in st.session_state:
     st.session_state.api_config = DEFAULT_API_CONFIG.copy()
@@ -19,12 +130,27 @@ if "api_config" not in st.session_state:
 if "custom_models" not in st.session_state:
     st.session_state.custom_models = {}
 
-if "ai_model" not in st.session_state:
-    st.session_state.ai_model = AIModel(st.session_state.api_config)
+if "custom_model_windows" not in st.session_state:
+    st.session_state.custom_model_windows = {}  # 自定义模型ID -> 上下文窗口
+
+# 会话的第一次运行，用于区分冷启动和重新运行的耗时
+first_run = "model_state" not in st.session_state
+if first_run:
+    st.session_state.model_state = {}  # 上下文裁剪报告和前缀锚点，见AIModel
 
 if "current_request" not in st.session_state:
     st.session_state.current_request = None
 
+if "render_config" not in st.session_state:
+    st.session_state.render_config = RENDER_CONFIG.copy()
+
+if "prompt_cache_usage" not in st.session_state:
+    st.session_state.prompt_cache_usage = {"hit": 0, "miss": 0}  # 本会话上游前缀缓存命中/未命中的token数
+
+if "compare_mode" not in st.session_state:
+    st.session_state.compare_mode = False
+    st.session_state.compare_models = []  # 对比模式下选中的模型（显示名称）
+
 # 页面标题
 st.title("🤖 AI思考推理助手")
 
@@ -55,7 +181,6 @@ with st.sidebar:
                 "base_url": base_url,
                 "api_key": api_key
             })
-            st.session_state.ai_model.update_config(st.session_state.api_config)
     
     # 模型选择
     with st.expander("模型选择", expanded=True):
@@ -74,9 +199,29 @@ with st.sidebar:
         
         # 更新选中的模型
         selected_model_id = all_models[selected_model_name]
-        if selected_model_id != st.session_state.api_config["model"]:
+        context_window = st.session_state.custom_model_windows.get(selected_model_id) \
+            if "📝" in selected_model_name else None
+        if selected_model_id != st.session_state.api_config["model"] or \
+           context_window != st.session_state.api_config.get("context_window"):
             st.session_state.api_config["model"] = selected_model_id
-            st.session_state.ai_model.update_config(st.session_state.api_config)
+            st.session_state.api_config["context_window"] = context_window
+        
+        # 对比模式
+        st.session_state.compare_mode = st.checkbox(
+            "对比模式",
+            value=st.session_state.compare_mode,
+            help="同一问题同时发给多个模型，并排显示回答、首个token耗时和输出速度（对比结果不写入对话历史）"
+        )
+        
+        if st.session_state.compare_mode:
+            st.session_state.compare_models = st.multiselect(
+                "对比模型",
+                options=list(all_models.keys()),
+                default=[name for name in st.session_state.compare_models if name in all_models]
+                or list(all_models.keys())[:2],
+                max_selections=COMPARE_CONFIG["max_workers"],
+                help=f"最多同时对比{COMPARE_CONFIG['max_workers']}个模型"
+            )
         
         st.divider()
         
@@ -84,12 +229,21 @@ with st.sidebar:
         st.subheader("添加自定义模型")
         custom_model_name = st.text_input("模型名称", key="new_model_name")
         custom_model_id = st.text_input("模型ID", key="new_model_id")
+        custom_model_window = st.number_input(
+            "上下文长度",
+            min_value=1024,
+            max_value=1000000,
+            value=CONTEXT_CONFIG["default_window"],
+            key="new_model_window",
+            help="模型的上下文窗口大小（token），用于裁剪历史消息"
+        )
         
         col1, col2 = st.columns([1, 1])
         with col1:
             if st.button("➕ 添加模型", help="添加自定义模型"):
                 if custom_model_name and custom_model_id:
                     st.session_state.custom_models[custom_model_name] = custom_model_id
+                    st.session_state.custom_model_windows[custom_model_id] = custom_model_window
                     st.success(f"已添加模型: {custom_model_name}")
                     st.experimental_rerun()  # 重新运行以更新选择列表
                 else:
@@ -102,7 +256,6 @@ with st.sidebar:
                 # 如果当前选中的是自定义模型，切换回默认模型
                 if "📝" in selected_model_name:
                     st.session_state.api_config["model"] = list(PRESET_MODELS.values())[0]
-                    st.session_state.ai_model.update_config(st.session_state.api_config)
                 st.experimental_rerun()
         
         # 显示现有的自定义模型
@@ -118,7 +271,6 @@ with st.sidebar:
                         # 如果删除的是当前选中的模型，切换回默认模型
                         if f"📝 {name}" == selected_model_name:
                             st.session_state.api_config["model"] = list(PRESET_MODELS.values())[0]
-                            st.session_state.ai_model.update_config(st.session_state.api_config)
                         st.success(f"已删除模型: {name}")
                         st.experimental_rerun()
     
@@ -134,14 +286,94 @@ with st.sidebar:
         
         if max_tokens != st.session_state.api_config.get("max_tokens"):
             st.session_state.api_config["max_tokens"] = max_tokens
-            st.session_state.ai_model.update_config(st.session_state.api_config)
+        
+        policy_names = list(CONTEXT_POLICIES.keys())
+        policy_labels = list(CONTEXT_POLICIES.values())
+        selected_policy_label = st.selectbox(
+            "上下文策略",
+            options=policy_labels,
+            index=policy_names.index(st.session_state.api_config.get("context_policy", CONTEXT_CONFIG["policy"])),
+            help="历史消息超出模型上下文预算时的裁剪方式"
+        )
+        
+        context_policy = policy_names[policy_labels.index(selected_policy_label)]
+        if context_policy != st.session_state.api_config.get("context_policy"):
+            st.session_state.api_config["context_policy"] = context_policy
+        
+        if context_policy != "drop_reasoning":
+            send_reasoning = st.checkbox(
+                "发送历史思考过程",
+                value=st.session_state.api_config.get("send_reasoning", CONTEXT_CONFIG["send_reasoning"]),
+                help="以reasoning_content字段随历史回答发送思考过程；deepseek-reasoner不接受该字段，请保持关闭"
+            )
+            
+            if send_reasoning != st.session_state.api_config.get("send_reasoning", CONTEXT_CONFIG["send_reasoning"]):
+                st.session_state.api_config["send_reasoning"] = send_reasoning
+        
+        cache_enabled = st.checkbox(
+            "启用响应缓存",
+            value=st.session_state.api_config.get("cache_enabled", False),
+            help="相同模型、相同对话内容的请求直接返回缓存结果，不再调用API"
+        )
+        
+        if cache_enabled != st.session_state.api_config.get("cache_enabled", False):
+            st.session_state.api_config["cache_enabled"] = cache_enabled
+        
+        hedge_enabled = st.checkbox(
+            "启用对冲请求",
+            value=st.session_state.api_config.get("hedge_enabled", HEDGE_CONFIG["enabled"]),
+            help="首个token迟迟未到时，向备用模型或另一个端点发出同样的请求，采用先返回的结果"
+        )
+        
+        if hedge_enabled != st.session_state.api_config.get("hedge_enabled", HEDGE_CONFIG["enabled"]):
+            st.session_state.api_config["hedge_enabled"] = hedge_enabled
+        
+        if hedge_enabled:
+            hedge_options = {"与当前模型相同": None, **PRESET_MODELS}
+            hedge_labels = list(hedge_options.keys())
+            hedge_model = st.session_state.api_config.get("hedge_model", HEDGE_CONFIG["backup_model"])
+            selected_hedge_label = st.selectbox(
+                "备用模型",
+                options=hedge_labels,
+                index=list(hedge_options.values()).index(hedge_model) if hedge_model in hedge_options.values() else 0,
+                help="对冲请求使用的模型"
+            )
+            
+            if hedge_options[selected_hedge_label] != hedge_model:
+                st.session_state.api_config["hedge_model"] = hedge_options[selected_hedge_label]
+    
+    # 渲染设置
+    with st.expander("渲染设置"):
+        st.session_state.render_config["fps"] = st.slider(
+            "刷新频率（次/秒）",
+            min_value=1,
+            max_value=30,
+            value=st.session_state.render_config["fps"],
+            help="流式输出时每秒最多刷新界面的次数，越低越省资源"
+        )
+        st.session_state.render_config["show_stats"] = st.checkbox(
+            "显示渲染统计",
+            value=st.session_state.render_config["show_stats"],
+            help="回答完成后显示界面渲染次数与收到的数据块数"
+        )
     
     # 添加分隔线
     st.divider()
     
+    # 历史会话
+    with st.expander("历史会话"):
+        for conversation in store.list_conversations(st.session_state.owner, limit=10):
+            if conversation["id"] == st.session_state.conversation_id:
+                st.text(f"▶ {conversation['title'] or '未命名会话'}")
+            elif st.button(conversation["title"] or "未命名会话", key=f"conv_{conversation['id']}",
+                           help=f"共 {conversation['message_count']} 条消息"):
+                load_conversation(conversation["id"])
+                st.session_state.current_request = None
+                st.experimental_rerun()
+    
     # 清空对话按钮
-    if st.button("🗑️ 清空对话历史", type="secondary", help="清除所有对话记录"):
-        st.session_state.chat_history = []
+    if st.button("🗑️ 清空对话历史", type="secondary", help="开始新的对话，之前的对话可在历史会话中找回"):
+        new_conversation()
         st.session_state.current_request = None
         st.experimental_rerun()
 
@@ -156,9 +388,6 @@ def process_ai_response(prompt, chat_history):
     reasoning_placeholder = st.empty()
     response_placeholder = st.empty()
     
-    # 用于累积内容
-    full_reasoning = ""
-    full_response = ""
     has_error = False
     
     # 显示初始状态
@@ -167,56 +396,299 @@ def process_ai_response(prompt, chat_history):
     
     response_container = response_placeholder.empty()
     
-    # 处理流式响应
-    for chunk in st.session_state.ai_model.generate_response_stream(
-        prompt, 
-        chat_history
-    ):
-        if chunk["type"] == "reasoning":
-            full_reasoning += chunk["content"]
-            with reasoning_placeholder.expander("思考过程", expanded=True):
-                reasoning_container.markdown(f"### 🤔 思考过程\n{full_reasoning}")
-        
-        elif chunk["type"] == "response":
-            full_response += chunk["content"]
-            response_container.markdown(f"### 💡 回答\n{full_response}")
-        
-        elif chunk["type"] == "complete":
-            # 更新为最终状态
-            with reasoning_placeholder.expander("查看思考过程", expanded=False):
-                reasoning_container.markdown(f"### 🤔 思考过程\n{chunk['content']['reasoning']}")
-            response_container.markdown(f"### 💡 回答\n{chunk['content']['response']}")
-            
-            # 添加到历史记录
-            st.session_state.chat_history.append({
-                "role": "assistant",
-                "content": chunk["content"]
-            })
-            # 清除当前请求
-            st.session_state.current_request = None
-            
-        elif chunk["type"] == "error":
-            # 显示错误信息
-            has_error = True
-            with reasoning_placeholder.expander("思考过程出错", expanded=True):
-                reasoning_container.error(chunk["content"]["reasoning"])
-            response_container.error(chunk["content"]["response"])
+    def render_reasoning(text):
+        with reasoning_placeholder.expander("思考过程", expanded=True):
+            reasoning_container.markdown(f"### 🤔 思考过程\n{text}")
+    
+    def render_response(text):
+        response_container.markdown(f"### 💡 回答\n{text}")
+    
+    # 合并增量，按帧率刷新界面
+    render_config = st.session_state.render_config
+    scheduler = RenderScheduler(
+        {"reasoning": render_reasoning, "response": render_response},
+        fps=render_config["fps"],
+        flush_chars=render_config["flush_chars"]
+    )
+    
+    # 停止按钮：点击后Streamlit重新运行脚本，中断下面的循环，在finally中取消生成
+    cancel = CancelToken()
+    stop_placeholder = st.empty()
+    stop_placeholder.button("⏹️ 停止生成", key="stop_generation")
+    heartbeat_placeholder = st.empty()
+    
+    def heartbeat():
+        heartbeat_placeholder.empty()
+        # 上游停顿时把暂存的最后一段增量渲染出来
+        scheduler.tick()
+    
+    # 处理流式响应，上游没有数据时也定时让出控制权，停止按钮和新的输入能及时生效
+    model = session_model()
+    stream = BackgroundStream(
+        model.generate_response_stream(prompt, chat_history, cancel=cancel),
+        heartbeat=heartbeat
+    )
+    finished = False
+    try:
+        for chunk in stream:
+            if chunk["type"] in ("reasoning", "response"):
+                scheduler.push(chunk["type"], chunk["content"])
             
-            # 添加重试按钮
-            col1, col2 = response_container.columns([3, 1])
-            with col2:
-                if st.button("🔄 重试", key="retry_button"):
-                    # 保存当前请求信息以供重试
-                    st.session_state.current_request = {
-                        "prompt": prompt,
-                        "chat_history": chat_history
-                    }
-                    st.experimental_rerun()
+            elif chunk["type"] == "complete":
+                finished = True
+                scheduler.flush()
+                # 更新为最终状态
+                with reasoning_placeholder.expander("查看思考过程", expanded=False):
+                    reasoning_container.markdown(f"### 🤔 思考过程\n{chunk['content']['reasoning']}")
+                response_container.markdown(f"### 💡 回答\n{chunk['content']['response']}")
+                
+                # 显示上下文裁剪情况
+                report = model.last_context_report
+                if report and report["dropped_messages"] > 0:
+                    st.caption(f"✂️ 上下文已裁剪约 {report['trimmed_tokens']} tokens"
+                               f"（丢弃 {report['dropped_messages']} 条历史消息）")
+                if chunk["content"].get("truncated"):
+                    st.caption(f"⚠️ 输出超过单轮上限（{OUTPUT_CONFIG['max_turn_bytes'] // 1024} KB），已截断")
+                
+                # 显示上游前缀缓存命中情况
+                usage = chunk.get("usage")
+                if usage and usage["cache_hit_tokens"] is not None:
+                    totals = st.session_state.prompt_cache_usage
+                    totals["hit"] += usage["cache_hit_tokens"]
+                    totals["miss"] += usage["cache_miss_tokens"] or 0
+                    hit_rate = totals["hit"] / max(totals["hit"] + totals["miss"], 1)
+                    st.caption(f"🗄️ 提示词缓存命中 {usage['cache_hit_tokens']} / 未命中 {usage['cache_miss_tokens']} tokens"
+                               f"（本会话命中率 {hit_rate:.0%}）")
+                
+                # 添加到历史记录
+                append_to_history({
+                    "role": "assistant",
+                    "content": chunk["content"]
+                })
+                # 清除当前请求
+                st.session_state.current_request = None
+                
+            elif chunk["type"] == "error":
+                finished = True
+                scheduler.flush()
+                # 显示错误信息
+                has_error = True
+                with reasoning_placeholder.expander("思考过程出错", expanded=True):
+                    reasoning_container.error(chunk["content"]["reasoning"])
+                response_container.error(chunk["content"]["response"])
+                
+                # 添加重试按钮
+                col1, col2 = response_container.columns([3, 1])
+                with col2:
+                    if st.button("🔄 重试", key="retry_button"):
+                        # 保存当前请求信息以供重试
+                        st.session_state.current_request = {
+                            "prompt": prompt,
+                            "chat_history": chat_history
+                        }
+                        st.experimental_rerun()
+    finally:
+        if not finished:
+            # 生成被重新运行中断：立即断开上游连接，保存已生成的部分
+            cancel.cancel()
+            for chunk in stream.remaining(timeout=2):
+                if chunk["type"] == "complete":
+                    append_to_history({
+                        "role": "assistant",
+                        "content": chunk["content"]
+                    })
+                    st.session_state.current_request = None
+    stop_placeholder.empty()
+
+    if render_config["show_stats"]:
+        stats = scheduler.stats()
+        st.caption(f"🖥️ 渲染 {stats['renders']} 次 / 数据块 {stats['chunks']} 个")
 
     return has_error
 
+COMPARE_STATUS = {"complete": "✅ 完成", "error": "❌ 出错", "cancelled": "⏹️ 已停止"}
+
+def comparison_config(label):
+    """对比模型的配置：当前的API设置加上该模型的ID和上下文窗口"""
+    model_id = all_models[label]
+    context_window = st.session_state.custom_model_windows.get(model_id) if "📝" in label else None
+    return {**st.session_state.api_config, "model": model_id, "context_window": context_window}
+
+def timed_stream(events, spans, label, model_id):
+    """在读取线程中记录一个模型的首个token耗时、输出速度和总耗时
+
+    计时在工作线程中完成，不受界面渲染的影响；排队等待线程的时间不计入。
+    """
+    span = spans[label] = RequestSpan(model_id, None)
+    status, content = "cancelled", None
+    try:
+        for event in events:
+            span.event(event)
+            if event["type"] == "complete":
+                content = event["content"]
+                status = "cancelled" if content.get("cancelled") else "complete"
+                span.usage = event.get("usage")
+                span.finish(status, content)
+            elif event["type"] == "error":
+                status = "error"
+                span.finish(status)
+            yield event
+    finally:
+        if span.status is None:
+            span.finish(status, content)
+
+def comparison_rows(labels, spans):
+    """对比结果表格：每个模型一行"""
+    rows = []
+    for label in labels:
+        span = spans.get(label)
+        if span is None:
+            rows.append({"模型": label, "状态": "排队中", "首个token": "-", "输出速度": "-", "总耗时": "-"})
+            continue
+        durations = span.durations()
+        firsts = [d for d in (durations["first_reasoning"], durations["first_response"]) if d is not None]
+        speed = span.tokens_per_second()
+        rows.append({
+            "模型": label,
+            "状态": COMPARE_STATUS.get(span.status, "生成中"),
+            "首个token": f"{min(firsts):.2f} 秒" if firsts else "-",
+            "输出速度": f"{speed:.1f} token/s" if speed else "-",
+            "总耗时": f"{durations['total']:.2f} 秒" if durations["total"] is not None else "-",
+        })
+    return rows
+
+def comparison_renderers(reasoning_placeholder, response_placeholder):
+    def render_reasoning(text):
+        reasoning_placeholder.expander("🤔 思考过程", expanded=True).markdown(text)
+
+    def render_response(text):
+        response_placeholder.markdown(text)
+
+    return {"reasoning": render_reasoning, "response": render_response}
+
+def show_comparison_result(reasoning_placeholder, response_placeholder, chunk):
+    """显示一个模型的最终结果"""
+    content = chunk["content"]
+    if chunk["type"] == "error":
+        reasoning_placeholder.empty()
+        response_placeholder.error(content["response"])
+        return
+    reasoning_placeholder.expander("🤔 思考过程", expanded=False).markdown(content["reasoning"])
+    response_placeholder.markdown(content["response"])
+    if content.get("cancelled"):
+        st.caption("⏹️ 已停止生成")
+
+def show_comparison(comparison):
+    """显示保存的对比结果"""
+    with st.chat_message("user"):
+        st.write(comparison["prompt"])
+    with st.chat_message("assistant"):
+        labels = comparison["labels"]
+        for label, column in zip(labels, st.columns(len(labels))):
+            with column:
+                st.markdown(f"**{label}**")
+                chunk = comparison["results"].get(label)
+                if chunk:
+                    show_comparison_result(st.empty(), st.empty(), chunk)
+        st.table(comparison["rows"])
+        st.caption(f"⏱️ 总耗时 {comparison['wall']:.2f} 秒（各模型耗时之和 {comparison['sum']:.2f} 秒）")
+
+def process_comparison(prompt, chat_history, labels):
+    """对比模式：同一问题同时发给多个模型，每个模型一列
+
+    各模型在有界线程池中并发请求，总耗时取决于最慢的模型。每列的增量按帧率
+    合并渲染，每个模型结束时刷新耗时表格。结果保存在会话状态中，不写入对话历史。
+    """
+    if not st.session_state.api_config.get("api_key"):
+        st.error("⚠️ 请先在侧边栏设置API Key")
+        return
+    
+    render_config = st.session_state.render_config
+    placeholders = {}
+    schedulers = {}
+    for label, column in zip(labels, st.columns(len(labels))):
+        with column:
+            st.markdown(f"**{label}**")
+            placeholders[label] = (st.empty(), st.empty())
+        schedulers[label] = RenderScheduler(
+            comparison_renderers(*placeholders[label]),
+            fps=render_config["fps"],
+            flush_chars=render_config["flush_chars"]
+        )
+    table_placeholder = st.empty()
+    
+    cancel = CancelToken()
+    stop_placeholder = st.empty()
+    stop_placeholder.button("⏹️ 停止生成", key="stop_comparison")
+    heartbeat_placeholder = st.empty()
+    
+    # 每个模型使用独立的上下文状态，不影响当前对话的请求前缀
+    spans = {}
+    streams = {
+        label: timed_stream(
+            AIModel(comparison_config(label)).generate_response_stream(prompt, chat_history, cancel=cancel),
+            spans, label, all_models[label]
+        )
+        for label in labels
+    }
+    started = time.perf_counter()
+    table_placeholder.table(comparison_rows(labels, spans))
+    def heartbeat():
+        heartbeat_placeholder.empty()
+        for scheduler in schedulers.values():
+            scheduler.tick()
+    
+    stream = ParallelStreams(streams, COMPARE_CONFIG["max_workers"], heartbeat=heartbeat)
+    results = {}
+    try:
+        for label, chunk in stream:
+            # 其他模型在输出时不会触发heartbeat，停顿的模型也要渲染暂存的尾部
+            for scheduler in schedulers.values():
+                scheduler.tick()
+            if chunk["type"] in ("reasoning", "response"):
+                schedulers[label].push(chunk["type"], chunk["content"])
+            elif chunk["type"] in ("complete", "error"):
+                schedulers[label].flush()
+                results[label] = chunk
+                with placeholders[label][1].container():
+                    show_comparison_result(st.empty(), st.empty(), chunk)
+                placeholders[label][0].empty()
+                table_placeholder.table(comparison_rows(labels, spans))
+    finally:
+        if len(results) < len(labels):
+            # 被重新运行中断：立即断开所有上游连接，保存已生成的部分
+            cancel.cancel()
+            for label, chunk in stream.remaining(timeout=2):
+                if chunk["type"] in ("complete", "error"):
+                    results[label] = chunk
+        totals = [span.durations()["total"] for span in spans.values()]
+        st.session_state.comparison = {
+            "prompt": prompt,
+            "labels": labels,
+            "results": results,
+            "rows": comparison_rows(labels, spans),
+            "wall": time.perf_counter() - started,
+            "sum": sum(total for total in totals if total is not None),
+        }
+    stop_placeholder.empty()
+    table_placeholder.table(st.session_state.comparison["rows"])
+    st.caption(f"⏱️ 总耗时 {st.session_state.comparison['wall']:.2f} 秒"
+               f"（各模型耗时之和 {st.session_state.comparison['sum']:.2f} 秒）")
+
+# 只显示最近的消息，更早的消息按需从存储加载
+display_messages = st.session_state.display_messages
+if display_messages and display_messages[0]["seq"] > 0:
+    if st.button("⬆️ 加载更早的消息"):
+        older = store.load_page(
+            st.session_state.conversation_id,
+            before_seq=display_messages[0]["seq"],
+            limit=STORAGE_CONFIG["page_size"]
+        )
+        st.session_state.display_messages = older + display_messages
+        st.session_state.display_limit += len(older)
+
 # 显示聊天历史
-for message in st.session_state.chat_history:
+for message in st.session_state.display_messages:
     with st.chat_message(message["role"]):
         # 如果是AI回复，显示思考过程和回答
         if message["role"] == "assistant" and isinstance(message["content"], dict):
@@ -227,9 +699,20 @@ for message in st.session_state.chat_history:
             # 显示最终回答
             st.markdown("### 💡 回答")
             st.markdown(message["content"]["response"])
+            if message["content"].get("cancelled"):
+                st.caption("⏹️ 已停止生成，以上为停止前的部分内容")
         else:
             st.write(message["content"])
 
+# 上一次的对比结果，开始新的对比时清除
+comparison_placeholder = st.empty()
+if st.session_state.compare_mode and st.session_state.comparison:
+    with comparison_placeholder.container():
+        show_comparison(st.session_state.comparison)
+
+# 界面脚本的耗时（不含生成回答），会话数增加时用于确认每次运行的开销不随之增长
+get_client().metrics.record_script_run(time.perf_counter() - run_started, cold=first_run)
+
 # 检查是否有待重试的请求
 if st.session_state.current_request:
     with st.chat_message("assistant"):
@@ -240,13 +723,21 @@ if st.session_state.current_request:
 
 # 用户输入
 if prompt := st.chat_input("请输入您的问题..."):
-    # 添加用户消息到历史
-    st.session_state.chat_history.append({"role": "user", "content": prompt})
-    
-    # 显示用户消息
-    with st.chat_message("user"):
-        st.write(prompt)
-    
-    # 显示AI思考过程
-    with st.chat_message("assistant"):
-        process_ai_response(prompt, st.session_state.chat_history[:-1]) 
\ No newline at end of file
+    if st.session_state.compare_mode and st.session_state.compare_models:
+        # 对比模式：同时发给所有选中的模型，结果不写入对话历史
+        comparison_placeholder.empty()
+        with st.chat_message("user"):
+            st.write(prompt)
+        with st.chat_message("assistant"):
+            process_comparison(prompt, st.session_state.chat_history, st.session_state.compare_models)
+    else:
+        # 添加用户消息到历史
+        append_to_history({"role": "user", "content": prompt})
+        
+        # 显示用户消息
+        with st.chat_message("user"):
+            st.write(prompt)
+        
+        # 显示AI思考过程
+        with st.chat_message("assistant"):
+            process_ai_response(prompt, st.session_state.chat_history[:-1]) 
\ No newline at end of file
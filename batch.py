@@ -0,0 +1,216 @@
+"""
+批量模式：不启动界面，用有界线程池处理JSONL文件中的问题
+
+用法：
+    python batch.py prompts.jsonl results.jsonl --concurrency 4 --rpm 60
+
+输入每行一个JSON对象，默认读取id和prompt字段，可选model、max_tokens。
+结果在每个请求完成后立即追加写入输出文件；中断后重新运行同样的命令，
+已成功完成的id会被跳过。
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import DEFAULT_API_CONFIG, PRESET_MODELS
+from log_setup import setup_logging
+from utils import AIModel
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """每分钟请求数限制（令牌桶）"""
+
+    def __init__(self, requests_per_minute):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """阻塞直到获得一个令牌"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+def id_key(item_id):
+    """id在已完成集合中的键：列表、对象等不可哈希的id按规范化的JSON文本比较"""
+    if isinstance(item_id, (str, int, float)) or item_id is None:
+        return item_id
+    return json.dumps(item_id, ensure_ascii=False, sort_keys=True)
+
+def load_completed_ids(output_path):
+    """读取输出文件中已成功完成的id，用于断点续跑"""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 崩溃时可能留下半行
+                continue
+            if record.get("status") == "complete":
+                completed.add(id_key(record["id"]))
+    return completed
+
+def iter_prompts(input_path, id_field, prompt_field, completed):
+    """逐行读取输入文件，跳过已完成的id"""
+    with open(input_path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning("第%d行不是合法的JSON，已跳过: %s", line_number, e)
+                continue
+            if not isinstance(item, dict):
+                logger.warning("第%d行不是JSON对象，已跳过", line_number)
+                continue
+            item_id = item.get(id_field, line_number)
+            if id_key(item_id) in completed:
+                continue
+            if prompt_field not in item:
+                logger.warning("第%d行缺少%s字段，已跳过", line_number, prompt_field)
+                continue
+            yield item_id, item
+
+def run_one(model, item_id, item, prompt_field, rate_limiter):
+    """处理一个问题，返回输出记录"""
+    rate_limiter.acquire()
+    overrides = {key: item[key] for key in ("model", "max_tokens") if key in item}
+    if overrides:
+        # 连接池按base_url共享，单独创建实例的开销很小
+        model = AIModel({**model.config, **overrides}, cache=model.cache)
+    start = time.monotonic()
+    first_reasoning = first_response = None
+    record = {"id": item_id, "model": model.config["model"]}
+    for event in model.generate_response_stream(item[prompt_field], item.get("history")):
+        now = time.monotonic() - start
+        if event["type"] == "reasoning" and first_reasoning is None:
+            first_reasoning = now
+        elif event["type"] == "response" and first_response is None:
+            first_response = now
+        elif event["type"] in ("complete", "error"):
+            record.update({
+                "status": event["type"],
+                "reasoning": event["content"]["reasoning"],
+                "response": event["content"]["response"],
+            })
+            if event["content"].get("truncated"):
+                record["truncated"] = True
+            if event.get("usage"):
+                record["usage"] = event["usage"]
+    first_token = min((t for t in (first_reasoning, first_response) if t is not None), default=None)
+    record["timings"] = {
+        "ttft": first_token,
+        "first_reasoning": first_reasoning,
+        "first_response": first_response,
+        "total": time.monotonic() - start,
+    }
+    return record
+
+def run_batch(model, input_path, output_path, concurrency=4, rpm=60,
+              id_field="id", prompt_field="prompt"):
+    """运行批量任务
+
+    同时在途的任务数不超过concurrency的两倍，内存占用与输入文件大小无关。
+
+    Returns:
+        dict: 完成、失败和跳过的数量
+    """
+    completed = load_completed_ids(output_path)
+    if completed:
+        logger.info("断点续跑：跳过%d个已完成的请求", len(completed))
+    rate_limiter = RateLimiter(rpm)
+    slots = threading.BoundedSemaphore(concurrency * 2)
+    write_lock = threading.Lock()
+    summary = {"complete": 0, "error": 0, "skipped": len(completed)}
+
+    with open(output_path, "a", encoding="utf-8") as output, \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        def on_done(future, item_id):
+            slots.release()
+            try:
+                record = future.result()
+            except Exception as e:
+                # 同样写入一条失败记录，重新运行时会再次处理
+                logger.error("[%s] 批量任务异常: %s", item_id, e, exc_info=True)
+                record = {
+                    "id": item_id,
+                    "status": "error",
+                    "error": f"{type(e).__name__}: {e}",
+                    "timings": {"total": None},
+                }
+            with write_lock:
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+                summary[record.get("status", "error")] += 1
+            if record["timings"]["total"] is not None:
+                logger.info("[%s] %s，耗时%.1f秒", record["id"], record.get("status"), record["timings"]["total"])
+
+        for item_id, item in iter_prompts(input_path, id_field, prompt_field, completed):
+            slots.acquire()
+            future = executor.submit(run_one, model, item_id, item, prompt_field, rate_limiter)
+            future.add_done_callback(lambda future, item_id=item_id: on_done(future, item_id))
+
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="批量调用AIModel处理JSONL中的问题")
+    parser.add_argument("input", help="输入JSONL文件")
+    parser.add_argument("output", help="输出JSONL文件（追加写入）")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发请求数")
+    parser.add_argument("--rpm", type=float, default=60, help="每分钟最多发起的请求数")
+    parser.add_argument("--model", default=list(PRESET_MODELS.values())[0], help="默认模型ID")
+    parser.add_argument("--base-url", default=DEFAULT_API_CONFIG["base_url"], help="API基础地址")
+    parser.add_argument("--api-key", default=None, help="API Key，默认读取环境变量DEEPSEEK_API_KEY")
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_API_CONFIG["max_tokens"], help="最大生成长度")
+    parser.add_argument("--id-field", default="id", help="输入中作为唯一标识的字段")
+    parser.add_argument("--prompt-field", default="prompt", help="输入中作为问题的字段")
+    args = parser.parse_args()
+    setup_logging()
+
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    api_key = args.api_key or os.getenv("DEEPSEEK_API_KEY")
+    if not api_key:
+        parser.error("请通过--api-key或环境变量DEEPSEEK_API_KEY提供API Key")
+
+    model = AIModel({
+        "base_url": args.base_url,
+        "api_key": api_key,
+        "model": args.model,
+        "max_tokens": args.max_tokens,
+    })
+    start = time.monotonic()
+    summary = run_batch(model, args.input, args.output, args.concurrency, args.rpm,
+                        args.id_field, args.prompt_field)
+    logger.info("批量任务结束，成功%d个，失败%d个，跳过%d个，总耗时%.1f秒",
+                summary["complete"], summary["error"], summary["skipped"], time.monotonic() - start)
+    return 0 if summary["error"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
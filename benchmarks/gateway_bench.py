@@ -0,0 +1,127 @@
+"""
+网关基准：用本地模拟服务作为上游，测量gateway.py在大量并发流下的表现
+
+用法：
+    python benchmarks/gateway_bench.py --streams 100,300 --tokens 500 --rate 50
+
+模拟服务和网关各在一个子进程中运行，客户端在本进程中用aiohttp同时发起
+streams个流式请求，报告完成数、429数、首个token耗时和总吞吐量。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from stream_bench import _free_port, percentile, start_mock_server
+
+def start_gateway(port, upstream, max_streams, max_per_client):
+    """在子进程中启动网关，上游为模拟服务"""
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "gateway.py"), "--port", str(port),
+         "--base-url", upstream, "--api-key", "mock",
+         "--max-streams", str(max_streams), "--max-per-client", str(max_per_client)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("网关启动失败")
+
+async def run_stream(session, url, index, clients):
+    """发起一个流式请求，返回(状态, 首个token耗时)"""
+    start = time.monotonic()
+    ttft = None
+    try:
+        async with session.post(url, json={
+            "messages": [{"role": "user", "content": f"benchmark {index}"}],
+            "stream": True,
+        }, headers={"X-Client-Id": f"client-{index % clients}"}) as response:
+            if response.status != 200:
+                await response.read()
+                return response.status, None
+            status = "eof"
+            async for line in response.content:
+                if ttft is None and b'"content"' in line:
+                    ttft = time.monotonic() - start
+                elif line.startswith(b'data: {"error"'):
+                    status = "error"
+                elif line.startswith(b"data: [DONE]"):
+                    status = status if status == "error" else "complete"
+            return status, ttft
+    except aiohttp.ClientError as e:
+        return type(e).__name__, None
+
+async def run_scenario(url, streams, clients, tokens):
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(run_stream(session, url, i, clients) for i in range(streams)))
+        wall = time.perf_counter() - start
+    statuses = Counter(str(status) for status, _ in results)
+    ttfts = [ttft for status, ttft in results if status == "complete" and ttft is not None]
+    return {
+        "streams": streams,
+        "clients": clients,
+        "statuses": dict(statuses),
+        "wall_seconds": wall,
+        "throughput": tokens * statuses["complete"] / wall if wall > 0 else None,
+        "ttft": {"p50": percentile(ttfts, 0.5), "p99": percentile(ttfts, 0.99)},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="网关并发流基准")
+    parser.add_argument("--streams", default="100,300", help="并发流数量，逗号分隔")
+    parser.add_argument("--clients", type=int, default=10, help="客户端数量（X-Client-Id个数）")
+    parser.add_argument("--tokens", type=int, default=500, help="每个流的输出token数")
+    parser.add_argument("--rate", type=float, default=50, help="上游每个流每秒输出的token数")
+    parser.add_argument("--max-streams", type=int, default=512, help="网关同时进行的生成数上限")
+    parser.add_argument("--max-per-client", type=int, default=64, help="网关单个客户端的并发上限")
+    parser.add_argument("--output", help="结果JSON文件")
+    args = parser.parse_args()
+
+    mock_port, gateway_port = _free_port(), _free_port()
+    mock = start_mock_server(mock_port)
+    upstream = f"http://127.0.0.1:{mock_port}/tokens={args.tokens},reasoning_tokens=0,rate={args.rate}/v1"
+    gateway = None
+    results = {"options": vars(args), "scenarios": []}
+    try:
+        gateway = start_gateway(gateway_port, upstream, args.max_streams, args.max_per_client)
+        url = f"http://127.0.0.1:{gateway_port}/v1/chat/completions"
+        print(f"{'流数':>6} {'完成':>6} {'429':>6} {'吞吐(token/s)':>14} {'TTFT p50':>10} {'TTFT p99':>10}")
+        for streams in map(int, args.streams.split(",")):
+            record = asyncio.run(run_scenario(url, streams, args.clients, args.tokens))
+            results["scenarios"].append(record)
+            p50, p99 = record["ttft"]["p50"], record["ttft"]["p99"]
+            print(f"{streams:>6} {record['statuses'].get('complete', 0):>6} {record['statuses'].get('429', 0):>6} "
+                  f"{record['throughput'] or 0:>14.0f} "
+                  f"{(f'{p50:.3f}s' if p50 is not None else '-'):>10} {(f'{p99:.3f}s' if p99 is not None else '-'):>10}")
+    finally:
+        if gateway is not None:
+            gateway.terminate()
+            gateway.wait()
+        mock.terminate()
+        mock.wait()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+本地模拟的OpenAI兼容流式接口，用于离线基准测试
+
+用法：
+    python benchmarks/mock_server.py --port 8900 --tokens 2000 --rate 500
+
+请求地址为 http://127.0.0.1:8900/v1/chat/completions。也可以在路径中覆盖
+单次请求的选项，例如base_url设为 http://127.0.0.1:8900/tokens=130000,think=split/v1
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+DEFAULT_OPTIONS = {
+    "tokens": 1000,  # 回答的token数
+    "reasoning_tokens": 200,  # 思考过程的token数
+    "think": "inline",  # 思考过程位置：inline（<think>标签）、split（标签跨数据块）、reasoning_content、none
+    "chunk_tokens": 1,  # 每个SSE事件包含的token数
+    "rate": 0.0,  # 每秒输出的token数，0表示不限速
+    "ttft": 0.0,  # 首个数据块前的等待（秒）
+    "malformed_rate": 0.0,  # 插入非法JSON行的概率（每个事件）
+    "stall_rate": 0.0,  # 停顿的概率（每个事件）
+    "stall_seconds": 1.0,  # 每次停顿的时长
+    "error_429_rate": 0.0,  # 直接返回429的概率（每个请求）
+    "error_5xx_rate": 0.0,  # 直接返回503的概率（每个请求）
+    "usage": 1,  # 是否在最后返回usage
+    "seed": 0,  # 随机种子，相同种子和请求序号产生相同的故障
+}
+
+def parse_options(text, base=None):
+    """解析"key=value,key=value"形式的选项，类型与DEFAULT_OPTIONS一致"""
+    options = dict(base or DEFAULT_OPTIONS)
+    for item in filter(None, text.split(",")):
+        key, _, value = item.partition("=")
+        if key not in DEFAULT_OPTIONS:
+            raise ValueError(f"未知选项: {key}")
+        options[key] = type(DEFAULT_OPTIONS[key])(value)
+    return options
+
+def build_pieces(options):
+    """生成(字段, 文本)形式的token序列"""
+    reasoning = [("content", f"r{i % 10} ") for i in range(options["reasoning_tokens"])]
+    answer = [("content", f"w{i % 10} ") for i in range(options["tokens"])]
+    think = options["think"]
+    if think == "none" or not reasoning:
+        return answer
+    if think == "reasoning_content":
+        return [("reasoning_content", text) for _, text in reasoning] + answer
+    if think == "split":
+        return [("content", "<thi"), ("content", "nk>")] + reasoning + \
+            [("content", "</th"), ("content", "ink>\n\n")] + answer
+    return [("content", "<think>")] + reasoning + [("content", "</think>\n\n")] + answer
+
+def iter_chunks(pieces, chunk_tokens):
+    """把token序列按字段合并成SSE数据块，返回(字段, 文本, token数)"""
+    group, field = [], None
+    for piece_field, text in pieces:
+        if group and (piece_field != field or len(group) >= chunk_tokens):
+            yield field, "".join(group), len(group)
+            group = []
+        field = piece_field
+        group.append(text)
+    if group:
+        yield field, "".join(group), len(group)
+
+def _event(payload):
+    return b"data: " + json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n\n"
+
+class MockServer:
+    """模拟服务端，options为默认选项"""
+
+    def __init__(self, options=None):
+        self.options = dict(options or DEFAULT_OPTIONS)
+        self.requests = 0
+        self._prefixes = set()  # 见过的消息前缀，模拟上游的前缀缓存
+
+    def _prompt_cache(self, messages):
+        """按消息粒度模拟前缀缓存，返回(命中, 未命中)的token数（每4个字符计1个token）"""
+        hit = total = 0
+        prefix = ()
+        for message in messages:
+            prefix += (message.get("role"), message.get("content"))
+            tokens = len(message.get("content") or "") // 4
+            total += tokens
+            key = hash(prefix)
+            if key in self._prefixes and hit == total - tokens:
+                hit += tokens
+            self._prefixes.add(key)
+        return hit, total - hit
+
+    async def chat(self, request):
+        options = parse_options(request.match_info.get("options", ""), self.options)
+        body = await request.json()
+        index = self.requests
+        self.requests += 1
+        rng = random.Random(f"{options['seed']}-{index}")
+
+        roll = rng.random()
+        if roll < options["error_429_rate"]:
+            return web.Response(status=429, text="rate limited", headers={"Retry-After": "1"})
+        if roll < options["error_429_rate"] + options["error_5xx_rate"]:
+            return web.Response(status=503, text="service unavailable")
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        if options["ttft"]:
+            await asyncio.sleep(options["ttft"])
+
+        start = time.monotonic()
+        sent = 0
+        for field, text, count in iter_chunks(build_pieces(options), options["chunk_tokens"]):
+            if options["rate"]:
+                # 按绝对时间表发送，避免sleep误差累积
+                delay = start + sent / options["rate"] - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if rng.random() < options["stall_rate"]:
+                await asyncio.sleep(options["stall_seconds"])
+            if rng.random() < options["malformed_rate"]:
+                await response.write(b'data: {"choices": [{"delta": \n\n')
+            await response.write(_event({
+                "id": f"mock-{index}",
+                "object": "chat.completion.chunk",
+                "model": body.get("model"),
+                "choices": [{"index": 0, "delta": {field: text}, "finish_reason": None}],
+            }))
+            sent += count
+
+        usage = None
+        if options["usage"]:
+            hit, miss = self._prompt_cache(body.get("messages", []))
+            usage = {
+                "prompt_tokens": hit + miss,
+                "completion_tokens": options["tokens"] + options["reasoning_tokens"],
+                "prompt_cache_hit_tokens": hit,
+                "prompt_cache_miss_tokens": miss,
+            }
+        await response.write(_event({
+            "id": f"mock-{index}",
+            "object": "chat.completion.chunk",
+            "model": body.get("model"),
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "usage": usage,
+        }))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat)
+        app.router.add_post("/{options}/v1/chat/completions", self.chat)
+        return app
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟的OpenAI兼容流式接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    for key, value in DEFAULT_OPTIONS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+    options = {key: getattr(args, key) for key in DEFAULT_OPTIONS}
+    print(f"模拟服务运行于 http://{args.host}:{args.port}/v1", flush=True)
+    web.run_app(MockServer(options).make_app(), host=args.host, port=args.port, print=None)
+
+if __name__ == "__main__":
+    main()
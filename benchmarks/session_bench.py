@@ -0,0 +1,82 @@
+"""
+界面会话基准：在同一进程中模拟多个Streamlit会话，测量脚本首次运行和重新运行的耗时
+
+用法：
+    python benchmarks/session_bench.py --sessions 1,8,32 --reruns 5
+
+所有会话同时存在于一个进程中（AppTest不支持多线程同时运行，各会话的运行
+交替进行）。每个会话先运行一次（冷启动），再重新运行reruns次。耗时取自app.py
+记录到共享客户端指标中的script_runs（不含生成回答），会话数增加时每次运行的
+开销应保持不变或下降（共享资源已经创建）。
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from streamlit.testing.v1 import AppTest
+
+from client import get_client
+from log_setup import setup_logging
+
+def _totals(run):
+    snapshot = get_client().metrics.snapshot()["script_runs"][run]
+    return snapshot["count"], snapshot["sum"]
+
+def _mean_since(run, before):
+    count, total = _totals(run)
+    if count == before[0]:
+        return None
+    return (total - before[1]) / (count - before[0])
+
+def run_scenario(sessions, reruns):
+    """sessions个会话，每个首次运行一次、重新运行reruns次"""
+    apps = [AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60) for _ in range(sessions)]
+    cold_before, rerun_before = _totals("cold"), _totals("rerun")
+    wall_start = time.perf_counter()
+    for _ in range(reruns + 1):
+        for app in apps:
+            app.run()
+    wall = time.perf_counter() - wall_start
+    errors = sum(1 for app in apps if app.exception)
+    return {
+        "sessions": sessions,
+        "reruns": reruns,
+        "cold_mean_seconds": _mean_since("cold", cold_before),
+        "rerun_mean_seconds": _mean_since("rerun", rerun_before),
+        "wall_seconds": wall,
+        "errors": errors,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="界面会话基准")
+    parser.add_argument("--sessions", default="1,8,32", help="会话数，逗号分隔")
+    parser.add_argument("--reruns", type=int, default=5, help="每个会话重新运行的次数")
+    parser.add_argument("--output", help="结果JSON文件")
+    args = parser.parse_args()
+
+    setup_logging({"level": "WARNING", "file": None})
+    process_start = time.perf_counter()
+    results = {"scenarios": []}
+    print(f"{'会话数':>6} {'首次运行(ms)':>12} {'重新运行(ms)':>12} {'总耗时(s)':>10}")
+    for sessions in map(int, args.sessions.split(",")):
+        record = run_scenario(sessions, args.reruns)
+        results["scenarios"].append(record)
+        print(f"{sessions:>6} {(record['cold_mean_seconds'] or 0) * 1000:>12.1f} "
+              f"{(record['rerun_mean_seconds'] or 0) * 1000:>12.1f} {record['wall_seconds']:>10.2f}")
+        if record["errors"]:
+            print(f"{'':>6} 出错 {record['errors']} 个会话")
+    results["client"] = get_client().stats()
+    results["process_seconds"] = time.perf_counter() - process_start
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+SSE解码微基准：对比旧的逐行解析循环与SSEDecoder的事件吞吐量
+
+用法：
+    python benchmarks/sse_decode.py [--events 200000] [--chunk-size 1400]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sse import SSEDecoder, get_json_loads
+
+logger = logging.getLogger("benchmark")
+
+def build_stream(event_count, chunk_size):
+    """构造模拟的上游字节流，按TCP报文大小切块"""
+    lines = []
+    for i in range(event_count):
+        chunk = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "deepseek-reasoner",
+            "choices": [{"index": 0, "delta": {"content": f"第{i}个词 "}, "finish_reason": None}]
+        }
+        lines.append(b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n\n")
+        if i % 50 == 0:
+            lines.append(b": keep-alive\n\n")
+    lines.append(b"data: [DONE]\n\n")
+    payload = b"".join(lines)
+    return [payload[i:i + chunk_size] for i in range(0, len(payload), chunk_size)]
+
+def _iter_lines(chunks):
+    """requests.Response.iter_lines的等价实现"""
+    pending = None
+    for chunk in chunks:
+        if pending is not None:
+            chunk = pending + chunk
+        lines = chunk.splitlines()
+        if lines and lines[-1] and chunk and lines[-1][-1] == chunk[-1]:
+            pending = lines.pop()
+        else:
+            pending = None
+        yield from lines
+    if pending is not None:
+        yield pending
+
+def legacy_loop(chunks):
+    """旧版generate_response_stream中的逐行解析逻辑"""
+    count = 0
+    for line in _iter_lines(chunks):
+        if not line:
+            continue
+        try:
+            line = line.decode('utf-8')
+            logger.debug("原始数据行: %r", line)
+            if line.startswith("data: "):
+                line = line[6:]
+                logger.debug("处理后的数据: %r", line)
+            if line == "[DONE]":
+                break
+            if not line.strip():
+                continue
+            try:
+                chunk = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "choices" not in chunk:
+                continue
+            chunk["choices"][0].get("delta", {})
+            count += 1
+        except Exception as e:
+            logger.error("处理数据块时出错: %s, 原始数据: %r", str(e), line, exc_info=True)
+    return count
+
+def decoder_loop(chunks, json_loads):
+    """SSEDecoder + 可插拔JSON解析"""
+    count = 0
+    decoder = SSEDecoder()
+    for raw in chunks:
+        for event in decoder.feed(raw):
+            if event.data == b"[DONE]":
+                return count
+            chunk = json_loads(event.data)
+            if "choices" in chunk:
+                chunk["choices"][0].get("delta", {})
+                count += 1
+    return count
+
+def measure(name, func, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    rate = count / best
+    print(f"{name:<24} {count:>8} 事件  {best * 1000:>9.1f} ms  {rate:>12,.0f} 事件/秒")
+    return rate
+
+def main():
+    parser = argparse.ArgumentParser(description="SSE解码微基准")
+    parser.add_argument("--events", type=int, default=200000, help="事件数量")
+    parser.add_argument("--chunk-size", type=int, default=1400, help="每个网络数据块的字节数")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    chunks = build_stream(args.events, args.chunk_size)
+    print(f"数据量: {sum(len(c) for c in chunks) / 1024 / 1024:.1f} MB，数据块: {len(chunks)}")
+
+    baseline = measure("旧版逐行循环", legacy_loop, chunks)
+    backends = ["json"]
+    auto_name, _ = get_json_loads("auto")
+    if auto_name != "json":
+        backends.append(auto_name)
+    for backend in backends:
+        _, loads = get_json_loads(backend)
+        rate = measure(f"SSEDecoder + {backend}", decoder_loop, chunks, loads)
+        print(f"{'':<24} 相对旧版: {rate / baseline:.2f}x")
+
+if __name__ == "__main__":
+    main()
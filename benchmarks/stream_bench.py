@@ -0,0 +1,217 @@
+"""
+流式端到端基准：用本地模拟服务驱动AIModel.generate_response_stream和界面端的增量合并
+
+用法：
+    python benchmarks/stream_bench.py --output results.json
+    python benchmarks/stream_bench.py --sizes 1000,130000 --concurrency 1,64 --compare results.json
+
+每个场景报告吞吐量（输出token/秒）、首个token耗时、CPU时间和峰值内存，
+结果保存为JSON，--compare读取之前的结果并输出变化比例，便于比较不同提交。
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import TRANSPORT_CONFIG
+from mock_server import parse_options
+from render import RenderScheduler
+from utils import AIModel
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_mock_server(port):
+    """在子进程中启动模拟服务，使测得的CPU时间只包含客户端"""
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "benchmarks", "mock_server.py"), "--port", str(port)],
+        stdout=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("模拟服务启动失败")
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def run_stream(model, prompt):
+    """消费一个流，按app.process_ai_response的方式合并增量并生成Markdown"""
+    rendered = {"reasoning": "", "response": ""}
+
+    def render_reasoning(text):
+        rendered["reasoning"] = f"### 🤔 思考过程\n{text}"
+
+    def render_response(text):
+        rendered["response"] = f"### 💡 回答\n{text}"
+
+    scheduler = RenderScheduler({"reasoning": render_reasoning, "response": render_response})
+    start = time.monotonic()
+    ttft = None
+    status = "cancelled"
+    for event in model.generate_response_stream(prompt, []):
+        if event["type"] in ("reasoning", "response"):
+            if ttft is None:
+                ttft = time.monotonic() - start
+            scheduler.push(event["type"], event["content"])
+        elif event["type"] in ("complete", "error"):
+            scheduler.flush()
+            status = event["type"]
+    return {"ttft": ttft, "status": status, "events": scheduler.stats()["chunks"]}
+
+def run_scenario(port, name, tokens, concurrency, mock_options, trace_memory=False):
+    """运行一个场景：concurrency个并发流，每个输出tokens个token"""
+    options = dict(mock_options, tokens=tokens - tokens // 5, reasoning_tokens=tokens // 5)
+    option_path = ",".join(f"{key}={value}" for key, value in options.items())
+    model = AIModel({
+        "base_url": f"http://127.0.0.1:{port}/{option_path}/v1",
+        "api_key": "mock",
+        "model": "deepseek-reasoner",
+        "max_tokens": 8192,
+        "cache_enabled": False,
+        "pool_maxsize": max(concurrency, TRANSPORT_CONFIG["pool_maxsize"]),
+    })
+
+    if trace_memory:
+        tracemalloc.start()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(
+            lambda i: run_stream(model, f"benchmark {name} {i}"), range(concurrency)
+        ))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    ttfts = [r["ttft"] for r in results if r["ttft"] is not None]
+    completed = sum(r["status"] == "complete" for r in results)
+    return {
+        "name": name,
+        "tokens": tokens,
+        "concurrency": concurrency,
+        "mock_options": mock_options,
+        "completed": completed,
+        "errors": concurrency - completed,
+        "events": sum(r["events"] for r in results),
+        "wall_seconds": wall,
+        "cpu_seconds": cpu,
+        "throughput": tokens * completed / wall if wall > 0 else None,
+        "ttft": {
+            "mean": sum(ttfts) / len(ttfts) if ttfts else None,
+            "p50": percentile(ttfts, 0.5),
+            "p95": percentile(ttfts, 0.95),
+            "max": max(ttfts, default=None),
+        },
+        "peak_memory_bytes": peak,
+    }
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path):
+    """与之前保存的结果对比"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {s["name"]: s for s in json.load(f)["scenarios"]}
+    print(f"\n对比 {baseline_path}（比例>1表示数值变大）")
+    for scenario in results["scenarios"]:
+        old = baseline.get(scenario["name"])
+        if old is None:
+            continue
+        ratios = []
+        for label, key in (("吞吐", ("throughput",)), ("TTFT p50", ("ttft", "p50")),
+                           ("CPU", ("cpu_seconds",)), ("内存", ("peak_memory_bytes",))):
+            new_value, old_value = scenario, old
+            for k in key:
+                new_value, old_value = new_value[k], old_value[k]
+            if new_value and old_value:
+                ratios.append(f"{label} {new_value / old_value:.2f}x")
+        print(f"{scenario['name']:<16} " + "  ".join(ratios))
+
+def main():
+    parser = argparse.ArgumentParser(description="流式端到端基准")
+    parser.add_argument("--sizes", default="1000,10000,130000", help="单流场景的输出token数，逗号分隔")
+    parser.add_argument("--concurrency", default="1,8,32", help="并发场景的流数量，逗号分隔")
+    parser.add_argument("--concurrent-tokens", type=int, default=2000, help="并发场景中每个流的输出token数")
+    parser.add_argument("--mock-options", default="",
+                        help="模拟服务选项，如rate=500,chunk_tokens=2,malformed_rate=0.001，见mock_server.DEFAULT_OPTIONS")
+    parser.add_argument("--skip-memory", action="store_true", help="跳过tracemalloc峰值内存测量")
+    parser.add_argument("--output", help="结果JSON文件")
+    parser.add_argument("--compare", help="用于对比的历史结果JSON文件")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    parse_options(args.mock_options)  # 提前检查选项名
+    mock_options = dict(item.split("=", 1) for item in filter(None, args.mock_options.split(",")))
+
+    scenarios = [(f"size-{n}", n, 1) for n in map(int, args.sizes.split(","))]
+    scenarios += [(f"concurrent-{c}", args.concurrent_tokens, c) for c in map(int, args.concurrency.split(","))]
+
+    port = _free_port()
+    server = start_mock_server(port)
+    results = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scenarios": [],
+    }
+    try:
+        print(f"{'场景':<16} {'吞吐(token/s)':>14} {'TTFT p50':>10} {'TTFT p95':>10} {'CPU(s)':>8} {'峰值内存':>10}")
+        for name, tokens, concurrency in scenarios:
+            # 计时与内存分开测量，tracemalloc会显著拖慢执行
+            record = run_scenario(port, name, tokens, concurrency, mock_options)
+            if not args.skip_memory:
+                record["peak_memory_bytes"] = run_scenario(
+                    port, name, tokens, concurrency, mock_options, trace_memory=True
+                )["peak_memory_bytes"]
+            results["scenarios"].append(record)
+            memory = f"{record['peak_memory_bytes'] / 1024 / 1024:.1f}MB" if record["peak_memory_bytes"] else "-"
+            print(f"{name:<16} {record['throughput'] or 0:>14,.0f} {record['ttft']['p50'] or 0:>10.4f} "
+                  f"{record['ttft']['p95'] or 0:>10.4f} {record['cpu_seconds']:>8.2f} {memory:>10}")
+            if record["errors"]:
+                print(f"{'':<16} 失败 {record['errors']} 个流")
+    finally:
+        server.terminate()
+        server.wait()
+
+    results["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+输出累积缓冲：按字节计数、线性时间拼接，超过上限时截断
+"""
+
+from config import OUTPUT_CONFIG
+
+def text_bytes(text):
+    """UTF-8字节数"""
+    return len(text) if text.isascii() else len(text.encode("utf-8"))
+
+def content_bytes(content):
+    """消息内容的字节数，助手回复的content为dict"""
+    if isinstance(content, dict):
+        return sum(text_bytes(value) for value in content.values() if isinstance(value, str))
+    return text_bytes(content)
+
+def truncate_bytes(text, max_bytes):
+    """截取不超过max_bytes字节的前缀，不会截断在多字节字符中间"""
+    return text.encode("utf-8")[:max_bytes].decode("utf-8", "ignore")
+
+class TextBuffer:
+    """分块文本缓冲
+
+    增量先放入尾部列表，每满COMPACT_PARTS个合并为一块，避免逐个小字符串的
+    对象开销和反复拼接的平方复杂度。text()合并后保留结果作为唯一副本。
+    """
+
+    COMPACT_PARTS = 256
+
+    def __init__(self):
+        self._chunks = []
+        self._tail = []
+        self.bytes = 0
+
+    def append(self, text, size=None):
+        """追加文本，size为已知的字节数"""
+        self._tail.append(text)
+        self.bytes += text_bytes(text) if size is None else size
+        if len(self._tail) >= self.COMPACT_PARTS:
+            self._chunks.append("".join(self._tail))
+            self._tail.clear()
+
+    def text(self):
+        """返回完整文本"""
+        if self._tail or len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks + self._tail)]
+            self._tail.clear()
+        return self._chunks[0] if self._chunks else ""
+
+    def __bool__(self):
+        return self.bytes > 0
+
+class TurnBuffer:
+    """一轮回答的累积缓冲，reasoning和response两个通道共享字节上限"""
+
+    def __init__(self, max_bytes=None):
+        """初始化缓冲
+
+        Args:
+            max_bytes (int): 两个通道合计的字节上限，默认为OUTPUT_CONFIG["max_turn_bytes"]
+        """
+        self.max_bytes = max_bytes or OUTPUT_CONFIG["max_turn_bytes"]
+        self.channels = {"reasoning": TextBuffer(), "response": TextBuffer()}
+        self.bytes = 0
+        self.truncated = False
+
+    def append(self, channel, text):
+        """追加增量
+
+        Returns:
+            str: 实际写入的部分，达到上限后为截断后的前缀或空字符串
+        """
+        if self.truncated or not text:
+            return ""
+        size = text_bytes(text)
+        if self.bytes + size > self.max_bytes:
+            text = truncate_bytes(text, self.max_bytes - self.bytes)
+            size = text_bytes(text)
+            self.truncated = True
+        if text:
+            self.channels[channel].append(text, size)
+            self.bytes += size
+        return text
+
+    def text(self, channel):
+        return self.channels[channel].text()
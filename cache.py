@@ -0,0 +1,238 @@
+"""
+响应缓存：内存LRU + SQLite持久化两级缓存
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import CACHE_CONFIG, NO_REASONING
+
+logger = logging.getLogger(__name__)
+
+def canonical_request_hash(model, messages, max_tokens):
+    """计算请求的规范化哈希
+
+    Args:
+        model (str): 模型ID
+        messages (list): _build_messages构建的消息列表
+        max_tokens (int): 最大生成长度
+
+    Returns:
+        str: sha256十六进制摘要
+    """
+    payload = json.dumps(
+        {"model": model, "messages": messages, "max_tokens": max_tokens},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """两级响应缓存
+
+    第一级为有界内存LRU，第二级为带TTL和容量上限的SQLite。
+    磁盘缓存的内容总大小在内存中随写入和删除增减，写入时不必扫描全表。
+    命中时通过replay()按与上游相同的事件协议回放。
+    """
+
+    def __init__(self, memory_entries=256, db_path=None, ttl=86400, max_db_bytes=100 * 1024 * 1024):
+        """初始化缓存
+
+        Args:
+            memory_entries (int): 内存LRU的最大条目数
+            db_path (str): SQLite文件路径，为None时只使用内存缓存
+            ttl (int): 磁盘缓存有效期（秒）
+            max_db_bytes (int): 磁盘缓存内容总大小上限（字节）
+        """
+        self.memory_entries = memory_entries
+        self.ttl = ttl
+        self.max_db_bytes = max_db_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "expired": 0,
+        }
+        self._db = None
+        self._disk_bytes = 0  # 磁盘缓存内容总大小
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, reasoning TEXT, response TEXT, "
+                "size INTEGER, created_at REAL, accessed_at REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed_at)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_created ON responses(created_at)")
+            self._db.commit()
+            self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            logger.info("响应缓存已启用，磁盘缓存: %s", db_path)
+
+    def get(self, key):
+        """查询缓存
+
+        Returns:
+            dict: 包含reasoning和response的内容，未命中时返回None
+        """
+        with self._lock:
+            content = self._memory.get(key)
+            if content is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return content
+
+            content = self._get_from_disk(key)
+            if content is not None:
+                self._stats["disk_hits"] += 1
+                self._put_memory(key, content)
+                return content
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key, content):
+        """写入缓存
+
+        Args:
+            key (str): canonical_request_hash计算的键
+            content (dict): complete事件中的reasoning和response
+        """
+        content = {"reasoning": content["reasoning"], "response": content["response"]}
+        with self._lock:
+            self._stats["stores"] += 1
+            self._put_memory(key, content)
+            if self._db is not None:
+                now = time.time()
+                size = len(content["reasoning"].encode("utf-8")) + len(content["response"].encode("utf-8"))
+                row = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self._disk_bytes += size - (row[0] if row else 0)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, content["reasoning"], content["response"], size, now, now)
+                )
+                self._evict_disk()
+                self._db.commit()
+
+    def replay(self, content):
+        """将缓存内容按流式事件协议回放"""
+        if content["reasoning"] and content["reasoning"] != NO_REASONING:
+            yield {"type": "reasoning", "content": content["reasoning"]}
+        if content["response"]:
+            yield {"type": "response", "content": content["response"]}
+        yield {"type": "complete", "content": dict(content), "cached": True}
+
+    def stats(self):
+        """返回命中率等统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            if self._db is not None:
+                count, size = self._db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()
+                stats["disk_entries"] = count
+                stats["disk_bytes"] = size
+                # 其他进程也可能写入同一个文件，以实际大小校正
+                self._disk_bytes = size
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        """清空两级缓存"""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+                self._disk_bytes = 0
+
+    def _put_memory(self, key, content):
+        self._memory[key] = content
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["memory_evictions"] += 1
+
+    def _get_from_disk(self, key):
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT reasoning, response, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        reasoning, response, created_at = row
+        now = time.time()
+        if now - created_at > self.ttl:
+            self._delete_disk(key)
+            self._db.commit()
+            self._stats["expired"] += 1
+            return None
+        self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        self._db.commit()
+        return {"reasoning": reasoning, "response": response}
+
+    def _delete_disk(self, key):
+        row = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._disk_bytes -= row[0]
+
+    def _evict_disk(self):
+        """删除过期条目，并按最近访问时间淘汰超出容量的条目
+
+        过期和淘汰都沿索引只读取要删除的行，开销与删除的条目数成正比。
+        """
+        expire_before = time.time() - self.ttl
+        count, size = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses WHERE created_at < ?", (expire_before,)
+        ).fetchone()
+        if count:
+            self._db.execute("DELETE FROM responses WHERE created_at < ?", (expire_before,))
+            self._disk_bytes -= size
+            self._stats["expired"] += count
+        while self._disk_bytes > self.max_db_bytes:
+            rows = self._db.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self._disk_bytes = 0
+                break
+            for key, size in rows:
+                if self._disk_bytes <= self.max_db_bytes:
+                    break
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._disk_bytes -= size
+                self._stats["disk_evictions"] += 1
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """获取进程内共享的响应缓存（按CACHE_CONFIG首次使用时创建）"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            db_path = CACHE_CONFIG["db_path"]
+            if db_path and not os.path.isabs(db_path):
+                db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), db_path)
+            _shared_cache = ResponseCache(
+                memory_entries=CACHE_CONFIG["memory_entries"],
+                db_path=db_path,
+                ttl=CACHE_CONFIG["ttl"],
+                max_db_bytes=CACHE_CONFIG["max_db_bytes"]
+            )
+        return _shared_cache
@@ -0,0 +1,62 @@
+"""
+取消令牌：在任意线程取消一次生成，并立即断开其上游连接
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class CancelToken:
+    """一次生成的取消令牌
+
+    持有连接的代码用register()登记断开连接的回调，cancel()在调用线程中
+    依次执行这些回调，使阻塞在读取上的线程立即返回。取消后再登记的回调
+    会被立即执行。重试前的等待用wait()代替time.sleep，取消时立即结束。
+    """
+
+    def __init__(self):
+        self._cancelled = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        """取消生成，重复调用无副作用"""
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug("取消回调执行失败: %s", str(e))
+
+    def wait(self, timeout):
+        """等待最多timeout秒，被取消时立即返回
+
+        Returns:
+            bool: 是否已被取消
+        """
+        return self._event.wait(timeout)
+
+    def register(self, callback):
+        """登记取消时执行的回调"""
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def unregister(self, callback):
+        """连接已释放后移除回调，避免取消时误断开被复用的连接"""
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
@@ -0,0 +1,71 @@
+"""
+进程级共享客户端：连接池、JSON解析器、响应缓存、请求合并和性能指标由所有会话共用
+"""
+
+import logging
+import threading
+import time
+
+from cache import get_response_cache
+from coalesce import coalescer
+from metrics import metrics
+from sse import get_json_loads
+from transport import get_async_transport, get_transport
+
+logger = logging.getLogger(__name__)
+
+class AIClient:
+    """进程内所有会话共用的资源
+
+    AIModel只保存每个会话自己的设置（API Key、模型、max_tokens等）和上下文状态，
+    创建开销可以忽略；连接池、JSON解析函数、响应缓存、请求合并和性能指标都从
+    这里取得，不随会话数量增加。
+    """
+
+    def __init__(self):
+        self.metrics = metrics
+        self.coalescer = coalescer
+        self._json_loads = {}  # 配置的后端 -> (后端名称, loads函数)
+        self._lock = threading.Lock()
+        self.created_at = time.time()
+        logger.info("创建共享客户端")
+
+    def transport(self, base_url, **options):
+        """base_url对应的共享HTTP传输，见transport.get_transport"""
+        return get_transport(base_url, **options)
+
+    def async_transport(self, base_url, **options):
+        """当前事件循环中base_url对应的共享异步HTTP传输"""
+        return get_async_transport(base_url, **options)
+
+    def json_loads(self, backend):
+        """解析后的JSON后端，每种配置只查找一次"""
+        with self._lock:
+            loads = self._json_loads.get(backend)
+            if loads is None:
+                loads = self._json_loads[backend] = get_json_loads(backend)
+            return loads
+
+    def response_cache(self):
+        return get_response_cache()
+
+    def stats(self):
+        """返回客户端的创建时间和脚本运行耗时统计
+
+        冷启动耗时见script_runs中的cold：会话第一次运行脚本到界面渲染完成。
+        """
+        return {
+            "created_at": self.created_at,
+            "script_runs": self.metrics.snapshot()["script_runs"],
+        }
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """获取进程级共享客户端，第一次使用时创建"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AIClient()
+        return _client
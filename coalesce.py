@@ -0,0 +1,228 @@
+"""
+请求合并：相同请求只向上游发起一次，流式结果分发给所有调用方
+"""
+
+import logging
+import threading
+from collections import deque
+
+from buffer import TextBuffer
+from cancel import CancelToken
+from config import COALESCE_CONFIG, NO_REASONING
+
+logger = logging.getLogger(__name__)
+
+DELTA_TYPES = ("reasoning", "response")
+
+def _merge_deltas(events):
+    """合并相邻的同类增量事件，落后的订阅者一次取走积压内容"""
+    merged = []
+    for event in events:
+        if merged and event["type"] in DELTA_TYPES and merged[-1]["type"] == event["type"]:
+            merged[-1] = {"type": event["type"], "content": merged[-1]["content"] + event["content"]}
+        else:
+            merged.append(event)
+    return merged
+
+class _Subscriber:
+    """一个订阅者：有界的待读事件队列和各通道已读到的字符数"""
+
+    def __init__(self, lagging=False, markers=()):
+        self.queue = deque(markers)
+        self.sent = {channel: 0 for channel in DELTA_TYPES}
+        self.lagging = lagging  # 队列溢出或中途加入，需要从已收到的文本追赶
+        self.left = False
+
+class _Flight:
+    """一个正在进行的上游请求
+
+    已收到的增量按通道累积为分块文本（与TurnBuffer相同），不保存逐个事件；
+    增量之外的事件（截断、完成、出错）只出现在流的末尾，数量很少，单独保存。
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.text = {channel: TextBuffer() for channel in DELTA_TYPES}
+        self.markers = []  # 增量之外的事件
+        self.done = False
+        self.subscribers = []
+        self.abandoned = False  # 所有订阅者都已离开
+        self.cancel = CancelToken()  # 上游请求的取消令牌
+        self.cond = threading.Condition()
+
+    def catch_up(self, subscriber):
+        """订阅者尚未读到的文本，每个通道合并为一个增量"""
+        events = []
+        for channel in DELTA_TYPES:
+            text = self.text[channel].text()
+            if len(text) > subscriber.sent[channel]:
+                events.append({"type": channel, "content": text[subscriber.sent[channel]:]})
+        return events
+
+    def partial_complete(self, subscriber):
+        """订阅者中途取消而上游仍在为其他订阅者生成时，由它已读到的文本拼出部分结果"""
+        reasoning = self.text["reasoning"].text()[:subscriber.sent["reasoning"]]
+        return {
+            "type": "complete",
+            "content": {
+                "reasoning": reasoning if reasoning else NO_REASONING,
+                "response": self.text["response"].text()[:subscriber.sent["response"]].strip(),
+                "cancelled": True
+            },
+            "usage": None
+        }
+
+class StreamCoalescer:
+    """single-flight请求合并
+
+    第一个调用方在后台线程中启动上游生成，之后相同键的调用方直接挂到
+    这个进行中的流上：先收到已到达的前缀（每个通道合并为一个增量），再接收
+    实时增量。每个订阅者的待读队列最多积压max_lag_events个事件，慢速订阅者
+    超过后清空队列，下次读取时从累积的文本中一次追赶，不会阻塞上游或其他
+    订阅者，内存也不随流的长度增长；所有订阅者都离开（关闭或取消）后立即
+    取消上游请求。
+    """
+
+    def __init__(self, max_lag_events=None):
+        self.max_lag_events = max_lag_events or COALESCE_CONFIG["max_lag_events"]
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = {"flights": 0, "joins": 0, "cancelled": 0}
+
+    def stream(self, key, factory, cancel=None):
+        """订阅key对应的事件流
+
+        Args:
+            key (str): 请求哈希
+            factory (callable): 接收上游请求的CancelToken，返回上游事件生成器，
+                只有第一个调用方会执行
+            cancel (CancelToken): 本订阅者的取消令牌。取消后本订阅者以部分结果
+                的complete事件结束，是最后一个订阅者时同时取消上游请求
+
+        Returns:
+            generator: 事件生成器
+        """
+        subscriber = None
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                with flight.cond:
+                    # 上游正被取消时不能再加入
+                    if flight.abandoned:
+                        flight = None
+                    else:
+                        subscriber = _Subscriber(lagging=True, markers=flight.markers)
+                        flight.subscribers.append(subscriber)
+            leader = flight is None
+            if leader:
+                flight = _Flight(key)
+                subscriber = _Subscriber()
+                flight.subscribers.append(subscriber)
+                self._flights[key] = flight
+                self._stats["flights"] += 1
+            else:
+                self._stats["joins"] += 1
+                logger.info("合并相同请求，当前订阅者: %d", len(flight.subscribers))
+        if leader:
+            thread = threading.Thread(target=self._produce, args=(flight, factory), daemon=True)
+            thread.start()
+        return self._consume(flight, subscriber, cancel)
+
+    def _publish(self, flight, event):
+        """把一个事件分发给所有订阅者，调用时持有flight.cond"""
+        delta = event["type"] in DELTA_TYPES
+        if delta:
+            flight.text[event["type"]].append(event["content"])
+        else:
+            flight.markers.append(event)
+        for subscriber in flight.subscribers:
+            if not delta:
+                subscriber.queue.append(event)
+            elif subscriber.lagging:
+                continue
+            elif len(subscriber.queue) >= self.max_lag_events:
+                # 积压过多，丢弃队列中的增量，改为下次读取时从累积的文本追赶
+                subscriber.queue = deque(e for e in subscriber.queue if e["type"] not in DELTA_TYPES)
+                subscriber.lagging = True
+            else:
+                subscriber.queue.append(event)
+        flight.cond.notify_all()
+
+    def _produce(self, flight, factory):
+        upstream = factory(flight.cancel)
+        try:
+            for event in upstream:
+                with flight.cond:
+                    self._publish(flight, event)
+        except Exception as e:
+            logger.error("合并请求的上游生成出错: %s", e, exc_info=True)
+        finally:
+            upstream.close()
+            with self._lock:
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    def _leave(self, flight, subscriber):
+        """订阅者离开，最后一个离开时取消上游请求"""
+        with flight.cond:
+            if subscriber.left:
+                return
+            subscriber.left = True
+            last = not flight.done and all(other.left for other in flight.subscribers)
+            if last:
+                # 最后一个订阅者继续接收上游被取消后的部分结果
+                flight.abandoned = True
+            else:
+                flight.subscribers.remove(subscriber)
+            flight.cond.notify_all()
+        if last:
+            with self._lock:
+                self._stats["cancelled"] += 1
+                # 之后的相同请求不能再挂到被取消的上游上
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+            logger.info("请求的所有订阅者已离开，取消上游请求")
+            flight.cancel.cancel()
+
+    def _consume(self, flight, subscriber, cancel=None):
+        leave = lambda: self._leave(flight, subscriber)
+        # 已取消，而上游仍在为其他订阅者生成，不再等待
+        detached = lambda: subscriber.left and not flight.abandoned
+        if cancel is not None:
+            cancel.register(leave)
+        try:
+            while True:
+                with flight.cond:
+                    while not subscriber.queue and not subscriber.lagging and not flight.done and not detached():
+                        flight.cond.wait()
+                    batch = flight.catch_up(subscriber) if subscriber.lagging else []
+                    subscriber.lagging = False
+                    batch.extend(subscriber.queue)
+                    subscriber.queue.clear()
+                    for event in batch:
+                        if event["type"] in DELTA_TYPES:
+                            subscriber.sent[event["type"]] += len(event["content"])
+                    done = flight.done
+                    partial = None if done or not detached() else flight.partial_complete(subscriber)
+                yield from _merge_deltas(batch)
+                if partial is not None:
+                    yield partial
+                    return
+                if done:
+                    return
+        finally:
+            if cancel is not None:
+                cancel.unregister(leave)
+            leave()
+
+    def stats(self):
+        """返回上游请求数、合并次数和进行中的请求数"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._flights)
+        return stats
+
+coalescer = StreamCoalescer()
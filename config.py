@@ -16,6 +16,149 @@ DEFAULT_API_CONFIG = {
     "max_tokens": 8192,
 }
 
+# HTTP传输配置（按base_url共享连接池）
+TRANSPORT_CONFIG = {
+    "pool_connections": 10,  # 缓存的主机连接池数量
+    "pool_maxsize": 20,  # 每个主机的最大保持连接数
+    "async_max_connections": 1000,  # 异步客户端的最大并发连接数
+    "connect_timeout": 10,  # 建立连接超时（秒）
+    "first_byte_timeout": 300,  # 等待首个字节超时（秒），推理模型首字可能较慢
+    "idle_timeout": 60,  # 数据块之间的空闲超时（秒）
+}
+
+# 流式解析配置
+STREAM_CONFIG = {
+    "json_backend": "auto",  # auto优先使用已安装的orjson/ujson，也可指定json
+    "include_usage": True,  # 请求stream_options.include_usage，在流末尾返回token用量和前缀缓存命中情况
+}
+
+# 响应缓存配置（默认关闭，可在侧边栏开启）
+CACHE_CONFIG = {
+    "enabled": False,
+    "memory_entries": 256,  # 内存LRU条目数
+    "db_path": "response_cache.db",  # SQLite缓存文件，相对路径基于项目目录
+    "ttl": 24 * 3600,  # 磁盘缓存有效期（秒）
+    "max_db_bytes": 100 * 1024 * 1024,  # 磁盘缓存内容总大小上限
+}
+
+# 输出大小上限：单轮回答（思考过程+回答）超过max_turn_bytes时截断，
+# 会话在内存中保留的历史消息超过max_session_bytes时移出较早的消息（仍保存在会话存储中）
+OUTPUT_CONFIG = {
+    "max_turn_bytes": 4 * 1024 * 1024,
+    "max_session_bytes": 32 * 1024 * 1024,
+}
+
+# 请求合并：相同请求（模型、消息、max_tokens、地址与Key均相同）同时进行时只请求上游一次
+# 为了让中途加入的调用方取得已到达的前缀，合并中的请求要另外保存一份本轮文本；
+# 大多数请求不会与其他请求重复，默认关闭，相同请求很多时（如网关、批量任务）再开启
+COALESCE_CONFIG = {
+    "enabled": False,
+    "max_lag_events": 256,  # 每个订阅者最多积压的事件数，超过后改为从已收到的文本一次追赶
+}
+
+# 流式输出渲染配置
+RENDER_CONFIG = {
+    "fps": 10,  # 每秒最多刷新界面的次数
+    "flush_chars": 2000,  # 暂存字符数达到该值时立即刷新
+    "show_stats": False,  # 是否显示渲染次数与数据块数
+}
+
+# 多模型对比：同一问题同时发给多个模型，每个模型在一个工作线程中读取
+COMPARE_CONFIG = {
+    "max_workers": 6,  # 同时请求的模型数上限，也是一次最多可选的对比模型数
+}
+
+# 会话存储配置
+STORAGE_CONFIG = {
+    "db_path": "conversations.db",  # SQLite文件，相对路径基于项目目录
+    "page_size": 20,  # 界面每页显示的消息数
+    "context_messages": 100,  # 内存中保留、用于构建请求上下文的最近消息数
+}
+
+# 多端点路由：除侧边栏设置的base_url外，额外可用的OpenAI兼容端点
+# 每个端点可用api_key或api_key_env提供密钥，models为模型ID映射（只服务映射中的模型）
+# 示例：
+# {
+#     "name": "dashscope",
+#     "base_url": "https://dashscope.aliyuncs.com/compatible-mode/v1",
+#     "api_key_env": "DASHSCOPE_API_KEY",
+#     "models": {"deepseek-reasoner": "deepseek-r1", "deepseek-chat": "deepseek-v3"},
+# }
+ENDPOINTS = []
+
+# 路由健康度配置
+ROUTING_CONFIG = {
+    "ewma_alpha": 0.3,  # 指数加权平均的平滑系数
+    "initial_ttft": 2.0,  # 无历史数据时假定的首字耗时（秒）
+    "error_penalty": 4,  # 错误率对得分的放大系数
+    "eject_consecutive_failures": 3,  # 连续失败多少次后摘除
+    "eject_error_rate": 0.5,  # 错误率超过该值后摘除
+    "min_requests": 5,  # 按错误率摘除前的最少请求数
+    "eject_seconds": 30,  # 首次摘除时长，之后按次数翻倍
+    "max_eject_seconds": 600,  # 最长摘除时长
+    "probe_interval": 10,  # 摘除到期后探测请求的最小间隔（秒）
+    "rate_limit_cooldown": 10,  # 429且无Retry-After时的冷却时间（秒）
+}
+
+# 重试与熔断配置
+RESILIENCE_CONFIG = {
+    "backoff_base": 1,  # 指数退避基数（秒）
+    "backoff_cap": 20,  # 单次退避上限（秒）
+    "max_retry_after": 60,  # 最多遵守的Retry-After时长（秒）
+    "retry_budget_ratio": 0.2,  # 重试量最多为请求量的比例
+    "retry_budget_min": 10,  # 启动时的初始重试令牌
+    "retry_budget_max": 100,  # 重试令牌上限
+    "breaker_failure_threshold": 5,  # 连续失败多少次后熔断
+    "breaker_open_seconds": 30,  # 熔断持续时间（秒）
+    "breaker_trial_timeout": 30,  # 半开状态的试探请求超过该时长（秒）仍无结果时，放行新的试探请求
+}
+
+# 对冲请求配置：首个token超过对冲延迟仍未到达时，向备用模型或端点发出同样的请求
+HEDGE_CONFIG = {
+    "enabled": False,
+    "backup_model": None,  # 备用模型ID，None表示同一模型（配置了多端点时优先换一个端点）
+    "percentile": 0.95,  # 对冲延迟取首个token耗时的该分位数
+    "min_delay": 1.0,  # 对冲延迟下限（秒）
+    "max_delay": 20.0,  # 对冲延迟上限（秒）
+    "initial_delay": 5.0,  # 样本不足时的对冲延迟（秒）
+    "min_samples": 20,  # 按分位数计算前的最少样本数
+    "window": 200,  # 参与计算的最近请求数
+    "max_ratio": 0.05,  # 对冲请求最多为请求量的比例
+    "budget_min": 5,  # 启动时的初始对冲令牌
+    "budget_max": 50,  # 对冲令牌上限
+}
+
+# 网关配置（gateway.py）：超过并发上限的请求在有界队列中等待，队列已满、等待超时
+# 或单个客户端超过并发上限时直接返回429
+GATEWAY_CONFIG = {
+    "host": "127.0.0.1",
+    "port": 8000,
+    "max_streams": 512,  # 同时进行的生成数上限
+    "max_queue": 256,  # 等待队列长度
+    "queue_timeout": 10,  # 请求在队列中最多等待的时间（秒）
+    "max_per_client": 32,  # 单个客户端进行中和排队的请求数上限，客户端按X-Client-Id、访问Key或IP区分
+    "retry_after": 1,  # 429响应中的Retry-After（秒）
+    "drain_timeout": 30,  # 停止服务时等待进行中的生成完成的最长时间（秒）
+    "flush_interval": 0.05,  # SSE增量合并写出的最短间隔（秒），0表示每个增量立即写出
+    "access_keys": [],  # 允许访问网关的Key，为空时不校验
+    "max_body_bytes": 8 * 1024 * 1024,  # 请求体大小上限
+    "strict_params": True,  # 请求带有网关不支持的参数（如temperature、tools）时返回400，为False时忽略并记录警告
+}
+
+# 日志配置：经队列由后台线程写入，rotation为size时按max_bytes轮转，为time时按when轮转
+LOGGING_CONFIG = {
+    "level": "INFO",
+    "format": "%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s",
+    "file": "app.log",  # 相对路径基于项目目录，为空时只输出到控制台
+    "rotation": "size",
+    "max_bytes": 10 * 1024 * 1024,
+    "when": "midnight",
+    "backup_count": 5,
+    "queue_size": 10000,  # 日志队列容量，写入跟不上时丢弃新日志
+    "rate_limit_burst": 5,  # 同一位置的告警在时间窗口内最多输出的条数
+    "rate_limit_interval": 10,  # 告警限频的时间窗口（秒）
+}
+
 # 预设模型列表
 PRESET_MODELS = {
     "DeepSeek Chat": "deepseek-chat",
@@ -23,6 +166,29 @@ PRESET_MODELS = {
     "DeepSeek Code": "deepseek-coder",
 }
 
+# 模型上下文窗口（token），自定义模型可在添加时指定
+MODEL_CONTEXT_WINDOWS = {
+    "deepseek-chat": 64000,
+    "deepseek-reasoner": 64000,
+    "deepseek-coder": 16000,
+}
+
+# 上下文管理配置
+CONTEXT_CONFIG = {
+    "policy": "drop_reasoning",  # drop_reasoning / sliding_window / keep_first_last
+    "send_reasoning": False,  # 请求中是否以reasoning_content字段带上历史回答的思考过程，deepseek-reasoner不接受该字段
+    "keep_first": 2,  # keep_first_last策略下保留的开头消息数
+    "default_window": 32000,  # 未知模型的默认上下文窗口
+    "safety_margin": 512,  # 估算误差的安全余量
+    "min_input_tokens": 2048,  # 输入预算下限
+    "prefix_stable": True,  # 保持请求前缀稳定，以命中上游的前缀缓存
+    "trim_watermark": 0.75,  # prefix_stable模式下需要裁剪时，一次裁剪到预算的该比例
+    "message_cache_bytes": 64 * 1024 * 1024,  # 历史消息格式化结果和JSON片段的缓存上限
+}
+
+# 没有思考过程时complete事件中的占位文本，回放缓存和发送历史时据此识别
+NO_REASONING = "未提供思考过程"
+
 # 系统提示词
 SYSTEM_PROMPT = """你是一个专业的AI思考推理助手。你的主要职责是：
 1. 深入分析问题，提供清晰的思考过程
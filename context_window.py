@@ -0,0 +1,285 @@
+"""
+上下文窗口管理：按模型的token预算裁剪历史消息
+"""
+
+import json
+import logging
+import math
+import threading
+from collections import OrderedDict
+
+from config import CONTEXT_CONFIG, MODEL_CONTEXT_WINDOWS
+
+logger = logging.getLogger(__name__)
+
+# 可选的裁剪策略
+CONTEXT_POLICIES = {
+    "drop_reasoning": "去掉历史回答的思考过程",
+    "sliding_window": "滑动窗口（保留最近的消息）",
+    "keep_first_last": "保留开头和最近的消息",
+}
+
+class TokenEstimator:
+    """本地快速token估算器
+
+    按DeepSeek官方给出的经验值估算：1个英文字符约0.3个token，
+    1个中文字符约0.6个token。结果按文本缓存，同一条历史消息只计算一次。
+    """
+
+    ASCII_RATIO = 0.3
+    NON_ASCII_RATIO = 0.6
+    MESSAGE_OVERHEAD = 4  # 每条消息的角色和分隔符开销
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, text):
+        """估算一段文本的token数"""
+        with self._lock:
+            tokens = self._cache.get(text)
+            if tokens is not None:
+                self._cache.move_to_end(text)
+                return tokens
+        tokens = self.estimate(text)
+        with self._lock:
+            self._cache[text] = tokens
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return tokens
+
+    @classmethod
+    def estimate(cls, text):
+        """不经缓存直接估算，用于只计算一次的长文本（如生成的回答）"""
+        ascii_chars = len(text.encode("ascii", "ignore"))
+        return math.ceil(ascii_chars * cls.ASCII_RATIO + (len(text) - ascii_chars) * cls.NON_ASCII_RATIO)
+
+    def count_message(self, message):
+        """估算一条API消息的token数"""
+        tokens = self.count(message["content"]) + self.MESSAGE_OVERHEAD
+        if message.get("reasoning_content"):
+            tokens += self.count(message["reasoning_content"])
+        return tokens
+
+_estimator = TokenEstimator()
+
+def encode_json(value):
+    """紧凑、确定的JSON序列化"""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class MessageCache:
+    """历史消息的API格式与JSON片段缓存
+
+    同一条历史消息每轮都要重新发送。缓存其格式化结果和序列化后的JSON片段，
+    每条消息只格式化、序列化一次，每轮发出的前缀字节完全相同。
+    返回的消息对象在多次请求间共享，调用方不得修改。
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._formatted = OrderedDict()  # (角色, 是否带思考过程, 思考过程, 回答) -> API消息
+        self._fragments = OrderedDict()  # (角色, 内容, 思考过程) -> JSON片段
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _put(self, table, key, value, size):
+        table[key] = value
+        self._bytes += size
+        while self._bytes > self.max_bytes and (len(self._formatted) + len(self._fragments)) > 1:
+            # 先淘汰较早的片段，再淘汰格式化结果
+            victim_table = self._fragments if self._fragments else self._formatted
+            _, victim = victim_table.popitem(last=False)
+            self._bytes -= len(victim) if isinstance(victim, bytes) else len(victim["content"])
+
+    def format(self, message, include_reasoning, formatter):
+        """返回历史消息的API格式，助手回复按内容缓存"""
+        content = message["content"]
+        if not isinstance(content, dict):
+            return formatter(message, include_reasoning)
+        key = (message["role"], include_reasoning, content.get("reasoning"), content.get("response"))
+        with self._lock:
+            formatted = self._formatted.get(key)
+            if formatted is not None:
+                self._formatted.move_to_end(key)
+                return formatted
+        formatted = formatter(message, include_reasoning)
+        with self._lock:
+            self._put(self._formatted, key, formatted, len(formatted["content"]))
+        return formatted
+
+    def fragment(self, message):
+        """返回API消息序列化后的JSON片段"""
+        key = (message["role"], message["content"], message.get("reasoning_content"))
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+                self.hits += 1
+                return fragment
+        fragment = encode_json(message)
+        with self._lock:
+            self.misses += 1
+            self._put(self._fragments, key, fragment, len(fragment))
+        return fragment
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._formatted) + len(self._fragments),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+_message_cache = MessageCache(CONTEXT_CONFIG["message_cache_bytes"])
+
+def encode_request_body(data):
+    """序列化请求体，messages使用缓存的JSON片段拼接
+
+    Args:
+        data (dict): 请求体，messages中的每条消息包含role和字符串content，
+            助手消息可能带有reasoning_content
+
+    Returns:
+        bytes: JSON请求体
+    """
+    parts = []
+    for key, value in data.items():
+        if key == "messages":
+            encoded = b"[" + b",".join(_message_cache.fragment(m) for m in value) + b"]"
+        else:
+            encoded = encode_json(value)
+        parts.append(encode_json(key) + b":" + encoded)
+    return b"{" + b",".join(parts) + b"}"
+
+def get_message_cache_stats():
+    """返回消息片段缓存的统计"""
+    return _message_cache.stats()
+
+def get_context_window(model, config=None):
+    """获取模型的上下文窗口大小
+
+    优先使用配置中的context_window（自定义模型），其次是MODEL_CONTEXT_WINDOWS。
+    """
+    if config and config.get("context_window"):
+        return int(config["context_window"])
+    return MODEL_CONTEXT_WINDOWS.get(model, CONTEXT_CONFIG["default_window"])
+
+class ContextManager:
+    """按token预算构建发送给API的消息列表"""
+
+    def __init__(self, formatter, policy=None, keep_first=None, estimator=None, prefix_stable=None,
+                 send_reasoning=None):
+        """初始化上下文管理器
+
+        Args:
+            formatter (callable): formatter(message, include_reasoning)将历史消息转换为API消息
+            policy (str): 裁剪策略，见CONTEXT_POLICIES
+            keep_first (int): keep_first_last策略下保留的开头消息数
+            estimator (TokenEstimator): token估算器，默认使用进程内共享实例
+            prefix_stable (bool): 是否保持请求前缀稳定，默认为CONTEXT_CONFIG["prefix_stable"]
+            send_reasoning (bool): 是否发送历史回答的思考过程，默认为CONTEXT_CONFIG["send_reasoning"]，
+                drop_reasoning策略下始终不发送
+        """
+        self.formatter = formatter
+        self.policy = policy or CONTEXT_CONFIG["policy"]
+        if self.policy not in CONTEXT_POLICIES:
+            raise ValueError(f"未知的上下文策略: {self.policy}")
+        self.keep_first = CONTEXT_CONFIG["keep_first"] if keep_first is None else keep_first
+        self.estimator = estimator or _estimator
+        self.prefix_stable = CONTEXT_CONFIG["prefix_stable"] if prefix_stable is None else prefix_stable
+        self.send_reasoning = CONTEXT_CONFIG["send_reasoning"] if send_reasoning is None else send_reasoning
+        self.anchor = None  # 最近片段的第一条历史消息，下次构建时传入
+
+    def budget(self, window, max_tokens):
+        """计算输入token预算：上下文窗口减去为输出预留的部分"""
+        return max(window - max_tokens - CONTEXT_CONFIG["safety_margin"], CONTEXT_CONFIG["min_input_tokens"])
+
+    def build(self, system_prompt, chat_history, user_input, budget, anchor=None):
+        """构建消息列表
+
+        prefix_stable模式下，上一轮保留的最近片段（从anchor开始）仍在预算内时
+        原样保留，请求前缀不变；超出预算时一次裁剪到预算的trim_watermark比例，
+        之后若干轮的前缀保持稳定，而不是每轮都向后滑动一条。
+
+        Args:
+            system_prompt (str): 系统提示词
+            chat_history (list): 历史消息
+            user_input (str): 当前用户输入
+            budget (int): 输入token预算
+            anchor (dict): 上一次构建后的self.anchor
+
+        Returns:
+            tuple: (消息列表, 裁剪报告)
+        """
+        include_reasoning = self.send_reasoning and self.policy != "drop_reasoning"
+        head = {"role": "system", "content": system_prompt}
+        tail = {"role": "user", "content": user_input}
+        history = [_message_cache.format(msg, include_reasoning, self.formatter) for msg in chat_history]
+        counts = [self.estimator.count_message(msg) for msg in history]
+        fixed = self.estimator.count_message(head) + self.estimator.count_message(tail)
+
+        omitted_reasoning_tokens = 0
+        if not include_reasoning:
+            # 统计不发送的思考过程的token，单独报告，不算作裁剪（思考文本对象不变，估算结果可命中缓存）
+            for msg in chat_history:
+                if isinstance(msg["content"], dict) and msg["content"].get("reasoning"):
+                    omitted_reasoning_tokens += self.estimator.count(msg["content"]["reasoning"])
+
+        if self.policy == "keep_first_last":
+            first = min(self.keep_first, len(history))
+        else:
+            first = 0
+        available = budget - fixed
+        kept = None
+        if self.prefix_stable and anchor is not None:
+            start = next((i for i, msg in enumerate(chat_history) if msg is anchor), None)
+            if start is not None and start >= first and \
+                    sum(counts[:first]) + sum(counts[start:]) <= available:
+                kept = list(range(first)) + list(range(start, len(history)))
+        if kept is None:
+            if self.prefix_stable and sum(counts) > available:
+                available = int(available * CONTEXT_CONFIG["trim_watermark"])
+            kept = self._fit(history, counts, first, available)
+        recent = [i for i in kept if i >= first]
+        self.anchor = chat_history[recent[0]] if recent else None
+        kept_history = [history[i] for i in kept]
+        kept_tokens = sum(counts[i] for i in kept)
+
+        report = {
+            "policy": self.policy,
+            "budget": budget,
+            "input_tokens": kept_tokens + fixed,
+            "trimmed_tokens": sum(counts) - kept_tokens,  # 只计被丢弃的消息
+            "dropped_messages": len(history) - len(kept),
+            "omitted_reasoning_tokens": omitted_reasoning_tokens,
+        }
+        return [head] + kept_history + [tail], report
+
+    @staticmethod
+    def _fit(history, counts, first, available):
+        """选择保留的历史消息下标
+
+        保留开头的first条（预算允许时），再从最近的消息往前尽量多保留。
+        """
+        kept_first = []
+        for i in range(first):
+            if counts[i] > available:
+                break
+            kept_first.append(i)
+            available -= counts[i]
+        kept_last = []
+        for i in range(len(history) - 1, len(kept_first) - 1, -1):
+            if counts[i] > available:
+                break
+            kept_last.append(i)
+            available -= counts[i]
+        kept_last.reverse()
+        # 中间有消息被丢弃时，让最近片段从用户消息开始，避免角色顺序错乱
+        if kept_last and kept_last[0] != len(kept_first):
+            while kept_last and history[kept_last[0]]["role"] != "user":
+                kept_last.pop(0)
+        return kept_first + kept_last
@@ -0,0 +1,521 @@
+"""
+OpenAI兼容的流式网关：通过HTTP提供AIModel的思考/回答拆分、重试、路由、缓存和并发控制
+
+用法：
+    python gateway.py --port 8000
+
+POST /v1/chat/completions的请求和响应格式与OpenAI接口相同，stream为true时以SSE
+返回，思考过程放在delta.reasoning_content，回答放在delta.content。客户端的messages
+按原顺序转发，不加界面的系统提示词，也不裁剪历史；网关不支持的参数返回400。
+GET /health返回运行状态（排空时为503），GET /metrics导出Prometheus指标。
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+
+from aiohttp import web
+
+from client import get_client
+from config import DEFAULT_API_CONFIG, GATEWAY_CONFIG, PRESET_MODELS
+from log_setup import setup_logging
+from transport import close_async_transports
+from utils import AIModel
+
+logger = logging.getLogger(__name__)
+
+# 网关处理的请求参数，其余参数不会转发给上游
+SUPPORTED_PARAMS = {"model", "messages", "stream", "stream_options", "max_tokens", "max_completion_tokens"}
+MESSAGE_FIELDS = {"role", "content", "reasoning_content"}
+
+class Overloaded(Exception):
+    """请求未被接纳，reason为client、queue、timeout或draining"""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+class AdmissionControl:
+    """网关的并发准入控制
+
+    同时进行的生成数不超过max_streams，超出的请求在长度为max_queue的队列中
+    等待，队列已满或等待超过queue_timeout时拒绝。每个客户端进行中和排队的
+    请求数不超过max_per_client，避免单个客户端占满队列。只在事件循环线程中使用。
+    """
+
+    def __init__(self, max_streams, max_queue, queue_timeout, max_per_client):
+        self.max_streams = max_streams
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_per_client = max_per_client
+        self._slots = asyncio.Semaphore(max_streams)
+        self._clients = {}  # 客户端 -> 进行中和排队的请求数
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = {"client": 0, "queue": 0, "timeout": 0, "draining": 0}
+        self.draining = False
+
+    def _reject(self, reason, message):
+        self.rejected[reason] += 1
+        raise Overloaded(reason, message)
+
+    def _leave(self, client_id):
+        count = self._clients[client_id] - 1
+        if count:
+            self._clients[client_id] = count
+        else:
+            del self._clients[client_id]
+        if not self._clients:
+            self._idle.set()
+
+    async def acquire(self, client_id):
+        """取得一个生成名额，不能接纳时抛出Overloaded"""
+        if self.draining:
+            self._reject("draining", "网关正在停止，请稍后重试")
+        if self._clients.get(client_id, 0) >= self.max_per_client:
+            self._reject("client", f"同一客户端最多同时进行{self.max_per_client}个请求")
+        # 按计数同步判定，不依赖信号量状态：同时到达的请求在await之前都已计入queued
+        if self.active + self.queued >= self.max_streams + self.max_queue:
+            self._reject("queue", "网关繁忙，请稍后重试")
+        self._clients[client_id] = self._clients.get(client_id, 0) + 1
+        self._idle.clear()
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._leave(client_id)
+            self._reject("timeout", "网关繁忙，排队超时")
+        except BaseException:
+            self._leave(client_id)
+            raise
+        finally:
+            self.queued -= 1
+        self.active += 1
+        self.admitted += 1
+
+    def release(self, client_id):
+        self.active -= 1
+        self._slots.release()
+        self._leave(client_id)
+
+    async def drain(self, timeout):
+        """停止接纳新请求，等待进行中和排队的请求结束
+
+        Returns:
+            bool: 超时前是否全部结束
+        """
+        self.draining = True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "clients": len(self._clients),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "max_streams": self.max_streams,
+            "max_queue": self.max_queue,
+        }
+
+def parse_messages(messages):
+    """校验OpenAI格式的messages，转换为发送给上游的消息列表
+
+    消息的顺序、角色和文本保持不变，不加系统提示词，也不按上下文窗口裁剪。
+    多段内容拼接为一个字符串，developer角色按system发送。网关无法转发的
+    内容（非文本片段、工具调用等字段）作为错误返回，不会被静默丢弃。
+
+    Returns:
+        list: 消息列表，每条包含role和字符串content，助手消息可能带有reasoning_content
+
+    Raises:
+        ValueError: 消息格式不正确或包含不支持的内容
+    """
+    if not isinstance(messages, list) or not messages:
+        raise ValueError("messages不能为空")
+    result = []
+    for message in messages:
+        if not isinstance(message, dict):
+            raise ValueError("messages中的每一项都必须是对象")
+        unsupported = sorted(set(message) - MESSAGE_FIELDS)
+        if unsupported:
+            raise ValueError(f"不支持的消息字段: {', '.join(unsupported)}")
+        role, content = message.get("role"), message.get("content")
+        if role not in ("system", "developer", "user", "assistant"):
+            raise ValueError(f"不支持的消息角色: {role}")
+        if isinstance(content, list):
+            if any(not isinstance(part, dict) or part.get("type") != "text" for part in content):
+                raise ValueError("消息内容只支持文本")
+            content = "".join(part.get("text", "") for part in content)
+        elif content is not None and not isinstance(content, str):
+            raise ValueError("消息内容必须是字符串或文本片段列表")
+        converted = {"role": "system" if role == "developer" else role, "content": content or ""}
+        if role == "assistant" and message.get("reasoning_content"):
+            converted["reasoning_content"] = message["reasoning_content"]
+        result.append(converted)
+    return result
+
+def openai_usage(usage):
+    """把normalize_usage的结果转换为OpenAI的usage格式"""
+    if not usage:
+        return None
+    prompt_tokens = usage["prompt_tokens"] or 0
+    completion_tokens = usage["completion_tokens"] or 0
+    result = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+    if usage["cache_hit_tokens"] is not None:
+        result["prompt_tokens_details"] = {"cached_tokens": usage["cache_hit_tokens"]}
+    return result
+
+def _sse(payload):
+    return b"data: " + json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n\n"
+
+def _error_response(status, message, error_type, retry_after=None):
+    headers = {"Retry-After": str(retry_after)} if retry_after is not None else None
+    return web.json_response(
+        {"error": {"message": message, "type": error_type}},
+        status=status, headers=headers, dumps=lambda obj: json.dumps(obj, ensure_ascii=False)
+    )
+
+async def _next_event(events):
+    try:
+        return await events.__anext__()
+    except StopAsyncIteration:
+        return None
+
+def _finish_reason(content):
+    return "length" if content.get("truncated") else "stop"
+
+class DeltaBatcher:
+    """合并写出SSE增量
+
+    每个增量单独写出时每个token都是一次send系统调用，并发流多时成为网关的
+    主要开销。距上次写出不足interval秒时增量先暂存，相邻的同类增量合并为
+    一个数据块；间隔内没有新增量时由定时器写出暂存部分，上游停顿时已收到的
+    内容不会被压住。写出较慢时push会等待，对上游形成背压。
+    """
+
+    def __init__(self, response, base, interval):
+        self.response = response
+        self.base = base
+        self.interval = interval
+        self._pending = []  # [(字段, [文本...])]
+        self._last_flush = 0.0
+        self._timer = None
+        self._timed_flush = None
+        self._error = None  # 定时写出时客户端已断开
+        self._lock = asyncio.Lock()
+
+    async def push(self, field, text):
+        """追加一个增量，距上次写出超过interval时立即写出"""
+        if self._error is not None:
+            raise self._error
+        if self._pending and self._pending[-1][0] == field:
+            self._pending[-1][1].append(text)
+        else:
+            self._pending.append((field, [text]))
+        delay = self._last_flush + self.interval - time.monotonic()
+        if delay <= 0:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._timed_flush = asyncio.ensure_future(self._flush_quietly())
+
+    async def _flush_quietly(self):
+        try:
+            await self.flush()
+        except ConnectionResetError as e:
+            # 由下一次push或flush在处理请求的任务中抛出
+            self._error = e
+
+    async def flush(self, tail=b""):
+        """写出所有暂存的增量，tail紧随其后在同一次写出中发送"""
+        async with self._lock:
+            if self._error is not None:
+                raise self._error
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            pending, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+            data = b"".join(
+                _sse({**self.base, "choices": [{"index": 0, "delta": {field: "".join(parts)}, "finish_reason": None}]})
+                for field, parts in pending
+            ) + tail
+            if data:
+                await self.response.write(data)
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._timed_flush is not None:
+            self._timed_flush.cancel()
+
+class Gateway:
+    """网关服务
+
+    每个请求按请求中的model和max_tokens创建一个AIModel，连接池、响应缓存、
+    请求合并和指标由进程级共享客户端提供。
+    """
+
+    def __init__(self, api_config, config=None):
+        self.api_config = api_config
+        self.config = {**GATEWAY_CONFIG, **(config or {})}
+        self.admission = AdmissionControl(
+            self.config["max_streams"], self.config["max_queue"],
+            self.config["queue_timeout"], self.config["max_per_client"]
+        )
+        self.started = time.time()
+
+    def _authorize(self, request):
+        """校验访问Key，返回客户端标识，未通过时返回None
+
+        配置了访问Key时按Key区分客户端，否则依次使用X-Client-Id、请求中的Key和IP。
+        """
+        auth = request.headers.get("Authorization", "")
+        key = auth[7:].strip() if auth.lower().startswith("bearer ") else ""
+        if self.config["access_keys"]:
+            return key if key in self.config["access_keys"] else None
+        return request.headers.get("X-Client-Id") or key or request.remote or "unknown"
+
+    def _check_params(self, body):
+        """检查请求中网关不支持的参数
+
+        strict_params为True时抛出ValueError，否则记录警告后忽略这些参数。
+        """
+        unsupported = sorted(set(body) - SUPPORTED_PARAMS)
+        if not unsupported:
+            return
+        if self.config["strict_params"]:
+            raise ValueError(f"网关不支持的参数: {', '.join(unsupported)}")
+        logger.warning("忽略网关不支持的参数: %s", ", ".join(unsupported))
+
+    def _create_model(self, body):
+        max_tokens = body.get("max_completion_tokens") or body.get("max_tokens")
+        config = {
+            **self.api_config,
+            "model": body.get("model") or self.api_config["model"],
+            "max_tokens": int(max_tokens or self.api_config["max_tokens"]),
+        }
+        return AIModel(config)
+
+    async def chat_completions(self, request):
+        client_id = self._authorize(request)
+        if client_id is None:
+            return _error_response(401, "访问Key无效", "invalid_request_error")
+        try:
+            body = await request.json()
+            if not isinstance(body, dict):
+                raise ValueError("请求体必须是JSON对象")
+            self._check_params(body)
+            messages = parse_messages(body.get("messages"))
+            model = self._create_model(body)
+        except (ValueError, TypeError) as e:
+            return _error_response(400, f"请求格式错误: {e}", "invalid_request_error")
+
+        try:
+            await self.admission.acquire(client_id)
+        except Overloaded as e:
+            status = 503 if e.reason == "draining" else 429
+            return _error_response(status, str(e), "rate_limit_exceeded", self.config["retry_after"])
+        try:
+            events = model.agenerate_response_stream(None, messages=messages)
+            try:
+                if body.get("stream"):
+                    return await self._stream(request, body, model, events)
+                return await self._complete(model, events)
+            finally:
+                await events.aclose()
+        finally:
+            self.admission.release(client_id)
+
+    @staticmethod
+    def _completion_base(model, object_type):
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": object_type,
+            "created": int(time.time()),
+            "model": model.config["model"],
+        }
+
+    async def _stream(self, request, body, model, events):
+        """以SSE返回
+
+        上游首个事件到达后才发送响应头，连接建立前的错误以HTTP状态码返回。
+        客户端断开时关闭事件流，上游连接随之断开。
+        """
+        first = await _next_event(events)
+        if first is None or first["type"] == "error":
+            message = first["content"]["reasoning"] if first else "上游没有返回内容"
+            return _error_response(502, message, "upstream_error")
+
+        base = self._completion_base(model, "chat.completion.chunk")
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+        })
+        await response.prepare(request)
+        batcher = DeltaBatcher(response, base, self.config["flush_interval"])
+        try:
+            await response.write(_sse({**base, "choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}]}))
+            tail = []
+            event = first
+            while event is not None:
+                if event["type"] in ("reasoning", "response"):
+                    field = "reasoning_content" if event["type"] == "reasoning" else "content"
+                    await batcher.push(field, event["content"])
+                elif event["type"] == "complete":
+                    tail.append(_sse({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": _finish_reason(event["content"])}]}))
+                    if include_usage:
+                        tail.append(_sse({**base, "choices": [], "usage": openai_usage(event.get("usage"))}))
+                elif event["type"] == "error":
+                    # 响应头已发送，错误以流中的error对象返回
+                    tail.append(_sse({"error": {"message": event["content"]["reasoning"], "type": "upstream_error"}}))
+                event = await _next_event(events)
+            tail.append(b"data: [DONE]\n\n")
+            await batcher.flush(b"".join(tail))
+            await response.write_eof()
+        except ConnectionResetError:
+            logger.info("客户端已断开，停止生成")
+        finally:
+            batcher.close()
+        return response
+
+    async def _complete(self, model, events):
+        """非流式请求：合并全部增量后一次返回"""
+        parts = {"reasoning": [], "response": []}
+        async for event in events:
+            if event["type"] in parts:
+                parts[event["type"]].append(event["content"])
+            elif event["type"] == "error":
+                return _error_response(502, event["content"]["reasoning"], "upstream_error")
+            elif event["type"] == "complete":
+                message = {"role": "assistant", "content": "".join(parts["response"])}
+                if parts["reasoning"]:
+                    message["reasoning_content"] = "".join(parts["reasoning"])
+                return web.json_response({
+                    **self._completion_base(model, "chat.completion"),
+                    "choices": [{"index": 0, "message": message, "finish_reason": _finish_reason(event["content"])}],
+                    "usage": openai_usage(event.get("usage")),
+                }, dumps=lambda obj: json.dumps(obj, ensure_ascii=False))
+        return _error_response(502, "上游没有返回内容", "upstream_error")
+
+    async def models(self, request):
+        if self._authorize(request) is None:
+            return _error_response(401, "访问Key无效", "invalid_request_error")
+        model_ids = dict.fromkeys([self.api_config["model"], *PRESET_MODELS.values()])
+        return web.json_response({
+            "object": "list",
+            "data": [{"id": model_id, "object": "model", "owned_by": "think_ai_chat"} for model_id in model_ids],
+        })
+
+    async def health(self, request):
+        stats = self.admission.stats()
+        status = "draining" if self.admission.draining else "ok"
+        return web.json_response(
+            {"status": status, "uptime": time.time() - self.started, **stats},
+            status=503 if self.admission.draining else 200
+        )
+
+    async def metrics(self, request):
+        stats = self.admission.stats()
+        lines = [
+            "# HELP think_ai_gateway_active_streams 网关进行中的生成数",
+            "# TYPE think_ai_gateway_active_streams gauge",
+            f"think_ai_gateway_active_streams {stats['active']}",
+            "# HELP think_ai_gateway_queued_requests 网关排队中的请求数",
+            "# TYPE think_ai_gateway_queued_requests gauge",
+            f"think_ai_gateway_queued_requests {stats['queued']}",
+            "# HELP think_ai_gateway_admitted_total 网关接纳的请求数",
+            "# TYPE think_ai_gateway_admitted_total counter",
+            f"think_ai_gateway_admitted_total {stats['admitted']}",
+            "# HELP think_ai_gateway_rejected_total 网关拒绝的请求数",
+            "# TYPE think_ai_gateway_rejected_total counter",
+        ]
+        for reason, n in stats["rejected"].items():
+            lines.append(f'think_ai_gateway_rejected_total{{reason="{reason}"}} {n}')
+        text = get_client().metrics.render_prometheus() + "\n".join(lines) + "\n"
+        return web.Response(text=text, content_type="text/plain", charset="utf-8")
+
+    async def on_shutdown(self, app):
+        """停止监听后排空：拒绝新请求，等待进行中的生成结束"""
+        stats = self.admission.stats()
+        logger.info("网关停止，等待%d个进行中和%d个排队的请求结束", stats["active"], stats["queued"])
+        if not await self.admission.drain(self.config["drain_timeout"]):
+            logger.warning("等待超过%d秒，剩余%d个请求将被中断", self.config["drain_timeout"], self.admission.active)
+
+    async def on_cleanup(self, app):
+        await close_async_transports()
+
+    def make_app(self):
+        app = web.Application(client_max_size=self.config["max_body_bytes"])
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/chat/completions", self.chat_completions)
+        app.router.add_get("/v1/models", self.models)
+        app.router.add_get("/health", self.health)
+        app.router.add_get("/metrics", self.metrics)
+        app.on_shutdown.append(self.on_shutdown)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI兼容的流式网关")
+    parser.add_argument("--host", default=GATEWAY_CONFIG["host"])
+    parser.add_argument("--port", type=int, default=GATEWAY_CONFIG["port"])
+    parser.add_argument("--model", default=list(PRESET_MODELS.values())[0], help="请求未指定model时使用的模型ID")
+    parser.add_argument("--base-url", default=DEFAULT_API_CONFIG["base_url"], help="API基础地址")
+    parser.add_argument("--api-key", default=None, help="上游API Key，默认读取环境变量DEEPSEEK_API_KEY")
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_API_CONFIG["max_tokens"], help="请求未指定max_tokens时的最大生成长度")
+    parser.add_argument("--max-streams", type=int, default=GATEWAY_CONFIG["max_streams"], help="同时进行的生成数上限")
+    parser.add_argument("--max-per-client", type=int, default=GATEWAY_CONFIG["max_per_client"], help="单个客户端的并发上限")
+    parser.add_argument("--access-key", action="append", default=None, help="允许访问网关的Key，可指定多次")
+    args = parser.parse_args()
+    setup_logging()
+
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    api_key = args.api_key or os.getenv("DEEPSEEK_API_KEY")
+    if not api_key:
+        parser.error("请通过--api-key或环境变量DEEPSEEK_API_KEY提供API Key")
+
+    gateway = Gateway({
+        "base_url": args.base_url,
+        "api_key": api_key,
+        "model": args.model,
+        "max_tokens": args.max_tokens,
+    }, {
+        "max_streams": args.max_streams,
+        "max_per_client": args.max_per_client,
+        "access_keys": args.access_key or GATEWAY_CONFIG["access_keys"],
+    })
+    logger.info("网关运行于 http://%s:%d/v1", args.host, args.port)
+    # 排空在on_shutdown中完成，之后剩余的连接直接关闭
+    web.run_app(gateway.make_app(), host=args.host, port=args.port, shutdown_timeout=1, print=None)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""
+对冲请求：首个token迟迟未到时向备用模型或端点发出同样的请求，先出token者胜出
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from cancel import CancelToken
+from config import HEDGE_CONFIG
+from resilience import RetryBudget
+
+logger = logging.getLogger(__name__)
+
+PRIMARY = "primary"
+BACKUP = "backup"
+
+_DONE = object()
+
+class HedgePolicy:
+    """单个模型的对冲策略
+
+    对冲延迟取最近window次请求首个token耗时的percentile分位数，限制在
+    [min_delay, max_delay]内，样本不足min_samples时使用initial_delay。
+    对冲次数受令牌桶限制：每个请求存入max_ratio个令牌，每次对冲消耗一个，
+    额外的上游开销不超过请求量的max_ratio倍。
+    """
+
+    def __init__(self, model, config=None):
+        self.model = model
+        self.config = {**HEDGE_CONFIG, **(config or {})}
+        self._ttfts = deque(maxlen=self.config["window"])
+        self._budget = RetryBudget(self.config["max_ratio"], self.config["budget_min"], self.config["budget_max"])
+        self._lock = threading.Lock()
+        self.hedges = 0
+        self.wins = {PRIMARY: 0, BACKUP: 0}
+
+    def delay(self):
+        """当前的对冲延迟（秒）"""
+        with self._lock:
+            samples = sorted(self._ttfts)
+        if len(samples) < self.config["min_samples"]:
+            return self.config["initial_delay"]
+        value = samples[min(len(samples) - 1, int(self.config["percentile"] * len(samples)))]
+        return min(self.config["max_delay"], max(self.config["min_delay"], value))
+
+    def record_request(self):
+        self._budget.record_request()
+
+    def try_hedge(self):
+        """尝试取得一次对冲的预算"""
+        if not self._budget.try_acquire():
+            return False
+        with self._lock:
+            self.hedges += 1
+        return True
+
+    def record_ttft(self, seconds):
+        """记录主请求首个token的耗时，主请求输掉时为取消时已等待的时长"""
+        with self._lock:
+            self._ttfts.append(seconds)
+
+    def record_win(self, winner):
+        with self._lock:
+            self.wins[winner] += 1
+
+    def stats(self):
+        budget = self._budget.stats()
+        delay = self.delay()
+        with self._lock:
+            return {
+                "model": self.model,
+                "requests": budget["requests"],
+                "hedges": self.hedges,
+                "hedge_rate": self.hedges / budget["requests"] if budget["requests"] else 0.0,
+                "wins": dict(self.wins),
+                "budget_exhausted": budget["exhausted"],
+                "delay": round(delay, 3),
+            }
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+def get_hedge_policy(model):
+    """获取模型对应的共享对冲策略"""
+    with _policies_lock:
+        policy = _policies.get(model)
+        if policy is None:
+            policy = HedgePolicy(model)
+            _policies[model] = policy
+        return policy
+
+def get_hedge_stats():
+    """返回所有模型的对冲统计"""
+    with _policies_lock:
+        policies = list(_policies.values())
+    return [policy.stats() for policy in policies]
+
+def _first_token(event):
+    """胜负以首个事件判定：内容、完成或截断事件，error事件表示这一路失败"""
+    return event["type"] != "error"
+
+def _record_outcome(policy, hedged, winner, first, started):
+    """记录胜出方和主请求的首个token耗时
+
+    备用请求胜出时主请求被取消，已等待的时长作为其首个token耗时的下界记录。
+    """
+    if hedged:
+        policy.record_win(winner)
+    if first is not None and _first_token(first):
+        policy.record_ttft(time.monotonic() - started)
+
+def _run_racer(name, factory, token, events):
+    """在后台线程中消费一路事件流，放入共享队列"""
+    stream = factory(token)
+    try:
+        for event in stream:
+            events.put((name, event))
+    except Exception as e:
+        logger.warning("对冲请求%s异常退出: %s", name, str(e))
+    finally:
+        stream.close()
+        events.put((name, _DONE))
+
+def race_streams(primary, backup, policy, cancel=None):
+    """对冲地消费事件流
+
+    主请求在后台线程中运行，超过对冲延迟仍没有首个事件且预算允许时，
+    启动备用请求。先产生首个事件的一路胜出，另一路的令牌被取消，
+    其连接立即断开。一路在首个事件前失败时继续等待另一路。
+
+    Args:
+        primary (callable): 接收CancelToken，返回主请求事件生成器
+        backup (callable): 接收CancelToken，返回备用请求事件生成器
+        policy (HedgePolicy): 对冲策略
+        cancel (CancelToken): 整个请求的取消令牌，取消时两路都被取消，
+            胜出一路以部分结果结束
+
+    Yields:
+        dict: 胜出一路的事件
+    """
+    events = queue.Queue()
+    tokens = {PRIMARY: CancelToken(), BACKUP: CancelToken()}
+    factories = {PRIMARY: primary, BACKUP: backup}
+    running = set()
+
+    def start(name):
+        running.add(name)
+        threading.Thread(
+            target=_run_racer, args=(name, factories[name], tokens[name], events),
+            name=f"hedge-{name}", daemon=True
+        ).start()
+
+    def cancel_all():
+        for token in tokens.values():
+            token.cancel()
+
+    if cancel is not None:
+        cancel.register(cancel_all)
+    policy.record_request()
+    started = time.monotonic()
+    deadline = started + policy.delay()
+    start(PRIMARY)
+    hedged = False
+    winner = first = failed = None
+    try:
+        while winner is None:
+            timeout = None
+            if not hedged and deadline is not None:
+                timeout = max(0.0, deadline - time.monotonic())
+            try:
+                name, event = events.get(timeout=timeout)
+            except queue.Empty:
+                deadline = None
+                if policy.try_hedge():
+                    logger.info("模型%s首个token超过%.2f秒未到，发出对冲请求", policy.model, time.monotonic() - started)
+                    hedged = True
+                    start(BACKUP)
+                continue
+            if event is _DONE:
+                running.discard(name)
+                if not running:
+                    winner, first = name, failed
+                continue
+            if _first_token(event) or running == {name}:
+                winner, first = name, event
+            else:
+                failed = event
+
+        _record_outcome(policy, hedged, winner, first, started)
+        for name in running:
+            if name != winner:
+                tokens[name].cancel()
+
+        if first is not None:
+            yield first
+        while winner in running:
+            name, event = events.get()
+            if name != winner:
+                continue
+            if event is _DONE:
+                break
+            yield event
+    finally:
+        if cancel is not None:
+            cancel.unregister(cancel_all)
+        cancel_all()
+
+async def arace_streams(primary, backup, policy):
+    """race_streams的asyncio版本，两路各在一个任务中运行，输掉的任务被取消
+
+    事件经容量为1的队列传递，胜出一路仍只在调用方取走事件后才继续读取。
+
+    Args:
+        primary (callable): 返回主请求事件异步生成器
+        backup (callable): 返回备用请求事件异步生成器
+        policy (HedgePolicy): 对冲策略
+    """
+    events = asyncio.Queue(1)
+    tasks = {}
+
+    async def run(name, factory):
+        stream = factory()
+        try:
+            async for event in stream:
+                await events.put((name, event))
+        except Exception as e:
+            logger.warning("对冲请求%s异常退出: %s", name, str(e))
+        finally:
+            await stream.aclose()
+        await events.put((name, _DONE))
+
+    policy.record_request()
+    started = time.monotonic()
+    deadline = started + policy.delay()
+    tasks[PRIMARY] = asyncio.ensure_future(run(PRIMARY, primary))
+    running = {PRIMARY}
+    hedged = False
+    winner = first = failed = None
+    try:
+        while winner is None:
+            timeout = None
+            if not hedged and deadline is not None:
+                timeout = max(0.0, deadline - time.monotonic())
+            try:
+                name, event = await asyncio.wait_for(events.get(), timeout)
+            except asyncio.TimeoutError:
+                deadline = None
+                if policy.try_hedge():
+                    logger.info("模型%s首个token超过%.2f秒未到，发出对冲请求", policy.model, time.monotonic() - started)
+                    hedged = True
+                    tasks[BACKUP] = asyncio.ensure_future(run(BACKUP, backup))
+                    running.add(BACKUP)
+                continue
+            if event is _DONE:
+                running.discard(name)
+                if not running:
+                    winner, first = name, failed
+                continue
+            if _first_token(event) or running == {name}:
+                winner, first = name, event
+            else:
+                failed = event
+
+        _record_outcome(policy, hedged, winner, first, started)
+        for name, task in tasks.items():
+            if name != winner:
+                task.cancel()
+
+        if first is not None:
+            yield first
+        while winner in running:
+            name, event = await events.get()
+            if name != winner:
+                continue
+            if event is _DONE:
+                break
+            yield event
+    finally:
+        for task in tasks.values():
+            task.cancel()
@@ -0,0 +1,113 @@
+"""
+日志配置：经队列异步写入文件和控制台，文件按大小或时间轮转，重复告警限频
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+from config import LOGGING_CONFIG
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列已满时丢弃日志而不是阻塞调用线程"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class RateLimitFilter(logging.Filter):
+    """同一位置的WARNING及以上日志在interval秒内最多输出burst条
+
+    被抑制的条数附加在该位置下一条放行的日志后面。
+    """
+
+    def __init__(self, burst, interval):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._windows = {}  # (文件, 行号) -> [窗口开始时间, 已输出条数, 已抑制条数]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} [已省略{suppressed}条相同位置的日志]"
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+_listener = None
+_queue_handler = None
+_setup_lock = threading.Lock()
+
+def _file_handler(config):
+    path = config["file"]
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+    if config["rotation"] == "time":
+        return logging.handlers.TimedRotatingFileHandler(
+            path, when=config["when"], backupCount=config["backup_count"], encoding="utf-8"
+        )
+    return logging.handlers.RotatingFileHandler(
+        path, maxBytes=config["max_bytes"], backupCount=config["backup_count"], encoding="utf-8"
+    )
+
+def setup_logging(config=None):
+    """配置根日志器，重复调用不会重复添加处理器
+
+    调用线程只负责生成日志记录并放入有界队列，格式化后的写文件和控制台输出
+    由后台线程完成，磁盘I/O不会阻塞流式输出；队列满时丢弃新日志。
+
+    Args:
+        config (dict): 日志配置，默认为LOGGING_CONFIG
+    """
+    global _listener, _queue_handler
+    config = {**LOGGING_CONFIG, **(config or {})}
+    with _setup_lock:
+        if _listener is not None:
+            return
+        formatter = logging.Formatter(config["format"])
+        handlers = [logging.StreamHandler()]
+        if config["file"]:
+            handlers.append(_file_handler(config))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        _queue_handler = DroppingQueueHandler(queue.Queue(config["queue_size"]))
+        _queue_handler.addFilter(RateLimitFilter(config["rate_limit_burst"], config["rate_limit_interval"]))
+        _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        root = logging.getLogger()
+        root.setLevel(config["level"])
+        root.addHandler(_queue_handler)
+
+        # 设置第三方库的日志级别
+        logging.getLogger("requests").setLevel(logging.WARNING)
+        logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+def get_logging_stats():
+    """返回因队列已满而丢弃的日志条数"""
+    return {"dropped": _queue_handler.dropped if _queue_handler is not None else 0}
@@ -0,0 +1,356 @@
+"""
+流式请求性能指标：分阶段耗时、数据块间隔、输出速度和上游usage，按模型和端点聚合
+"""
+
+import bisect
+import threading
+import time
+from collections import deque
+
+from context_window import TokenEstimator
+
+# 各阶段含义：queue为调用到发出请求（上下文构建、缓存查询、重试等待），
+# connect为发出请求到收到响应头，其余为从调用开始到对应时刻的耗时
+PHASES = ("queue", "connect", "ttfb", "first_reasoning", "first_response", "total")
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+GAP_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+RATE_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000)
+SCRIPT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+# 界面脚本运行的类型：cold为会话的第一次运行，rerun为之后每次交互触发的重新运行
+SCRIPT_RUNS = ("cold", "rerun")
+
+def normalize_usage(usage):
+    """统一不同上游的usage字段
+
+    DeepSeek返回prompt_cache_hit_tokens/prompt_cache_miss_tokens，
+    OpenAI返回prompt_tokens_details.cached_tokens。
+
+    Returns:
+        dict: prompt_tokens、completion_tokens、cache_hit_tokens、cache_miss_tokens，
+            上游未返回usage时为None，未报告前缀缓存时对应字段为None
+    """
+    if not usage:
+        return None
+    prompt_tokens = usage.get("prompt_tokens")
+    hit = usage.get("prompt_cache_hit_tokens")
+    if hit is None:
+        hit = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    miss = usage.get("prompt_cache_miss_tokens")
+    if miss is None and hit is not None and prompt_tokens is not None:
+        miss = prompt_tokens - hit
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": usage.get("completion_tokens"),
+        "cache_hit_tokens": hit,
+        "cache_miss_tokens": miss,
+    }
+
+class Histogram:
+    """固定分桶直方图"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个桶为+Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q):
+        """按分桶上界估算分位数，落在+Inf桶时返回最大的有限上界"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+class RequestSpan:
+    """一次上游请求的计时记录"""
+
+    def __init__(self, model, endpoint, clock=time.monotonic):
+        """开始计时
+
+        Args:
+            model (str): 模型ID
+            endpoint (str): 端点名称或base_url，多端点切换时会更新
+            clock (callable): 单调时钟，便于测试
+        """
+        self.model = model
+        self.endpoint = endpoint
+        self.clock = clock
+        self.start = clock()
+        self.marks = {}
+        self.attempts = 0
+        self.gaps = Histogram(GAP_BUCKETS)
+        self.usage = None
+        self.output_tokens = None
+        self.status = None
+        self._last_chunk = None
+
+    def mark(self, name):
+        """记录某个时刻，只保留第一次"""
+        if name not in self.marks:
+            self.marks[name] = self.clock()
+
+    def begin_attempt(self, endpoint=None):
+        """开始一次上游尝试，切换端点时丢弃上一次尝试的连接计时"""
+        self.attempts += 1
+        if endpoint is not None:
+            self.endpoint = endpoint
+        self.mark("request")
+        for name in ("headers", "first_byte"):
+            self.marks.pop(name, None)
+        self.gaps = Histogram(GAP_BUCKETS)
+        self._last_chunk = None
+
+    def chunk(self):
+        """收到一个网络数据块"""
+        now = self.clock()
+        if self._last_chunk is None:
+            self.marks.setdefault("first_byte", now)
+        else:
+            self.gaps.observe(now - self._last_chunk)
+        self._last_chunk = now
+
+    def event(self, event):
+        """收到一个解析后的事件"""
+        if event["type"] == "reasoning":
+            self.mark("first_reasoning")
+        elif event["type"] == "response":
+            self.mark("first_response")
+
+    def finish(self, status, content=None):
+        """结束计时
+
+        Args:
+            status (str): complete、error或cancelled
+            content (dict): complete事件的内容，上游未返回usage时用于估算输出token数
+        """
+        self.mark("end")
+        self.status = status
+        if self.usage and self.usage.get("completion_tokens") is not None:
+            self.output_tokens = self.usage["completion_tokens"]
+        elif content:
+            reasoning = content.get("reasoning") if "first_reasoning" in self.marks else ""
+            self.output_tokens = TokenEstimator.estimate((reasoning or "") + content.get("response", ""))
+
+    def _since(self, name, origin=None):
+        if name not in self.marks:
+            return None
+        return self.marks[name] - (self.start if origin is None else self.marks.get(origin, self.start))
+
+    def durations(self):
+        """各阶段耗时（秒），未发生的阶段为None"""
+        connect = self._since("headers", "request") if "request" in self.marks else None
+        return {
+            "queue": self._since("request"),
+            "connect": connect,
+            "ttfb": self._since("first_byte"),
+            "first_reasoning": self._since("first_reasoning"),
+            "first_response": self._since("first_response"),
+            "total": self._since("end"),
+        }
+
+    def tokens_per_second(self):
+        """生成速度：输出token数除以首个token到结束的时长"""
+        firsts = [self.marks[n] for n in ("first_reasoning", "first_response") if n in self.marks]
+        if not self.output_tokens or not firsts or "end" not in self.marks:
+            return None
+        elapsed = self.marks["end"] - min(firsts)
+        return self.output_tokens / elapsed if elapsed > 0 else None
+
+    def to_dict(self):
+        return {
+            "model": self.model,
+            "endpoint": self.endpoint,
+            "status": self.status,
+            "attempts": self.attempts,
+            "durations": self.durations(),
+            "chunk_gaps": self.gaps.snapshot(),
+            "output_tokens": self.output_tokens,
+            "tokens_per_second": self.tokens_per_second(),
+            "usage": self.usage,
+        }
+
+class _Series:
+    """一个模型+端点组合的聚合指标"""
+
+    def __init__(self):
+        self.requests = {}  # status -> 次数
+        self.phases = {phase: Histogram(LATENCY_BUCKETS) for phase in PHASES}
+        self.gaps = Histogram(GAP_BUCKETS)
+        self.rate = Histogram(RATE_BUCKETS)
+        self.usage = {}  # normalize_usage的字段 -> 累计token数
+        # 按是否命中上游前缀缓存区分的首字节耗时
+        self.ttfb_by_prompt_cache = {"hit": Histogram(LATENCY_BUCKETS), "miss": Histogram(LATENCY_BUCKETS)}
+
+    def record(self, span):
+        self.requests[span.status] = self.requests.get(span.status, 0) + 1
+        for phase, value in span.durations().items():
+            if value is not None:
+                self.phases[phase].observe(value)
+        self.gaps.merge(span.gaps)
+        rate = span.tokens_per_second()
+        if rate is not None:
+            self.rate.observe(rate)
+        usage = normalize_usage(span.usage) or {}
+        for key, value in usage.items():
+            if value is not None:
+                self.usage[key] = self.usage.get(key, 0) + value
+        ttfb = span.durations()["ttfb"]
+        if ttfb is not None and usage.get("cache_hit_tokens") is not None:
+            self.ttfb_by_prompt_cache["hit" if usage["cache_hit_tokens"] > 0 else "miss"].observe(ttfb)
+
+    def snapshot(self):
+        return {
+            "requests": dict(self.requests),
+            "phases": {phase: h.snapshot() for phase, h in self.phases.items()},
+            "chunk_gaps": self.gaps.snapshot(),
+            "tokens_per_second": self.rate.snapshot(),
+            "usage": dict(self.usage),
+            "ttfb_by_prompt_cache": {k: h.snapshot() for k, h in self.ttfb_by_prompt_cache.items()},
+        }
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(**labels):
+    return ",".join(f'{key}="{_label_value(value)}"' for key, value in labels.items())
+
+def _histogram_lines(name, histogram, labels):
+    lines = []
+    cumulative = 0
+    for bound, n in zip(histogram.buckets + (float("inf"),), histogram.counts):
+        cumulative += n
+        le = "+Inf" if bound == float("inf") else repr(float(bound))
+        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
+
+class MetricsRegistry:
+    """进程内指标注册表，所有会话共享"""
+
+    def __init__(self, recent=100):
+        self._series = {}
+        self._recent = deque(maxlen=recent)
+        self._script_runs = {run: Histogram(SCRIPT_BUCKETS) for run in SCRIPT_RUNS}
+        self._lock = threading.Lock()
+
+    def start_span(self, model, endpoint):
+        """开始记录一次请求"""
+        return RequestSpan(model, endpoint)
+
+    def record(self, span):
+        """汇总一个已结束的请求"""
+        with self._lock:
+            series = self._series.get((span.model, span.endpoint))
+            if series is None:
+                series = self._series[(span.model, span.endpoint)] = _Series()
+            series.record(span)
+            self._recent.append(span.to_dict())
+
+    def record_script_run(self, seconds, cold=False):
+        """记录一次界面脚本运行的耗时（不含生成回答）"""
+        with self._lock:
+            self._script_runs["cold" if cold else "rerun"].observe(seconds)
+
+    def snapshot(self):
+        """返回按模型和端点聚合的指标
+
+        Returns:
+            dict: series为聚合指标列表，recent为最近请求的明细，
+                script_runs为界面脚本首次运行和重新运行的耗时
+        """
+        with self._lock:
+            return {
+                "series": [
+                    {"model": model, "endpoint": endpoint, **series.snapshot()}
+                    for (model, endpoint), series in self._series.items()
+                ],
+                "recent": list(self._recent),
+                "script_runs": {run: histogram.snapshot() for run, histogram in self._script_runs.items()},
+            }
+
+    def render_prometheus(self):
+        """导出Prometheus文本格式"""
+        lines = [
+            "# HELP think_ai_requests_total 上游流式请求数",
+            "# TYPE think_ai_requests_total counter",
+        ]
+        with self._lock:
+            items = list(self._series.items())
+            for (model, endpoint), series in items:
+                for status, n in series.requests.items():
+                    lines.append(f"think_ai_requests_total{{{_labels(model=model, endpoint=endpoint, status=status)}}} {n}")
+            lines += [
+                "# HELP think_ai_phase_seconds 请求各阶段耗时",
+                "# TYPE think_ai_phase_seconds histogram",
+            ]
+            for (model, endpoint), series in items:
+                for phase, histogram in series.phases.items():
+                    lines += _histogram_lines("think_ai_phase_seconds", histogram,
+                                              _labels(model=model, endpoint=endpoint, phase=phase))
+            lines += [
+                "# HELP think_ai_chunk_gap_seconds 相邻网络数据块的间隔",
+                "# TYPE think_ai_chunk_gap_seconds histogram",
+            ]
+            for (model, endpoint), series in items:
+                lines += _histogram_lines("think_ai_chunk_gap_seconds", series.gaps,
+                                          _labels(model=model, endpoint=endpoint))
+            lines += [
+                "# HELP think_ai_output_tokens_per_second 每个请求的输出速度",
+                "# TYPE think_ai_output_tokens_per_second histogram",
+            ]
+            for (model, endpoint), series in items:
+                lines += _histogram_lines("think_ai_output_tokens_per_second", series.rate,
+                                          _labels(model=model, endpoint=endpoint))
+            lines += [
+                "# HELP think_ai_usage_tokens_total 上游usage中报告的token数",
+                "# TYPE think_ai_usage_tokens_total counter",
+            ]
+            for (model, endpoint), series in items:
+                for kind, n in series.usage.items():
+                    lines.append(f"think_ai_usage_tokens_total{{{_labels(model=model, endpoint=endpoint, kind=kind)}}} {n}")
+            lines += [
+                "# HELP think_ai_ttfb_by_prompt_cache_seconds 按是否命中上游前缀缓存区分的首字节耗时",
+                "# TYPE think_ai_ttfb_by_prompt_cache_seconds histogram",
+            ]
+            for (model, endpoint), series in items:
+                for status, histogram in series.ttfb_by_prompt_cache.items():
+                    lines += _histogram_lines("think_ai_ttfb_by_prompt_cache_seconds", histogram,
+                                              _labels(model=model, endpoint=endpoint, prompt_cache=status))
+            lines += [
+                "# HELP think_ai_script_run_seconds 界面脚本运行耗时（不含生成回答）",
+                "# TYPE think_ai_script_run_seconds histogram",
+            ]
+            for run, histogram in self._script_runs.items():
+                lines += _histogram_lines("think_ai_script_run_seconds", histogram, _labels(run=run))
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
@@ -0,0 +1,202 @@
+"""
+流式输出渲染调度：合并增量，按帧率刷新界面
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from config import RENDER_CONFIG
+
+_END = object()
+
+class RenderScheduler:
+    """在事件流和界面占位符之间合并增量
+
+    每个通道（reasoning/response）的增量先暂存，距上次刷新超过
+    1/fps秒或暂存字符数超过flush_chars时才调用一次渲染函数。
+    上游停顿时没有新的增量触发刷新，等待期间定时调用tick()渲染暂存的尾部。
+    数据流结束时必须调用flush()做最后一次刷新。
+    """
+
+    def __init__(self, renderers, fps=None, flush_chars=None, clock=time.monotonic):
+        """初始化渲染调度器
+
+        Args:
+            renderers (dict): 通道名 -> 渲染函数，渲染函数接收该通道的完整文本
+            fps (float): 每秒最多刷新次数
+            flush_chars (int): 暂存字符数达到该值时立即刷新
+            clock (callable): 时钟函数，便于测试
+        """
+        self.renderers = renderers
+        fps = fps or RENDER_CONFIG["fps"]
+        self.interval = 1.0 / fps
+        self.flush_chars = flush_chars or RENDER_CONFIG["flush_chars"]
+        self.clock = clock
+        self._texts = {name: "" for name in renderers}
+        self._pending = {name: [] for name in renderers}
+        self._pending_chars = 0
+        self._last_flush = clock()
+        self.chunk_count = 0  # 收到的增量数
+        self.render_count = 0  # 实际渲染次数
+
+    def push(self, channel, delta):
+        """追加一个增量，必要时触发刷新"""
+        self.chunk_count += 1
+        if not delta:
+            return
+        self._pending[channel].append(delta)
+        self._pending_chars += len(delta)
+        if self._pending_chars >= self.flush_chars or \
+           self.clock() - self._last_flush >= self.interval:
+            self.flush()
+
+    def tick(self):
+        """没有新增量时定时调用，暂存的增量距上次刷新超过1/fps秒时刷新"""
+        if self._pending_chars and self.clock() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """把所有暂存的增量渲染到界面"""
+        for name, parts in self._pending.items():
+            if not parts:
+                continue
+            self._texts[name] += "".join(parts)
+            parts.clear()
+            self.renderers[name](self._texts[name])
+            self.render_count += 1
+        self._pending_chars = 0
+        self._last_flush = self.clock()
+
+    def text(self, channel):
+        """返回通道当前的完整文本（包含未刷新的部分）"""
+        return self._texts[channel] + "".join(self._pending[channel])
+
+    def stats(self):
+        """返回渲染次数和增量数"""
+        return {"chunks": self.chunk_count, "renders": self.render_count}
+
+class BackgroundStream:
+    """在后台线程中读取事件流
+
+    Streamlit只在脚本调用st函数时处理重新运行请求（点击停止按钮、提交新输入），
+    上游长时间没有数据时脚本线程阻塞在读取上，无法及时停止。事件流改在后台
+    线程中读取，脚本线程等待超过heartbeat_interval秒时调用一次heartbeat，
+    给Streamlit中断脚本的机会。
+    """
+
+    def __init__(self, events, heartbeat=None, heartbeat_interval=0.25):
+        """开始读取
+
+        Args:
+            events (iterator): 事件流，例如AIModel.generate_response_stream的返回值
+            heartbeat (callable): 等待期间定时调用的函数，通常是刷新一个空占位符
+            heartbeat_interval (float): 调用heartbeat的间隔（秒）
+        """
+        self.heartbeat = heartbeat
+        self.heartbeat_interval = heartbeat_interval
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, args=(events,), daemon=True)
+        self._thread.start()
+
+    def _run(self, events):
+        try:
+            for event in events:
+                self._queue.put(event)
+        finally:
+            self._queue.put(_END)
+
+    def __iter__(self):
+        while True:
+            try:
+                event = self._queue.get(timeout=self.heartbeat_interval)
+            except queue.Empty:
+                if self.heartbeat is not None:
+                    self.heartbeat()
+                continue
+            if event is _END:
+                return
+            yield event
+
+    def remaining(self, timeout):
+        """取消生成后取出剩余事件，最多等待timeout秒
+
+        Returns:
+            list: 尚未读取的事件，通常以带cancelled标记的complete事件结束
+        """
+        self._thread.join(timeout)
+        events = []
+        while True:
+            try:
+                event = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if event is _END:
+                break
+            events.append(event)
+        return events
+
+class ParallelStreams:
+    """在有界线程池中同时读取多个事件流
+
+    每个事件流在一个工作线程中读取，事件按到达顺序合并为(键, 事件)，总耗时
+    取决于最慢的一个流而不是各流之和。流的数量超过max_workers时多出的排队，
+    有线程空闲后才开始。与BackgroundStream一样，等待超过heartbeat_interval秒
+    时调用一次heartbeat。
+    """
+
+    def __init__(self, streams, max_workers, heartbeat=None, heartbeat_interval=0.25):
+        """开始读取
+
+        Args:
+            streams (dict): 键 -> 事件流，生成器在工作线程中才开始执行
+            max_workers (int): 同时读取的事件流数上限
+            heartbeat (callable): 等待期间定时调用的函数
+            heartbeat_interval (float): 调用heartbeat的间隔（秒）
+        """
+        self.heartbeat = heartbeat
+        self.heartbeat_interval = heartbeat_interval
+        self._queue = queue.Queue()
+        self._running = len(streams)
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(streams))),
+                                      thread_name_prefix="parallel-stream")
+        self._futures = [executor.submit(self._run, key, events) for key, events in streams.items()]
+        executor.shutdown(wait=False)
+
+    def _run(self, key, events):
+        try:
+            for event in events:
+                self._queue.put((key, event))
+        finally:
+            self._queue.put((key, _END))
+
+    def __iter__(self):
+        while self._running:
+            try:
+                key, event = self._queue.get(timeout=self.heartbeat_interval)
+            except queue.Empty:
+                if self.heartbeat is not None:
+                    self.heartbeat()
+                continue
+            if event is _END:
+                self._running -= 1
+                continue
+            yield key, event
+
+    def remaining(self, timeout):
+        """取消生成后取出所有流的剩余事件，最多等待timeout秒
+
+        Returns:
+            list: 尚未读取的(键, 事件)
+        """
+        wait(self._futures, timeout)
+        events = []
+        while True:
+            try:
+                key, event = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if event is not _END:
+                events.append((key, event))
+        return events
@@ -0,0 +1,212 @@
+"""
+容错：错误分类、带抖动的指数退避、进程级重试预算和按base_url的熔断器
+"""
+
+import logging
+import random
+import threading
+import time
+
+from config import RESILIENCE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# 错误类别
+RETRYABLE = "retryable"  # 连接错误、超时、5xx
+RATE_LIMITED = "rate_limited"  # 429
+FATAL = "fatal"  # 参数错误、鉴权失败等重试无意义的4xx
+
+def error_status(error):
+    """从requests或aiohttp异常中提取HTTP状态码和Retry-After
+
+    Returns:
+        tuple: (状态码, Retry-After秒数)，没有对应信息时为None
+    """
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(error, "status", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None) or {}
+    retry_after = headers.get("Retry-After")
+    try:
+        retry_after = float(retry_after) if retry_after else None
+    except ValueError:
+        retry_after = None
+    return status, retry_after
+
+def classify_error(error):
+    """对请求异常分类
+
+    Returns:
+        tuple: (错误类别, 状态码, Retry-After秒数)
+    """
+    status, retry_after = error_status(error)
+    if status == 429:
+        return RATE_LIMITED, status, retry_after
+    if status is not None and 400 <= status < 500 and status != 408:
+        return FATAL, status, retry_after
+    return RETRYABLE, status, retry_after
+
+def backoff_delay(attempt, retry_after=None):
+    """计算第attempt次重试（从0开始）前的等待时间
+
+    使用full jitter：在[0, min(上限, 基数*2^attempt)]内均匀随机，
+    避免所有会话同步重试。服务端给出Retry-After时至少等待该时长。
+    """
+    ceiling = min(RESILIENCE_CONFIG["backoff_cap"], RESILIENCE_CONFIG["backoff_base"] * 2 ** attempt)
+    delay = random.uniform(0, ceiling)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, RESILIENCE_CONFIG["max_retry_after"]))
+    return delay
+
+class RetryBudget:
+    """进程级重试预算
+
+    每个请求存入ratio个令牌，每次重试消耗一个令牌，令牌数有上限。
+    上游大面积故障时，重试量被限制在正常请求量的ratio倍以内。
+    """
+
+    def __init__(self, ratio, min_tokens, max_tokens):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = float(min_tokens)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.exhausted = 0  # 因预算不足放弃的重试次数
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_acquire(self):
+        """尝试为一次重试取得令牌"""
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.retries += 1
+                return True
+            self.exhausted += 1
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "exhausted": self.exhausted,
+                "tokens": round(self._tokens, 2),
+            }
+
+class CircuitBreaker:
+    """单个上游地址的熔断器
+
+    连续失败达到阈值后打开，打开期间直接快速失败；冷却结束后进入半开状态，
+    只放行一个试探请求，成功则关闭，失败则重新打开。试探请求被限流或取消时
+    调用release()，不判定上游状态，下一个请求接着试探；试探请求超过
+    trial_timeout秒仍无结果时也放行新的试探请求。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold, open_seconds, trial_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.trial_timeout = open_seconds if trial_timeout is None else trial_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.opened_count = 0  # 打开次数
+        self.fast_failures = 0  # 熔断期间被拒绝的请求数
+        self._trial_in_flight = False
+        self._trial_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否放行请求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.time() - self.opened_at >= self.open_seconds:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and self._trial_in_flight \
+                    and time.time() - self._trial_started >= self.trial_timeout:
+                logger.warning("熔断器%s的试探请求%d秒内没有结果，放行新的试探请求", self.name, self.trial_timeout)
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                self._trial_started = time.time()
+                return True
+            self.fast_failures += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("熔断器%s已关闭，恢复正常请求", self.name)
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def release(self):
+        """请求结束但不能判定上游是否恢复（被限流、被取消），半开状态下放行下一个试探请求"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened_count += 1
+                    logger.warning("熔断器%s已打开，%d秒内快速失败（连续失败%d次）",
+                                   self.name, self.open_seconds, self.consecutive_failures)
+                self.state = self.OPEN
+                self.opened_at = time.time()
+                self._trial_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "opened_count": self.opened_count,
+                "fast_failures": self.fast_failures,
+            }
+
+retry_budget = RetryBudget(
+    RESILIENCE_CONFIG["retry_budget_ratio"],
+    RESILIENCE_CONFIG["retry_budget_min"],
+    RESILIENCE_CONFIG["retry_budget_max"]
+)
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(base_url):
+    """获取base_url对应的共享熔断器"""
+    with _breakers_lock:
+        breaker = _breakers.get(base_url)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                base_url,
+                RESILIENCE_CONFIG["breaker_failure_threshold"],
+                RESILIENCE_CONFIG["breaker_open_seconds"],
+                RESILIENCE_CONFIG["breaker_trial_timeout"]
+            )
+            _breakers[base_url] = breaker
+        return breaker
+
+def get_resilience_stats():
+    """返回重试预算和所有熔断器的状态，用于监控"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {
+        "retry_budget": retry_budget.stats(),
+        "circuit_breakers": [breaker.stats() for breaker in breakers],
+    }
@@ -0,0 +1,202 @@
+"""
+多端点路由：按实时健康度选择OpenAI兼容端点，失败时自动切换
+"""
+
+import logging
+import os
+import threading
+import time
+
+from config import ROUTING_CONFIG
+
+logger = logging.getLogger(__name__)
+
+class Endpoint:
+    """一个OpenAI兼容的API端点及其健康状态"""
+
+    def __init__(self, name, base_url, api_key=None, api_key_env=None, models=None):
+        """初始化端点
+
+        Args:
+            name (str): 端点名称
+            base_url (str): API基础地址
+            api_key (str): API Key
+            api_key_env (str): 未提供api_key时从该环境变量读取
+            models (dict): 模型ID映射（请求的模型ID -> 该端点的模型ID），
+                为None时原样透传，提供时只服务映射中的模型
+        """
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key or (os.getenv(api_key_env) if api_key_env else None)
+        self.models = models
+        self.ewma_ttft = None  # 首个事件耗时的指数加权平均（秒）
+        self.ewma_error = 0.0  # 错误率的指数加权平均
+        self.requests = 0
+        self.failures = 0
+        self.rate_limited = 0  # 收到429的次数
+        self.consecutive_failures = 0
+        self.ejected = False
+        self.ejections = 0  # 连续被摘除的次数，用于退避
+        self.ejected_until = 0.0
+        self.cooldown_until = 0.0  # 429后的冷却截止时间
+        self.last_probe = 0.0
+
+    @property
+    def url(self):
+        return f"{self.base_url}/chat/completions"
+
+    def serves(self, model):
+        return self.models is None or model in self.models
+
+    def model_for(self, model):
+        """返回该端点上对应的模型ID"""
+        return model if self.models is None else self.models[model]
+
+    def headers(self):
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def score(self):
+        """路由得分，越低越优先"""
+        ttft = self.ewma_ttft if self.ewma_ttft is not None else ROUTING_CONFIG["initial_ttft"]
+        return ttft * (1 + ROUTING_CONFIG["error_penalty"] * self.ewma_error)
+
+    def stats(self):
+        now = time.time()
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "ewma_ttft": self.ewma_ttft,
+            "ewma_error": round(self.ewma_error, 4),
+            "requests": self.requests,
+            "failures": self.failures,
+            "rate_limited": self.rate_limited,
+            "ejected": self.ejected,
+            "ejected_for": max(0.0, self.ejected_until - now),
+            "cooldown_for": max(0.0, self.cooldown_until - now),
+        }
+
+class EndpointPool:
+    """按健康度路由的端点池
+
+    健康度由首个事件耗时、错误率和429的指数加权平均计算。连续失败或错误率
+    过高的端点被摘除，摘除时间按次数指数退避；到期后放行一个探测请求，
+    成功则恢复。由于切换发生在首个事件之前，探测失败对用户不可见。
+    """
+
+    def __init__(self, endpoints):
+        """初始化端点池
+
+        Args:
+            endpoints (list): Endpoint列表，顺序即初始优先级
+        """
+        self.endpoints = endpoints
+        self._lock = threading.Lock()
+
+    def candidates(self, model):
+        """返回服务该模型的端点，按尝试顺序排列
+
+        到期待探测的端点排在最前，其次是健康端点（按得分），
+        被摘除或冷却中的端点作为最后的兜底。
+        """
+        now = time.time()
+        probing, healthy, unavailable = [], [], []
+        with self._lock:
+            for endpoint in self.endpoints:
+                if not endpoint.serves(model):
+                    continue
+                if endpoint.ejected_until > now or endpoint.cooldown_until > now:
+                    unavailable.append(endpoint)
+                elif endpoint.ejected:
+                    if now - endpoint.last_probe >= ROUTING_CONFIG["probe_interval"]:
+                        endpoint.last_probe = now
+                        probing.append(endpoint)
+                    else:
+                        unavailable.append(endpoint)
+                else:
+                    healthy.append(endpoint)
+        healthy.sort(key=lambda e: e.score())
+        unavailable.sort(key=lambda e: max(e.ejected_until, e.cooldown_until))
+        return probing + healthy + unavailable
+
+    def record_success(self, endpoint, ttft):
+        """记录一次成功请求（已收到首个事件）"""
+        alpha = ROUTING_CONFIG["ewma_alpha"]
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.consecutive_failures = 0
+            endpoint.ewma_error *= 1 - alpha
+            if endpoint.ewma_ttft is None:
+                endpoint.ewma_ttft = ttft
+            else:
+                endpoint.ewma_ttft = alpha * ttft + (1 - alpha) * endpoint.ewma_ttft
+            if endpoint.ejected:
+                logger.info("端点%s探测成功，恢复使用", endpoint.name)
+                endpoint.ejected = False
+                endpoint.ejections = 0
+
+    def record_failure(self, endpoint, status=None, retry_after=None):
+        """记录一次失败请求
+
+        Args:
+            endpoint (Endpoint): 失败的端点
+            status (int): HTTP状态码，连接错误或超时为None
+            retry_after (float): 429响应中的Retry-After（秒）
+        """
+        alpha = ROUTING_CONFIG["ewma_alpha"]
+        now = time.time()
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.failures += 1
+            if status == 429:
+                # 限流只是暂时冷却，不计入摘除判断
+                endpoint.rate_limited += 1
+                endpoint.cooldown_until = now + (retry_after or ROUTING_CONFIG["rate_limit_cooldown"])
+                return
+            endpoint.consecutive_failures += 1
+            endpoint.ewma_error = alpha + (1 - alpha) * endpoint.ewma_error
+            should_eject = endpoint.ejected or \
+                endpoint.consecutive_failures >= ROUTING_CONFIG["eject_consecutive_failures"] or \
+                (endpoint.requests >= ROUTING_CONFIG["min_requests"] and
+                 endpoint.ewma_error >= ROUTING_CONFIG["eject_error_rate"])
+            if should_eject:
+                endpoint.ejections += 1
+                duration = min(
+                    ROUTING_CONFIG["eject_seconds"] * 2 ** (endpoint.ejections - 1),
+                    ROUTING_CONFIG["max_eject_seconds"]
+                )
+                endpoint.ejected = True
+                endpoint.ejected_until = now + duration
+                logger.warning("端点%s已摘除%d秒（连续失败%d次，错误率%.2f）", endpoint.name,
+                               duration, endpoint.consecutive_failures, endpoint.ewma_error)
+
+    def stats(self):
+        """返回所有端点的健康状态"""
+        with self._lock:
+            return [endpoint.stats() for endpoint in self.endpoints]
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_endpoint_pool(endpoint_configs):
+    """获取端点配置对应的共享端点池（进程内单例，所有会话共享健康状态）
+
+    Args:
+        endpoint_configs (list): 端点配置字典列表，字段同Endpoint的参数
+
+    Returns:
+        EndpointPool: 共享的端点池
+    """
+    key = tuple(
+        (c["name"], c["base_url"], c.get("api_key"), c.get("api_key_env"),
+         tuple(sorted((c.get("models") or {}).items())) if c.get("models") is not None else None)
+        for c in endpoint_configs
+    )
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = EndpointPool([Endpoint(**c) for c in endpoint_configs])
+            _pools[key] = pool
+        return pool
@@ -0,0 +1,135 @@
+"""
+Server-Sent Events解码器
+"""
+
+import json
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# 可选的高性能JSON解析库，按优先级排列
+_JSON_BACKENDS = ("orjson", "ujson")
+
+SSEEvent = namedtuple("SSEEvent", ["event", "data", "id", "retry"])
+SSEEvent.__doc__ = """一个完整的SSE事件，data为bytes（多行data以换行连接）"""
+
+_decode_json = json.JSONDecoder().decode
+
+def _stdlib_loads(data):
+    """标准库解析，跳过json.loads对bytes的编码探测"""
+    return _decode_json(data.decode("utf-8"))
+
+def get_json_loads(backend="auto"):
+    """获取JSON解析函数
+
+    Args:
+        backend (str): "auto"（优先使用已安装的orjson/ujson）、"json"或具体库名
+
+    Returns:
+        tuple: (后端名称, 接受bytes的loads函数)
+    """
+    if backend == "json":
+        return "json", _stdlib_loads
+    candidates = _JSON_BACKENDS if backend == "auto" else (backend,)
+    for name in candidates:
+        try:
+            module = __import__(name)
+        except ImportError:
+            if backend != "auto":
+                logger.warning("JSON解析库%s未安装，使用标准库json", name)
+            continue
+        return name, module.loads
+    return "json", _stdlib_loads
+
+class SSEDecoder:
+    """基于原始字节块的增量SSE解码器
+
+    按SSE规范处理CRLF/LF/CR换行、多行data、event/id/retry字段和
+    以冒号开头的注释（keep-alive）。数据在整个解码过程中保持为bytes，
+    不做逐行decode。
+    """
+
+    def __init__(self):
+        self._buffer = b""
+        self._data_lines = []
+        self._event_type = None
+        self.last_event_id = None
+        self.retry = None
+        self.comment_count = 0  # 收到的注释行（keep-alive）数量
+
+    def feed(self, chunk):
+        """输入一个字节块
+
+        Args:
+            chunk (bytes): 从网络读取的原始数据
+
+        Returns:
+            list: 本次解析出的完整SSEEvent
+        """
+        buffer = self._buffer + chunk if self._buffer else chunk
+        held = b""
+        if b"\r" in buffer:
+            # 末尾的\r可能与下一块开头的\n组成CRLF，先保留
+            if buffer.endswith(b"\r"):
+                buffer, held = buffer[:-1], b"\r"
+            buffer = buffer.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        lines = buffer.split(b"\n")
+        self._buffer = lines.pop() + held
+
+        events = []
+        for line in lines:
+            if not line:
+                if self._data_lines:
+                    events.append(self._dispatch())
+                else:
+                    self._event_type = None
+                continue
+            if line.startswith(b"data: "):
+                # 绝大多数行都是data字段，走快速路径
+                self._data_lines.append(line[6:])
+            elif line[0] == 58:  # b":" 注释
+                self.comment_count += 1
+            else:
+                self._process_field(line)
+        return events
+
+    def flush(self):
+        """数据流结束时处理残留数据
+
+        规范要求丢弃未以空行结尾的事件；部分兼容服务在[DONE]后直接断开，
+        这里放宽为仍然派发最后一个事件。
+
+        Returns:
+            list: 残留的未以空行结尾的事件
+        """
+        buffer, self._buffer = self._buffer.rstrip(b"\r"), b""
+        if buffer and buffer[0] != 58:
+            self._process_field(buffer)
+        if self._data_lines:
+            return [self._dispatch()]
+        return []
+
+    def _process_field(self, line):
+        field, _, value = line.partition(b":")
+        if value[:1] == b" ":
+            value = value[1:]
+        if field == b"data":
+            self._data_lines.append(value)
+        elif field == b"event":
+            self._event_type = value.decode("utf-8", "replace")
+        elif field == b"id":
+            if b"\0" not in value:
+                self.last_event_id = value.decode("utf-8", "replace")
+        elif field == b"retry":
+            if value.isdigit():
+                self.retry = int(value)
+        # 其他字段按规范忽略
+
+    def _dispatch(self):
+        data_lines = self._data_lines
+        data = data_lines[0] if len(data_lines) == 1 else b"\n".join(data_lines)
+        event = SSEEvent(self._event_type or "message", data, self.last_event_id, self.retry)
+        self._data_lines = []
+        self._event_type = None
+        return event
@@ -0,0 +1,174 @@
+"""
+会话持久化存储：基于SQLite的追加写入和分页读取
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from config import STORAGE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+class ConversationStore:
+    """会话存储
+
+    每条用户消息和助手回复完成后追加写入一行，读取时按序号分页，
+    界面只需加载最近一页，更早的消息按需获取。每个会话属于创建它的
+    所有者（浏览器密钥），列出和打开会话时只匹配自己的会话。
+    """
+
+    def __init__(self, db_path):
+        """初始化存储
+
+        Args:
+            db_path (str): SQLite文件路径，":memory:"表示仅内存
+        """
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            if db_path != ":memory:":
+                self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "id TEXT PRIMARY KEY, title TEXT, created_at REAL, updated_at REAL, "
+                "message_count INTEGER DEFAULT 0, owner TEXT)"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(conversations)")]
+            if "owner" not in columns:
+                # 旧版本的数据库没有所有者，其中的会话不再对任何人显示
+                self._db.execute("ALTER TABLE conversations ADD COLUMN owner TEXT")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS conversations_owner ON conversations (owner, updated_at)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "conversation_id TEXT, seq INTEGER, role TEXT, content TEXT, created_at REAL, "
+                "PRIMARY KEY (conversation_id, seq))"
+            )
+            self._db.commit()
+
+    def create_conversation(self, owner, title=""):
+        """创建新会话
+
+        Args:
+            owner (str): 所有者密钥
+            title (str): 会话标题
+
+        Returns:
+            str: 会话ID
+        """
+        conversation_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO conversations (id, title, created_at, updated_at, owner) VALUES (?, ?, ?, ?, ?)",
+                (conversation_id, title, now, now, owner)
+            )
+            self._db.commit()
+        return conversation_id
+
+    def has_conversation(self, conversation_id, owner):
+        """会话是否存在且属于owner"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM conversations WHERE id = ? AND owner = ?", (conversation_id, owner)
+            ).fetchone()
+        return row is not None
+
+    def list_conversations(self, owner, limit=20):
+        """按最近更新时间列出owner的会话"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, title, updated_at, message_count FROM conversations "
+                "WHERE owner = ? AND message_count > 0 ORDER BY updated_at DESC LIMIT ?", (owner, limit)
+            ).fetchall()
+        return [
+            {"id": row[0], "title": row[1], "updated_at": row[2], "message_count": row[3]}
+            for row in rows
+        ]
+
+    def append_message(self, conversation_id, message):
+        """追加一条消息
+
+        Args:
+            conversation_id (str): 会话ID
+            message (dict): 包含role和content的消息，助手回复的content为dict
+
+        Returns:
+            int: 消息序号
+        """
+        content = json.dumps(message["content"], ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            seq = self._db.execute(
+                "SELECT message_count FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()[0]
+            self._db.execute(
+                "INSERT INTO messages VALUES (?, ?, ?, ?, ?)",
+                (conversation_id, seq, message["role"], content, now)
+            )
+            title_update = ""
+            if seq == 0 and message["role"] == "user":
+                # 以第一条用户消息作为会话标题
+                title_update = ", title = ?"
+            params = [now] + ([message["content"][:30]] if title_update else []) + [conversation_id]
+            self._db.execute(
+                f"UPDATE conversations SET message_count = message_count + 1, updated_at = ?{title_update} WHERE id = ?",
+                params
+            )
+            self._db.commit()
+        return seq
+
+    def count_messages(self, conversation_id):
+        """返回会话中的消息数"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT message_count FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def load_page(self, conversation_id, before_seq=None, limit=20):
+        """按时间顺序返回before_seq之前的最多limit条消息
+
+        Args:
+            conversation_id (str): 会话ID
+            before_seq (int): 只返回序号小于该值的消息，为None时返回最近一页
+            limit (int): 最多返回的消息数
+
+        Returns:
+            list: 消息列表，每条包含seq、role和content
+        """
+        if before_seq is None:
+            before_seq = 2 ** 62
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, role, content FROM messages WHERE conversation_id = ? AND seq < ? "
+                "ORDER BY seq DESC LIMIT ?",
+                (conversation_id, before_seq, limit)
+            ).fetchall()
+        rows.reverse()
+        return [{"seq": seq, "role": role, "content": json.loads(content)} for seq, role, content in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+def get_conversation_store():
+    """获取进程内共享的会话存储（按STORAGE_CONFIG首次使用时创建）"""
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            db_path = STORAGE_CONFIG["db_path"]
+            if db_path != ":memory:" and not os.path.isabs(db_path):
+                db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), db_path)
+            _shared_store = ConversationStore(db_path)
+            logger.info("会话存储: %s", db_path)
+        return _shared_store
@@ -0,0 +1,34 @@
+import json
+
+from batch import iter_prompts, load_completed_ids
+
+def write_lines(path, lines):
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+def test_iter_prompts_skips_non_object_lines(tmp_path):
+    input_path = tmp_path / "prompts.jsonl"
+    write_lines(input_path, [
+        json.dumps({"id": 1, "prompt": "a"}),
+        json.dumps(["x"]),
+        "42",
+        json.dumps({"id": 2, "prompt": "b"}),
+    ])
+    items = list(iter_prompts(input_path, "id", "prompt", set()))
+    assert [item_id for item_id, _ in items] == [1, 2]
+
+def test_unhashable_ids_are_resumable(tmp_path):
+    input_path = tmp_path / "prompts.jsonl"
+    output_path = tmp_path / "results.jsonl"
+    write_lines(input_path, [
+        json.dumps({"id": [1, 2], "prompt": "a"}),
+        json.dumps({"id": {"b": 1, "a": 2}, "prompt": "b"}),
+        json.dumps({"id": "c", "prompt": "c"}),
+    ])
+    write_lines(output_path, [
+        json.dumps({"id": [1, 2], "status": "complete"}),
+        json.dumps({"id": {"a": 2, "b": 1}, "status": "complete"}),
+        json.dumps({"id": "c", "status": "error"}),
+    ])
+    completed = load_completed_ids(output_path)
+    items = list(iter_prompts(input_path, "id", "prompt", completed))
+    assert [item_id for item_id, _ in items] == ["c"]
@@ -0,0 +1,336 @@
+"""
+HTTP传输层：按base_url共享的长连接池
+"""
+
+import asyncio
+import logging
+import socket
+import threading
+import weakref
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import TRANSPORT_CONFIG
+
+logger = logging.getLogger(__name__)
+
+def _set_read_timeout(response, timeout):
+    """调整流式响应底层socket的读超时"""
+    connection = getattr(response.raw, "connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        sock.settimeout(timeout)
+
+class HTTPTransport:
+    """带连接池和分段超时的HTTP传输
+
+    同一个base_url的所有会话共享一个实例，后续请求复用已建立的
+    TCP/TLS连接，避免每轮对话重新握手。
+    """
+
+    DRAIN_LIMIT = 64 * 1024  # 释放连接时最多读取的剩余字节数
+    DRAIN_TIMEOUT = 1  # 读取剩余数据的超时（秒）
+
+    def __init__(self, base_url, **options):
+        """初始化传输层
+
+        Args:
+            base_url (str): API基础地址
+            **options: 覆盖TRANSPORT_CONFIG中的连接池和超时设置
+        """
+        self.base_url = base_url
+        self.options = {**TRANSPORT_CONFIG, **options}
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.options["pool_connections"],
+            pool_maxsize=self.options["pool_maxsize"],
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._adapter = adapter
+        self._lock = threading.Lock()
+        self._requests = 0  # 已发送请求数
+        self._errors = 0  # 失败请求数
+        self._active_streams = 0  # 正在读取的流数量
+        logger.info("创建HTTP连接池: %s（最大连接数: %d）",
+                    base_url, self.options["pool_maxsize"])
+
+    def post(self, url, headers, data, stream=False):
+        """发送POST请求
+
+        连接阶段使用connect_timeout，等待响应头和首个数据块使用first_byte_timeout。
+        data为dict时按JSON发送，为bytes时视为已序列化的请求体。
+        """
+        timeout = (self.options["connect_timeout"], self.options["first_byte_timeout"])
+        body = {"data": data} if isinstance(data, bytes) else {"json": data}
+        with self._lock:
+            self._requests += 1
+        try:
+            response = self.session.post(
+                url,
+                headers=headers,
+                stream=stream,
+                timeout=timeout,
+                **body
+            )
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self._errors += 1
+            raise
+        return response
+
+    def iter_content(self, response):
+        """按到达顺序逐块读取流式响应体
+
+        收到首个数据块后，将读超时切换为数据块之间的idle_timeout。
+        读取结束（或被中途关闭）后释放连接回连接池。
+        """
+        with self._lock:
+            self._active_streams += 1
+        try:
+            first_chunk = True
+            for chunk in response.iter_content(chunk_size=None):
+                if first_chunk:
+                    _set_read_timeout(response, self.options["idle_timeout"])
+                    first_chunk = False
+                if chunk:
+                    yield chunk
+        finally:
+            with self._lock:
+                self._active_streams -= 1
+            self.release(response)
+
+    def release(self, response):
+        """释放响应占用的连接
+
+        收到[DONE]后通常只剩结束分块，读完后连接可以回到连接池复用；
+        若剩余数据超过DRAIN_LIMIT（例如上游仍在生成），直接关闭连接。
+        """
+        raw = response.raw
+        try:
+            if not raw.closed:
+                _set_read_timeout(response, self.DRAIN_TIMEOUT)
+                raw.read(self.DRAIN_LIMIT, decode_content=False)
+            if raw.closed:
+                raw.release_conn()
+                return
+        except Exception:
+            pass
+        response.close()
+
+    def abort(self, response):
+        """从其他线程立即断开流式响应
+
+        关闭socket的读写两端，阻塞在读取上的线程会立即收到异常，
+        由读取方负责关闭响应；连接不会回到连接池。已释放的响应不受影响。
+        """
+        connection = getattr(response.raw, "connection", None)
+        sock = getattr(connection, "sock", None)
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def stats(self):
+        """返回连接池统计信息"""
+        pools = []
+        for key in list(self._adapter.poolmanager.pools.keys()):
+            pool = self._adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append({
+                "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                "connections_created": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle_connections": sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0,
+            })
+        with self._lock:
+            return {
+                "base_url": self.base_url,
+                "requests": self._requests,
+                "errors": self._errors,
+                "active_streams": self._active_streams,
+                "pool_maxsize": self.options["pool_maxsize"],
+                "pools": pools,
+            }
+
+    def close(self):
+        """关闭所有连接"""
+        self.session.close()
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+def _transport_key(base_url, options):
+    parts = urlsplit(base_url)
+    return (parts.scheme, parts.netloc, tuple(sorted(options.items())))
+
+def get_transport(base_url, **options):
+    """获取base_url对应的共享传输实例（进程内单例）
+
+    Args:
+        base_url (str): API基础地址
+        **options: 连接池和超时设置，不同设置会得到不同实例
+
+    Returns:
+        HTTPTransport: 共享的传输实例
+    """
+    key = _transport_key(base_url, options)
+    with _transports_lock:
+        transport = _transports.get(key)
+        if transport is None:
+            transport = HTTPTransport(base_url, **options)
+            _transports[key] = transport
+        return transport
+
+def get_all_transport_stats():
+    """返回所有共享传输实例的统计信息"""
+    with _transports_lock:
+        transports = list(_transports.values())
+    return [transport.stats() for transport in transports]
+
+class AsyncHTTPTransport:
+    """基于aiohttp的异步HTTP传输
+
+    aiohttp的会话绑定事件循环，因此按(事件循环, base_url)共享实例。
+    单个事件循环可同时承载数百个流式请求。
+    """
+
+    DRAIN_LIMIT = HTTPTransport.DRAIN_LIMIT
+    DRAIN_TIMEOUT = HTTPTransport.DRAIN_TIMEOUT
+
+    def __init__(self, base_url, **options):
+        """初始化异步传输层
+
+        Args:
+            base_url (str): API基础地址
+            **options: 覆盖TRANSPORT_CONFIG中的连接池和超时设置
+        """
+        import aiohttp
+
+        self.base_url = base_url
+        self.options = {**TRANSPORT_CONFIG, **options}
+        connector = aiohttp.TCPConnector(limit=self.options["async_max_connections"])
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=self.options["connect_timeout"]
+            )
+        )
+        self._requests = 0  # 已发送请求数
+        self._errors = 0  # 失败请求数
+        self._active_streams = 0  # 正在读取的流数量
+        logger.info("创建异步HTTP连接池: %s（最大连接数: %d）",
+                    base_url, self.options["async_max_connections"])
+
+    async def post(self, url, headers, data):
+        """发送流式POST请求，在first_byte_timeout内等待响应头，data的含义同HTTPTransport.post"""
+        self._requests += 1
+        body = {"data": data} if isinstance(data, bytes) else {"json": data}
+        response = None
+        try:
+            response = await asyncio.wait_for(
+                self.session.post(url, headers=headers, **body),
+                self.options["first_byte_timeout"]
+            )
+            response.raise_for_status()
+            return response
+        except BaseException:
+            self._errors += 1
+            if response is not None:
+                response.close()
+            raise
+
+    async def iter_content(self, response):
+        """逐块读取响应体
+
+        首个数据块使用first_byte_timeout，之后每块使用idle_timeout。
+        正常结束时连接回到连接池；提前关闭时会尝试在DRAIN_LIMIT内读完
+        剩余数据以便复用；异常或任务取消时立即断开连接。
+        """
+        self._active_streams += 1
+        timeout = self.options["first_byte_timeout"]
+        finished = False
+        drained = False
+        try:
+            while True:
+                chunk = await asyncio.wait_for(response.content.readany(), timeout)
+                if not chunk:
+                    break
+                timeout = self.options["idle_timeout"]
+                yield chunk
+            finished = True
+        except GeneratorExit:
+            drained = True
+            await self._drain(response)
+            raise
+        finally:
+            self._active_streams -= 1
+            if finished:
+                response.release()
+            elif not drained:
+                response.close()
+
+    async def _drain(self, response):
+        """读完少量剩余数据（通常只有结束分块）以便连接复用"""
+        try:
+            remaining = self.DRAIN_LIMIT
+            while remaining > 0:
+                chunk = await asyncio.wait_for(response.content.readany(), self.DRAIN_TIMEOUT)
+                if not chunk:
+                    response.release()
+                    return
+                remaining -= len(chunk)
+        except Exception:
+            pass
+        response.close()
+
+    def stats(self):
+        """返回连接池统计信息"""
+        connector = self.session.connector
+        return {
+            "base_url": self.base_url,
+            "requests": self._requests,
+            "errors": self._errors,
+            "active_streams": self._active_streams,
+            "max_connections": self.options["async_max_connections"],
+            "idle_connections": sum(len(conns) for conns in connector._conns.values()) if connector else 0,
+        }
+
+    async def close(self):
+        """关闭会话和所有连接"""
+        await self.session.close()
+
+_async_transports = weakref.WeakKeyDictionary()
+
+def get_async_transport(base_url, **options):
+    """获取当前事件循环中base_url对应的共享异步传输实例
+
+    必须在事件循环内调用。
+
+    Args:
+        base_url (str): API基础地址
+        **options: 连接池和超时设置，不同设置会得到不同实例
+
+    Returns:
+        AsyncHTTPTransport: 共享的异步传输实例
+    """
+    loop = asyncio.get_running_loop()
+    key = _transport_key(base_url, options)
+    transports = _async_transports.setdefault(loop, {})
+    transport = transports.get(key)
+    if transport is None or transport.session.closed:
+        transport = AsyncHTTPTransport(base_url, **options)
+        transports[key] = transport
+    return transport
+
+async def close_async_transports():
+    """关闭当前事件循环中的所有异步传输实例，用于服务退出前清理"""
+    transports = _async_transports.pop(asyncio.get_running_loop(), {})
+    for transport in transports.values():
+        await transport.close()
@@ -1,24 +1,28 @@
+import asyncio
+import hashlib
 import requests
 import json
 import logging
 import time
 import re
-from config import SYSTEM_PROMPT
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,  # 默认级别改为INFO
-    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('app.log', encoding='utf-8', mode='a')
-    ]
+from config import (
+    SYSTEM_PROMPT, TRANSPORT_CONFIG, STREAM_CONFIG, CACHE_CONFIG, COALESCE_CONFIG, OUTPUT_CONFIG, ENDPOINTS,
+    HEDGE_CONFIG, NO_REASONING
+)
+from sse import SSEDecoder, get_json_loads
+from buffer import TurnBuffer
+from cache import canonical_request_hash
+from client import get_client
+from hedge import arace_streams, get_hedge_policy, get_hedge_stats, race_streams
+from metrics import normalize_usage
+from context_window import ContextManager, encode_request_body, get_context_window
+from routing import get_endpoint_pool
+from resilience import (
+    FATAL, RETRYABLE, backoff_delay, classify_error, error_status,
+    get_circuit_breaker, get_resilience_stats, retry_budget
 )
-logger = logging.getLogger(__name__)
 
-# 设置第三方库的日志级别
-logging.getLogger("requests").setLevel(logging.WARNING)
-logging.getLogger("urllib3").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
 
 def extract_think_content(text):
     """提取<think>标签中的内容"""
@@ -34,22 +38,304 @@ def extract_think_content(text):
     
     return None, text
 
+class ThinkTagParser:
+    """增量式<think>标签解析器
+
+    每个数据块只处理一次，仅返回本次新增的思考/回答片段。
+    支持标签被拆分在多个数据块之间，以及未闭合的<think>块。
+    """
+
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self):
+        self.in_think = False  # 当前是否处于<think>块内
+        self._pending = ""  # 可能是标签前缀的未决尾部
+        self._has_reasoning = False  # 是否已输出过思考内容
+        self._response_started = False  # 回答是否已出现非空白字符
+
+    @staticmethod
+    def _partial_tag_length(text, tag):
+        """返回text末尾与tag前缀重合的最大长度"""
+        for size in range(min(len(text), len(tag) - 1), 0, -1):
+            if text.endswith(tag[:size]):
+                return size
+        return 0
+
+    def _emit(self, text, reasoning_parts, response_parts):
+        """将文本片段写入当前通道"""
+        if not text:
+            return
+        if self.in_think:
+            reasoning_parts.append(text)
+            self._has_reasoning = True
+        else:
+            if not self._response_started:
+                # 与extract_think_content保持一致，去掉回答开头的空白
+                text = text.lstrip()
+                if not text:
+                    return
+                self._response_started = True
+            response_parts.append(text)
+
+    def feed(self, text):
+        """处理一个新的文本块
+
+        Args:
+            text (str): 新到达的内容片段
+
+        Returns:
+            tuple: (思考增量, 回答增量)
+        """
+        reasoning_parts = []
+        response_parts = []
+        buffer = self._pending + text
+        self._pending = ""
+
+        while buffer:
+            tag = self.CLOSE_TAG if self.in_think else self.OPEN_TAG
+            index = buffer.find(tag)
+            if index == -1:
+                keep = self._partial_tag_length(buffer, tag)
+                if keep:
+                    self._pending = buffer[-keep:]
+                    buffer = buffer[:-keep]
+                self._emit(buffer, reasoning_parts, response_parts)
+                break
+
+            self._emit(buffer[:index], reasoning_parts, response_parts)
+            buffer = buffer[index + len(tag):]
+            if not self.in_think and self._has_reasoning:
+                # 多个<think>块之间用换行分隔
+                reasoning_parts.append("\n")
+            self.in_think = not self.in_think
+
+        return "".join(reasoning_parts), "".join(response_parts)
+
+    def flush(self):
+        """数据流结束时输出残留的未决文本
+
+        Returns:
+            tuple: (思考增量, 回答增量)
+        """
+        reasoning_parts = []
+        response_parts = []
+        pending, self._pending = self._pending, ""
+        self._emit(pending, reasoning_parts, response_parts)
+        return "".join(reasoning_parts), "".join(response_parts)
+
 class APIError(Exception):
     """API调用相关错误"""
     pass
 
+class StreamResponseParser:
+    """将上游SSE事件转换为reasoning/response/complete事件
+
+    同步和异步两条流式路径共用，负责JSON解析、错误计数和<think>标签拆分。
+    上游以delta.reasoning_content单独输出思考过程时直接使用该字段，
+    回答不再经过<think>标签扫描。
+    """
+
+    def __init__(self, max_errors=3, error_window=2, json_backend="auto", max_output_bytes=None, json_loads=None):
+        """初始化解析器
+
+        Args:
+            max_errors (int): 允许的连续JSON解析错误次数
+            error_window (float): 判定为连续错误的时间窗口（秒）
+            json_backend (str): JSON解析库，见sse.get_json_loads
+            max_output_bytes (int): 单轮输出的字节上限，超过后截断并停止读取
+            json_loads (tuple): 已查找好的(后端名称, loads函数)，为None时按json_backend查找
+        """
+        self.json_backend, self.json_loads = json_loads or get_json_loads(json_backend)
+        self.max_errors = max_errors
+        self.error_window = error_window
+        self.done = False  # 是否已收到[DONE]
+        self.think_parser = ThinkTagParser()
+        self.output = TurnBuffer(max_output_bytes)
+        self.has_content = False
+        self.native_reasoning = False  # 上游是否以reasoning_content字段输出思考过程
+        self._response_started = False  # 原生思考通道下回答是否已出现非空白字符
+        self.cancelled = False  # 是否被取消，取消后finish()返回部分结果
+        self.usage = None  # 上游返回的token用量
+        self.chunk_count = 0
+        self.last_error_time = 0  # 上次错误时间
+        self.error_count = 0  # 连续错误计数
+
+    def _content_events(self, reasoning_delta, response_delta):
+        events = []
+        for channel, delta in (("reasoning", reasoning_delta), ("response", response_delta)):
+            if self.output.truncated:
+                break
+            delta = self.output.append(channel, delta)
+            if delta:
+                events.append({
+                    "type": channel,
+                    "content": delta
+                })
+            if self.output.truncated:
+                # 达到单轮上限，不再读取上游
+                logger.warning("输出超过单轮上限%d字节，已截断", self.output.max_bytes)
+                self.done = True
+                events.append({
+                    "type": "truncated",
+                    "content": {"scope": "turn", "limit": self.output.max_bytes}
+                })
+        return events
+
+    def _native_response(self, text):
+        """原生思考通道下的回答增量，与<think>拆分一致去掉回答开头的空白"""
+        if not text or self._response_started:
+            return text or ""
+        text = text.lstrip()
+        self._response_started = bool(text)
+        return text
+
+    def process_event(self, event):
+        """处理一个SSE事件
+
+        Args:
+            event (SSEEvent): SSEDecoder解析出的事件
+
+        Returns:
+            list: 本事件产生的reasoning/response事件
+        """
+        data = event.data
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("原始数据: %r", data)
+        
+        if data == b"[DONE]":
+            logger.info("数据流接收完成")
+            self.done = True
+            return []
+        
+        # 尝试解析前先检查数据是否为空
+        if not data.strip():
+            logger.warning("收到空数据行")
+            return []
+            
+        try:
+            chunk = self.json_loads(data)
+            self.error_count = 0  # 重置错误计数
+        except ValueError as e:
+            current_time = time.time()
+            if current_time - self.last_error_time > self.error_window:
+                self.error_count = 1
+            else:
+                self.error_count += 1
+                
+            self.last_error_time = current_time
+            
+            if self.error_count >= self.max_errors:
+                logger.error("连续JSON解析错误达到最大重试次数")
+                raise APIError("数据解析失败，请稍后重试")
+                
+            logger.warning("JSON解析错误（%d/%d）: %s, 原始数据: %r", 
+                         self.error_count, self.max_errors, str(e), data)
+            return []
+        
+        try:
+            if isinstance(chunk, dict) and chunk.get("usage"):
+                self.usage = chunk["usage"]
+            
+            if "choices" not in chunk:
+                if isinstance(chunk, dict) and "error" in chunk:
+                    # 上游在流中返回的错误信息
+                    error = chunk["error"]
+                    message = error.get("message") if isinstance(error, dict) else error
+                    raise APIError(f"上游返回错误：{message}")
+                logger.warning("数据块中没有choices字段: %r", chunk)
+                return []
+            if not chunk["choices"]:
+                # 只携带usage的最后一个数据块
+                return []
+                
+            delta = chunk["choices"][0].get("delta", {})
+            self.chunk_count += 1
+            
+            # 每100个数据块记录一次进度
+            if self.chunk_count % 100 == 0:
+                logger.info("已处理 %d 个数据块", self.chunk_count)
+            
+            reasoning_chunk = delta.get("reasoning_content")
+            content_chunk = delta.get("content")
+            if reasoning_chunk:
+                self.native_reasoning = True
+            if not (reasoning_chunk or content_chunk):
+                return []
+            self.has_content = True
+            if self.native_reasoning:
+                # 思考过程已在独立字段中，回答里不会再有<think>标签
+                return self._content_events(reasoning_chunk or "", self._native_response(content_chunk))
+            # 增量拆分<think>标签，只输出新增部分
+            return self._content_events(*self.think_parser.feed(content_chunk))
+                
+        except APIError:
+            raise
+        except Exception as e:
+            logger.error("处理数据块时出错: %s, 原始数据: %r", str(e), data, exc_info=True)
+            return []
+
+    def finish(self):
+        """数据流结束，返回剩余事件和complete事件
+
+        被取消时complete事件包含已收到的部分内容，并带有cancelled标记。
+
+        Raises:
+            APIError: 未收到任何有效内容
+        """
+        if not self.has_content and not self.cancelled:
+            logger.error("未生成有效内容")
+            raise APIError("未能获取有效的响应内容")
+        
+        # 输出解析器中残留的未决文本
+        events = self._content_events(*self.think_parser.flush())
+        
+        thinking = self.output.text("reasoning")
+        response = self.output.text("response").strip()
+        logger.info("生成完成，思考过程长度: %d, 回答长度: %d", 
+                  len(thinking), len(response))
+        content = {
+            "reasoning": thinking if thinking else NO_REASONING,
+            "response": response
+        }
+        if self.output.truncated:
+            content["truncated"] = True
+        if self.cancelled:
+            content["cancelled"] = True
+        events.append({
+            "type": "complete",
+            "content": content,
+            "usage": normalize_usage(self.usage)
+        })
+        return events
+
 class AIModel:
-    def __init__(self, config):
+    def __init__(self, config, cache=None, client=None, state=None):
         """初始化AI模型
         
+        连接池、JSON解析器、响应缓存和性能指标由进程级共享客户端提供，
+        AIModel本身只保存会话的设置和上下文状态，创建开销可以忽略。
+        
         Args:
             config (dict): 模型配置，包含api_key、base_url、model等
+            cache (ResponseCache): 响应缓存，为None时按配置项cache_enabled使用共享缓存
+            client (AIClient): 共享客户端，默认为client.get_client()
+            state (dict): 跨请求保留的会话状态（上下文裁剪报告和前缀锚点），
+                传入会话中保存的dict可以每次运行重新创建AIModel
         """
         self.config = config.copy()
+        self.cache = cache
+        self.client = client or get_client()
+        self.state = state if state is not None else {}
         self.system_prompt = SYSTEM_PROMPT
         self.max_retries = 3  # 最大重试次数
         self.retry_delay = 2  # 重试间隔（秒）
-        logger.info("初始化AI模型，使用API地址: %s", self.config.get("base_url"))
+        logger.debug("初始化AI模型，使用API地址: %s", self.config.get("base_url"))
+
+    @property
+    def last_context_report(self):
+        """最近一次请求的上下文裁剪报告"""
+        return self.state.get("last_context_report")
 
     def update_config(self, new_config):
         """更新模型配置
@@ -60,64 +346,178 @@ class AIModel:
         self.config.update(new_config)
         logger.info("模型配置已更新")
 
-    def _make_api_request(self, url, headers, data, stream=False):
-        """发送API请求，带重试机制"""
+    def _get_transport(self, base_url=None):
+        """获取base_url（默认为配置中的地址）对应的共享HTTP传输
+
+        配置中与TRANSPORT_CONFIG同名的键（如idle_timeout）会覆盖默认值。
+        """
+        options = {k: self.config[k] for k in TRANSPORT_CONFIG if k in self.config}
+        return self.client.transport(base_url or self.config["base_url"], **options)
+
+    def _get_cache(self):
+        """获取响应缓存，未启用时返回None"""
+        if self.cache is not None:
+            return self.cache
+        if self.config.get("cache_enabled", CACHE_CONFIG["enabled"]):
+            return self.client.response_cache()
+        return None
+
+    def _cached_events(self, data):
+        """查询响应缓存
+
+        Returns:
+            tuple: (缓存键, 命中时的回放事件列表)，未启用缓存时键为None
+        """
+        cache = self._get_cache()
+        if cache is None:
+            return None, None
+        key = canonical_request_hash(data["model"], data["messages"], data["max_tokens"])
+        content = cache.get(key)
+        if content is None:
+            return key, None
+        logger.info("命中响应缓存，直接回放")
+        return key, list(cache.replay(content))
+
+    def _store_cached(self, key, event):
+        if key is None or event["type"] != "complete":
+            return
+        if not event["content"].get("truncated") and not event["content"].get("cancelled"):
+            self._get_cache().put(key, event["content"])
+
+    def _get_async_transport(self, base_url=None):
+        """获取当前事件循环中base_url对应的共享异步HTTP传输"""
+        options = {k: self.config[k] for k in TRANSPORT_CONFIG if k in self.config}
+        return self.client.async_transport(base_url or self.config["base_url"], **options)
+
+    def get_transport_stats(self):
+        """返回当前连接池的统计信息"""
+        return self._get_transport().stats()
+
+    def _make_api_request(self, url, headers, data, stream=False, cancel=None):
+        """发送API请求，带重试、退避和熔断
+        
+        参数错误、鉴权失败等4xx直接失败；连接错误、超时、5xx和429按带抖动的
+        指数退避重试（429遵守Retry-After），重试受进程级预算限制；
+        base_url熔断期间直接快速失败。cancel被取消时退避等待立即结束，
+        不再发出新的请求。
+        """
+        transport = self._get_transport()
+        breaker = get_circuit_breaker(self.config["base_url"])
+        body = encode_request_body(data)
+        retry_budget.record_request()
         for attempt in range(self.max_retries):
+            if cancel is not None and cancel.cancelled:
+                raise APIError("请求已取消")
+            if not breaker.allow():
+                raise APIError("上游服务暂时不可用（已熔断），请稍后重试")
+            response = None
             try:
-                response = requests.post(
+                response = transport.post(
                     url,
                     headers=headers,
-                    json=data,
+                    data=body,
                     stream=stream
                 )
                 response.raise_for_status()
+                breaker.record_success()
                 return response
             except requests.exceptions.RequestException as e:
-                if attempt == self.max_retries - 1:  # 最后一次重试
-                    raise APIError(f"API请求失败（已重试{self.max_retries}次）：{str(e)}")
-                logger.warning("API请求失败，%d秒后重试（%d/%d）: %s", 
-                             self.retry_delay, attempt + 1, self.max_retries, str(e))
-                time.sleep(self.retry_delay)
-
-    def _format_message_for_api(self, message):
-        """格式化消息以适应API要求"""
+                if response is not None:
+                    response.close()
+                if cancel is not None and cancel.cancelled:
+                    breaker.release()
+                    raise APIError("请求已取消")
+                delay = self._retry_delay_for(e, breaker, attempt)
+                logger.warning("API请求失败，%.1f秒后重试（%d/%d）: %s", 
+                             delay, attempt + 1, self.max_retries, str(e))
+                if cancel is None:
+                    time.sleep(delay)
+                elif cancel.wait(delay):
+                    raise APIError("请求已取消")
+
+    def _retry_delay_for(self, error, breaker, attempt):
+        """判断失败的请求能否重试，返回退避时间；不能重试时抛出APIError"""
+        kind, status, retry_after = classify_error(error)
+        if kind == FATAL:
+            # 上游可达，只是请求本身有问题
+            breaker.record_success()
+            raise APIError(f"API请求失败：{str(error) or type(error).__name__}")
+        if kind == RETRYABLE:
+            breaker.record_failure()
+            if breaker.state == breaker.OPEN:
+                raise APIError("上游服务暂时不可用（已熔断），请稍后重试")
+        else:
+            # 被限流不说明上游是否恢复，结束试探请求但不改变熔断状态
+            breaker.release()
+        if attempt == self.max_retries - 1:  # 最后一次重试
+            raise APIError(f"API请求失败（已重试{self.max_retries}次）：{str(error) or type(error).__name__}")
+        if not retry_budget.try_acquire():
+            raise APIError(f"API请求失败（重试预算已用尽）：{str(error) or type(error).__name__}")
+        return backoff_delay(attempt, retry_after)
+
+    def _round_retry_delay(self, last_error, retryable, retry_after, attempt):
+        """所有端点都在首个数据前失败后，判断能否再试一轮，返回退避时间；不能重试时抛出APIError
+
+        与_make_api_request的重试共用次数上限、进程级重试预算和带抖动的指数退避。
+
+        Args:
+            last_error (Exception): 最后一个端点的错误
+            retryable (bool): 本轮是否有可重试的失败（连接错误、超时、5xx、429）
+            retry_after (float): 本轮429响应中最短的Retry-After
+            attempt (int): 本轮的序号（从0开始）
+        """
+        reason = str(last_error) or type(last_error).__name__
+        if not retryable:
+            raise APIError(f"所有端点均不可用：{reason}")
+        if attempt == self.max_retries - 1:
+            raise APIError(f"所有端点均不可用（已重试{self.max_retries}轮）：{reason}")
+        if not retry_budget.try_acquire():
+            raise APIError(f"所有端点均不可用（重试预算已用尽）：{reason}")
+        return backoff_delay(attempt, retry_after)
+
+    def get_metrics(self):
+        """返回按模型和端点聚合的流式请求性能指标，见metrics.MetricsRegistry.snapshot"""
+        return self.client.metrics.snapshot()
+
+    def get_resilience_stats(self):
+        """返回重试预算和熔断器状态"""
+        return get_resilience_stats()
+
+    def get_hedge_stats(self):
+        """返回各模型的对冲次数、对冲率和胜出方统计"""
+        return get_hedge_stats()
+
+    def _format_message_for_api(self, message, include_reasoning=False):
+        """格式化消息以适应API要求
+        
+        思考过程与回答分开保存，发送时回答作为content，思考过程（如需发送）
+        原样放在reasoning_content字段，不与回答拼接。
+        
+        Args:
+            message (dict): 历史消息
+            include_reasoning (bool): 助手回复是否带上思考过程
+        """
         if isinstance(message["content"], dict):
-            # 如果是助手的回复，合并思考过程和回答
             content = message["content"]
-            formatted_content = ""
-            if content.get("reasoning"):
-                formatted_content += f"思考过程：\n{content['reasoning']}\n\n"
-            if content.get("response"):
-                formatted_content += f"回答：\n{content['response']}"
-            return {
+            formatted = {
                 "role": message["role"],
-                "content": formatted_content.strip()
+                "content": content.get("response", "")
             }
+            reasoning = content.get("reasoning")
+            if include_reasoning and reasoning and reasoning != NO_REASONING:
+                formatted["reasoning_content"] = reasoning
+            return formatted
         else:
             # 用户消息直接返回
             return message
 
-    def generate_response_stream(self, user_input, chat_history=None):
-        if chat_history is None:
-            chat_history = []
-        
-        # 检查API配置
-        if not self.config.get("api_key"):
-            logger.error("未设置API Key")
-            yield {
-                "type": "error",
-                "content": {
-                    "reasoning": "API Key未设置",
-                    "response": "请先设置API Key"
-                }
-            }
-            return
-        
+    def _prepare_request(self, user_input, chat_history, messages=None):
+        """构建API请求的地址、请求头和请求体，提供messages时原样使用"""
         # 构建消息历史
-        messages = self._build_messages(chat_history, user_input)
+        if messages is None:
+            messages = self._build_messages(chat_history, user_input)
         logger.info("开始生成回答，输入长度: %d", len(str(messages)))
         
-        # 调用API
         headers = {
             "Authorization": f"Bearer {self.config['api_key']}",
             "Content-Type": "application/json"
@@ -129,157 +529,572 @@ class AIModel:
             "max_tokens": self.config.get("max_tokens", 8192),
             "stream": True  # 启用流式输出
         }
+        if self.config.get("include_usage", STREAM_CONFIG["include_usage"]):
+            data["stream_options"] = {"include_usage": True}
+        return f"{self.config['base_url']}/chat/completions", headers, data
+
+    @staticmethod
+    def _missing_key_event():
+        logger.error("未设置API Key")
+        return {
+            "type": "error",
+            "content": {
+                "reasoning": "API Key未设置",
+                "response": "请先设置API Key"
+            }
+        }
+
+    @staticmethod
+    def _cancelled_event():
+        """连接建立前就被取消时的complete事件"""
+        return {
+            "type": "complete",
+            "content": {"reasoning": NO_REASONING, "response": "", "cancelled": True},
+            "usage": None
+        }
+
+    @staticmethod
+    def _error_event(error):
+        """将异常转换为error事件"""
+        if isinstance(error, APIError):
+            error_msg = str(error)
+            logger.error(error_msg)
+            return {
+                "type": "error",
+                "content": {
+                    "reasoning": error_msg,
+                    "response": f"抱歉，{error_msg}"
+                }
+            }
+        error_msg = f"API调用出错：{str(error)}"
+        logger.error(error_msg, exc_info=error)
+        return {
+            "type": "error",
+            "content": {
+                "reasoning": error_msg,
+                "response": f"抱歉，发生了错误：{str(error)}"
+            }
+        }
+
+    def _create_stream_parser(self):
+        json_backend = self.config.get("json_backend", STREAM_CONFIG["json_backend"])
+        return StreamResponseParser(
+            self.max_retries,
+            self.retry_delay,
+            json_backend,
+            self.config.get("max_turn_bytes", OUTPUT_CONFIG["max_turn_bytes"]),
+            self.client.json_loads(json_backend)
+        )
+
+    def _get_endpoint_pool(self):
+        """获取多端点路由池，未配置额外端点时返回None
+
+        侧边栏设置的base_url和api_key作为名为primary的端点，服务所有模型。
+        """
+        endpoints = self.config.get("endpoints", ENDPOINTS)
+        if not endpoints:
+            return None
+        primary = {
+            "name": "primary",
+            "base_url": self.config["base_url"],
+            "api_key": self.config.get("api_key"),
+        }
+        return get_endpoint_pool([primary] + list(endpoints))
+
+    def get_routing_stats(self):
+        """返回各端点的健康状态，未配置多端点时返回空列表"""
+        pool = self._get_endpoint_pool()
+        return pool.stats() if pool is not None else []
+
+    def _iter_stream_events(self, transport, response, span=None, cancel=None):
+        """读取流式响应，产生reasoning/response/complete事件
+
+        cancel被取消后（连接已由取消回调断开）停止读取，以部分结果结束。
+        """
+        parser = self._create_stream_parser()
+        decoder = SSEDecoder()
+        chunks = transport.iter_content(response)
+        try:
+            for chunk in chunks:
+                if cancel is not None and cancel.cancelled:
+                    break
+                if span is not None:
+                    span.chunk()
+                for event in decoder.feed(chunk):
+                    yield from parser.process_event(event)
+                    if parser.done:
+                        break
+                if parser.done:
+                    break
+            else:
+                for event in decoder.flush():
+                    yield from parser.process_event(event)
+        except Exception:
+            if cancel is None or not cancel.cancelled:
+                raise
+        finally:
+            chunks.close()
+        
+        if cancel is not None and cancel.cancelled and not parser.done:
+            logger.info("生成已取消")
+            parser.cancelled = True
         
+        if span is not None:
+            span.usage = parser.usage
+        # 返回完整的响应
+        yield from parser.finish()
+
+    async def _aiter_stream_events(self, transport, response, span=None):
+        """异步读取流式响应，产生reasoning/response/complete事件"""
+        parser = self._create_stream_parser()
+        decoder = SSEDecoder()
+        chunks = transport.iter_content(response)
         try:
-            logger.info("正在调用API生成回答...")
-            response = self._make_api_request(
-                f"{self.config['base_url']}/chat/completions",
-                headers=headers,
-                data=data,
-                stream=True
-            )
+            async for chunk in chunks:
+                if span is not None:
+                    span.chunk()
+                for sse_event in decoder.feed(chunk):
+                    for event in parser.process_event(sse_event):
+                        yield event
+                    if parser.done:
+                        break
+                if parser.done:
+                    break
+            else:
+                for sse_event in decoder.flush():
+                    for event in parser.process_event(sse_event):
+                        yield event
+        finally:
+            if not parser.done:
+                # 调用方提前关闭时上游仍在生成，直接断开，不尝试读完剩余数据
+                response.close()
+            await chunks.aclose()
+        
+        if span is not None:
+            span.usage = parser.usage
+        for event in parser.finish():
+            yield event
+
+    @staticmethod
+    def _watch_cancel(cancel, transport, response):
+        """令牌取消时断开response的连接，返回登记的回调"""
+        if cancel is None:
+            return None
+        abort = lambda: transport.abort(response)
+        cancel.register(abort)
+        return abort
+
+    @staticmethod
+    def _ordered_candidates(pool, model, avoid=None):
+        """按尝试顺序返回端点，对冲请求把主请求正在使用的端点avoid排到最后"""
+        candidates = pool.candidates(model)
+        if avoid is not None:
+            candidates.sort(key=lambda endpoint: endpoint.name == avoid)
+        return candidates
+
+    def _open_stream(self, url, headers, data, span, cancel=None, avoid=None):
+        """打开上游流式响应
+
+        配置了多端点时按健康度依次尝试，在收到首个事件之前失败会
+        直接切换到下一个端点，用户看不到这次失败。所有端点都失败时按与
+        _make_api_request相同的重试次数、重试预算和退避再试一轮。cancel被取消时
+        立即断开连接，不计入端点和熔断器的失败。
+        """
+        pool = self._get_endpoint_pool()
+        if pool is None:
+            transport = self._get_transport()
+            span.begin_attempt()
+            response = self._make_api_request(url, headers=headers, data=data, stream=True, cancel=cancel)
+            span.mark("headers")
             logger.info("API连接成功，开始接收数据流")
+            abort = self._watch_cancel(cancel, transport, response)
+            try:
+                yield from self._iter_stream_events(transport, response, span, cancel)
+            finally:
+                if abort is not None:
+                    cancel.unregister(abort)
+            return
+        
+        retry_budget.record_request()
+        last_error = None
+        for attempt in range(self.max_retries):
+            retryable, round_retry_after = False, None
+            for endpoint in self._ordered_candidates(pool, data["model"], avoid):
+                breaker = get_circuit_breaker(endpoint.base_url)
+                if not breaker.allow():
+                    last_error = APIError(f"端点{endpoint.name}已熔断")
+                    continue
+                transport = self._get_transport(endpoint.base_url)
+                start = time.monotonic()
+                span.begin_attempt(endpoint.name)
+                response = events = abort = None
+                try:
+                    response = transport.post(
+                        endpoint.url,
+                        headers=endpoint.headers(),
+                        data=encode_request_body({**data, "model": endpoint.model_for(data["model"])}),
+                        stream=True
+                    )
+                    response.raise_for_status()
+                    span.mark("headers")
+                    abort = self._watch_cancel(cancel, transport, response)
+                    events = self._iter_stream_events(transport, response, span, cancel)
+                    first_event = next(events)
+                except Exception as e:
+                    if events is not None:
+                        events.close()
+                    elif response is not None:
+                        response.close()
+                    if abort is not None:
+                        cancel.unregister(abort)
+                    if cancel is not None and cancel.cancelled:
+                        breaker.release()
+                        raise
+                    kind, status, retry_after = classify_error(e)
+                    if status == 400:
+                        # 请求本身有误，换端点也无济于事
+                        breaker.record_success()
+                        raise APIError(f"API请求失败：{str(e)}")
+                    if kind == RETRYABLE:
+                        breaker.record_failure()
+                    else:
+                        breaker.release()
+                    if kind != FATAL:
+                        retryable = True
+                        if retry_after is not None:
+                            round_retry_after = min(retry_after, round_retry_after or retry_after)
+                    pool.record_failure(endpoint, status, retry_after)
+                    logger.warning("端点%s在首个数据前失败，切换下一个端点: %s", endpoint.name, str(e))
+                    last_error = e
+                    continue
+                
+                if cancel is None or not cancel.cancelled:
+                    breaker.record_success()
+                    pool.record_success(endpoint, time.monotonic() - start)
+                else:
+                    # 首个数据前被取消，得到的是部分结果，不能说明上游已恢复
+                    breaker.release()
+                logger.info("端点%s连接成功，开始接收数据流", endpoint.name)
+                try:
+                    yield first_event
+                    yield from events
+                except Exception as e:
+                    if cancel is None or not cancel.cancelled:
+                        pool.record_failure(endpoint, *error_status(e))
+                    raise
+                finally:
+                    if abort is not None:
+                        cancel.unregister(abort)
+                return
             
-            # 用于累积思考过程和最终回答
-            reasoning_content = ""
-            final_content = ""
-            chunk_count = 0
-            last_error_time = 0  # 上次错误时间
-            error_count = 0  # 连续错误计数
-            
-            for line in response.iter_lines():
-                if not line:
+            # 所有端点都失败：与单端点相同，受预算限制地退避后再试一轮
+            delay = self._round_retry_delay(last_error, retryable, round_retry_after, attempt)
+            logger.warning("所有端点均在首个数据前失败，%.1f秒后重试（%d/%d）", delay, attempt + 1, self.max_retries)
+            if cancel is None:
+                time.sleep(delay)
+            elif cancel.wait(delay):
+                raise APIError("请求已取消")
+
+    async def _aopen_stream(self, url, headers, data, span, avoid=None):
+        """_open_stream的asyncio版本，取消所在任务即可断开连接"""
+        pool = self._get_endpoint_pool()
+        if pool is None:
+            transport = self._get_async_transport()
+            span.begin_attempt()
+            response = await self._amake_api_request(transport, url, headers, data)
+            span.mark("headers")
+            logger.info("API连接成功，开始接收数据流")
+            events = self._aiter_stream_events(transport, response, span)
+            try:
+                async for event in events:
+                    yield event
+            finally:
+                await events.aclose()
+            return
+        
+        retry_budget.record_request()
+        last_error = None
+        for attempt in range(self.max_retries):
+            retryable, round_retry_after = False, None
+            for endpoint in self._ordered_candidates(pool, data["model"], avoid):
+                breaker = get_circuit_breaker(endpoint.base_url)
+                if not breaker.allow():
+                    last_error = APIError(f"端点{endpoint.name}已熔断")
                     continue
-                    
+                transport = self._get_async_transport(endpoint.base_url)
+                start = time.monotonic()
+                span.begin_attempt(endpoint.name)
+                events = None
                 try:
-                    # 移除 "data: " 前缀并解析JSON
-                    line = line.decode('utf-8')
-                    # 打印原始数据
-                    logger.debug("原始数据行: %r", line)
-                    
-                    if line.startswith("data: "):
-                        line = line[6:]
-                        logger.debug("处理后的数据: %r", line)
-                    if line == "[DONE]":
-                        logger.info("数据流接收完成")
-                        break
-                    
-                    # 尝试解析前先检查数据是否为空
-                    if not line.strip():
-                        logger.warning("收到空数据行")
-                        continue
-                        
-                    try:
-                        chunk = json.loads(line)
-                        error_count = 0  # 重置错误计数
-                    except json.JSONDecodeError as e:
-                        current_time = time.time()
-                        if current_time - last_error_time > self.retry_delay:
-                            error_count = 1
-                        else:
-                            error_count += 1
-                            
-                        last_error_time = current_time
-                        
-                        if error_count >= self.max_retries:
-                            logger.error("连续JSON解析错误达到最大重试次数")
-                            raise APIError("数据解析失败，请稍后重试")
-                            
-                        logger.warning("JSON解析错误（%d/%d）: %s, 原始数据: %r", 
-                                     error_count, self.max_retries, str(e), line)
-                        continue
-                        
-                    if "choices" not in chunk:
-                        logger.warning("数据块中没有choices字段: %r", chunk)
-                        continue
-                        
-                    delta = chunk["choices"][0].get("delta", {})
-                    chunk_count += 1
-                    
-                    # 每100个数据块记录一次进度
-                    if chunk_count % 100 == 0:
-                        logger.info("已处理 %d 个数据块", chunk_count)
-                    
-                    # 检查是否有content
-                    content_chunk = delta.get("content", "")
-                    if content_chunk:
-                        final_content += content_chunk
-                        # 检查是否包含<think>标签
-                        thinking, response = extract_think_content(final_content)
-                        if thinking:
-                            # 更新思考内容
-                            yield {
-                                "type": "reasoning",
-                                "content": thinking
-                            }
-                            # 更新回答内容
-                            yield {
-                                "type": "response",
-                                "content": response
-                            }
-                        else:
-                            # 没有<think>标签，直接作为回答内容
-                            yield {
-                                "type": "response",
-                                "content": content_chunk
-                            }
-                        
+                    response = await transport.post(
+                        endpoint.url,
+                        headers=endpoint.headers(),
+                        data=encode_request_body({**data, "model": endpoint.model_for(data["model"])})
+                    )
+                    span.mark("headers")
+                    events = self._aiter_stream_events(transport, response, span)
+                    first_event = await events.__anext__()
+                except asyncio.CancelledError:
+                    breaker.release()
+                    raise
                 except Exception as e:
-                    logger.error("处理数据块时出错: %s, 原始数据: %r", str(e), line, exc_info=True)
+                    if events is not None:
+                        await events.aclose()
+                    kind, status, retry_after = classify_error(e)
+                    if status == 400:
+                        breaker.record_success()
+                        raise APIError(f"API请求失败：{str(e)}")
+                    if kind == RETRYABLE:
+                        breaker.record_failure()
+                    else:
+                        breaker.release()
+                    if kind != FATAL:
+                        retryable = True
+                        if retry_after is not None:
+                            round_retry_after = min(retry_after, round_retry_after or retry_after)
+                    pool.record_failure(endpoint, status, retry_after)
+                    logger.warning("端点%s在首个数据前失败，切换下一个端点: %s", endpoint.name, str(e))
+                    last_error = e
                     continue
+                
+                breaker.record_success()
+                pool.record_success(endpoint, time.monotonic() - start)
+                logger.info("端点%s连接成功，开始接收数据流", endpoint.name)
+                try:
+                    yield first_event
+                    async for event in events:
+                        yield event
+                except Exception as e:
+                    pool.record_failure(endpoint, *error_status(e))
+                    raise
+                finally:
+                    await events.aclose()
+                return
             
-            # 返回完整的响应
-            if final_content:
-                # 最后再次检查是否有<think>标签
-                thinking, response = extract_think_content(final_content)
-                logger.info("生成完成，思考过程长度: %d, 回答长度: %d", 
-                          len(thinking) if thinking else 0, len(response))
-                yield {
-                    "type": "complete",
-                    "content": {
-                        "reasoning": thinking if thinking else "未提供思考过程",
-                        "response": response
-                    }
-                }
-            else:
-                logger.error("未生成有效内容")
-                raise APIError("未能获取有效的响应内容")
+            delay = self._round_retry_delay(last_error, retryable, round_retry_after, attempt)
+            logger.warning("所有端点均在首个数据前失败，%.1f秒后重试（%d/%d）", delay, attempt + 1, self.max_retries)
+            await asyncio.sleep(delay)
+
+    def generate_response_stream(self, user_input, chat_history=None, cancel=None, messages=None):
+        """生成回答，产生reasoning/response/complete/error事件
+
+        Args:
+            user_input (str): 用户输入
+            chat_history (list): 历史消息
+            cancel (CancelToken): 取消令牌，可在其他线程取消。取消后立即断开上游
+                连接，以带cancelled标记、包含已收到内容的complete事件结束
+            messages (list): 已构建好的API消息列表。提供时原样发送，不加系统提示词、
+                不裁剪，忽略user_input和chat_history
+        """
+        if chat_history is None:
+            chat_history = []
+        
+        # 检查API配置
+        if not self.config.get("api_key"):
+            yield self._missing_key_event()
+            return
+        
+        span = self.client.metrics.start_span(self.config["model"], self.config["base_url"])
+        url, headers, data = self._prepare_request(user_input, chat_history, messages)
+        
+        cache_key, cached = self._cached_events(data)
+        if cached:
+            yield from cached
+            return
+        
+        if self.config.get("hedge_enabled", HEDGE_CONFIG["enabled"]):
+            upstream = lambda token: self._hedged_events(url, headers, data, cache_key, span, token)
+        else:
+            upstream = lambda token: self._upstream_events(url, headers, data, cache_key, span, token)
+        if self.config.get("coalesce_enabled", COALESCE_CONFIG["enabled"]):
+            events = self.client.coalescer.stream(self._coalesce_key(data), upstream, cancel)
+        else:
+            events = upstream(cancel)
+        try:
+            yield from events
+        finally:
+            events.close()
+
+    def _coalesce_key(self, data):
+        """请求合并的键：请求体的哈希，加上地址和API Key，不同账号的请求不会合并
+
+        请求体由缓存的消息片段拼接而成，计算哈希不需要重新序列化整个历史。
+        """
+        identity = f"{self.config['base_url']}\n{self.config['api_key']}\n".encode("utf-8")
+        return hashlib.sha256(identity + encode_request_body(data)).hexdigest()
+
+    def _hedge_request(self, data):
+        """对冲请求的请求体：模型换成备用模型（未配置时不变）"""
+        model = self.config.get("hedge_model", HEDGE_CONFIG["backup_model"]) or data["model"]
+        return {**data, "model": model}
+
+    def _hedged_events(self, url, headers, data, cache_key, span, cancel=None):
+        """对冲地请求上游，见hedge.race_streams
+
+        备用请求单独记录性能指标；换了模型时其结果不写入主请求的缓存。
+        """
+        backup_data = self._hedge_request(data)
+        backup_cache_key = cache_key if backup_data["model"] == data["model"] else None
+        return race_streams(
+            lambda cancel: self._upstream_events(url, headers, data, cache_key, span, cancel),
+            lambda cancel: self._upstream_events(
+                url, headers, backup_data, backup_cache_key,
+                self.client.metrics.start_span(backup_data["model"], self.config["base_url"]),
+                cancel, avoid=span.endpoint
+            ),
+            get_hedge_policy(data["model"]),
+            cancel
+        )
+
+    def _upstream_events(self, url, headers, data, cache_key, span, cancel=None, avoid=None):
+        """请求上游并产生事件，出错时以error事件结束，结束后记录性能指标
+
+        cancel被取消后以部分结果的complete事件结束，连接断开引起的错误不会报告。
+        """
+        status, content = "cancelled", None
+        try:
+            logger.info("正在调用API生成回答...")
+            events = self._open_stream(url, headers, data, span, cancel, avoid)
+            try:
+                for event in events:
+                    span.event(event)
+                    if event["type"] == "complete" and not event["content"].get("cancelled"):
+                        status, content = "complete", event["content"]
+                    self._store_cached(cache_key, event)
+                    yield event
+            finally:
+                events.close()
             
-        except APIError as e:
-            error_msg = str(e)
-            logger.error(error_msg)
-            yield {
-                "type": "error",
-                "content": {
-                    "reasoning": error_msg,
-                    "response": f"抱歉，{error_msg}"
-                }
-            }
         except Exception as e:
-            error_msg = f"API调用出错：{str(e)}"
-            logger.error(error_msg, exc_info=True)
-            yield {
-                "type": "error",
-                "content": {
-                    "reasoning": error_msg,
-                    "response": f"抱歉，发生了错误：{str(e)}"
-                }
-            }
+            if cancel is not None and cancel.cancelled:
+                yield self._cancelled_event()
+                return
+            status = "error"
+            yield self._error_event(e)
+        finally:
+            span.finish(status, content)
+            self.client.metrics.record(span)
 
-    def _build_messages(self, chat_history, user_input):
-        """构建完整的消息历史"""
-        messages = [{"role": "system", "content": self.system_prompt}]
+    async def _amake_api_request(self, transport, url, headers, data):
+        """异步发送API请求，重试策略与_make_api_request相同"""
+        import aiohttp
+        
+        breaker = get_circuit_breaker(transport.base_url)
+        body = encode_request_body(data)
+        retry_budget.record_request()
+        for attempt in range(self.max_retries):
+            if not breaker.allow():
+                raise APIError("上游服务暂时不可用（已熔断），请稍后重试")
+            try:
+                response = await transport.post(url, headers=headers, data=body)
+                breaker.record_success()
+                return response
+            except asyncio.CancelledError:
+                breaker.release()
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                delay = self._retry_delay_for(e, breaker, attempt)
+                logger.warning("API请求失败，%.1f秒后重试（%d/%d）: %s", 
+                             delay, attempt + 1, self.max_retries, str(e))
+                await asyncio.sleep(delay)
+
+    async def agenerate_response_stream(self, user_input, chat_history=None, messages=None):
+        """generate_response_stream的asyncio版本
+
+        产生相同的reasoning/response/complete/error事件。只有在调用方取走
+        上一个事件后才会继续读取socket，消费变慢时由TCP流控对上游形成背压；
+        取消所在任务或调用aclose()会立即关闭上游连接。
+
+        Args:
+            user_input (str): 用户输入
+            chat_history (list): 历史消息
+            messages (list): 已构建好的API消息列表，见generate_response_stream
+        """
+        if chat_history is None:
+            chat_history = []
+        
+        if not self.config.get("api_key"):
+            yield self._missing_key_event()
+            return
+        
+        span = self.client.metrics.start_span(self.config["model"], self.config["base_url"])
+        url, headers, data = self._prepare_request(user_input, chat_history, messages)
         
-        # 添加历史对话
-        for msg in chat_history:
-            formatted_msg = self._format_message_for_api(msg)
-            messages.append(formatted_msg)
+        cache_key, cached = self._cached_events(data)
+        if cached:
+            for event in cached:
+                yield event
+            return
         
-        # 添加当前用户输入
-        messages.append({"role": "user", "content": user_input})
+        if self.config.get("hedge_enabled", HEDGE_CONFIG["enabled"]):
+            events = self._ahedged_events(url, headers, data, cache_key, span)
+        else:
+            events = self._aupstream_events(url, headers, data, cache_key, span)
+        try:
+            async for event in events:
+                yield event
+        finally:
+            await events.aclose()
+
+    def _ahedged_events(self, url, headers, data, cache_key, span):
+        """_hedged_events的asyncio版本，见hedge.arace_streams"""
+        backup_data = self._hedge_request(data)
+        backup_cache_key = cache_key if backup_data["model"] == data["model"] else None
+        return arace_streams(
+            lambda: self._aupstream_events(url, headers, data, cache_key, span),
+            lambda: self._aupstream_events(
+                url, headers, backup_data, backup_cache_key,
+                self.client.metrics.start_span(backup_data["model"], self.config["base_url"]),
+                avoid=span.endpoint
+            ),
+            get_hedge_policy(data["model"])
+        )
+
+    async def _aupstream_events(self, url, headers, data, cache_key, span, avoid=None):
+        """_upstream_events的asyncio版本"""
+        status, content = "cancelled", None
+        try:
+            logger.info("正在调用API生成回答...")
+            events = self._aopen_stream(url, headers, data, span, avoid)
+            try:
+                async for event in events:
+                    span.event(event)
+                    if event["type"] == "complete":
+                        status, content = "complete", event["content"]
+                    self._store_cached(cache_key, event)
+                    yield event
+            finally:
+                await events.aclose()
+            
+        except Exception as e:
+            status = "error"
+            yield self._error_event(e)
+        finally:
+            span.finish(status, content)
+            self.client.metrics.record(span)
+
+    def _build_messages(self, chat_history, user_input):
+        """构建完整的消息历史，按模型的token预算裁剪历史消息"""
+        manager = ContextManager(
+            self._format_message_for_api,
+            policy=self.config.get("context_policy"),
+            send_reasoning=self.config.get("send_reasoning")
+        )
+        window = get_context_window(self.config.get("model"), self.config)
+        budget = manager.budget(window, self.config.get("max_tokens", 8192))
+        messages, report = manager.build(
+            self.system_prompt, chat_history, user_input, budget, anchor=self.state.get("context_anchor")
+        )
+        self.state["context_anchor"] = manager.anchor
+        self.state["last_context_report"] = report
+        if report["dropped_messages"] > 0:
+            logger.info("上下文已裁剪（策略: %s），预计输入%d tokens，裁剪%d tokens，丢弃%d条消息", 
+                      report["policy"], report["input_tokens"], 
+                      report["trimmed_tokens"], report["dropped_messages"])
         
         # 记录完整的消息历史用于调试
-        logger.debug("完整的消息历史: %s", json.dumps(messages, ensure_ascii=False))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("完整的消息历史: %s", json.dumps(messages, ensure_ascii=False))
         
         return messages
 